@@ -76,3 +76,22 @@ AGGREGATION_SQL = {
     Aggregation.SUM.value: 'sum(n.value)',
     Aggregation.COUNT.value: 'count(n.value)'
 }
+
+# Groups over the continuous aggregates of iot_libs.const.timescale.NUMERIC_SCALAR_ROLLUPS
+ROLLUP_GROUPING_SQL = {grouping: sql.replace('n.timestamp', 'n.bucket') for grouping, sql in GROUPING_SQL.items()}
+
+ROLLUP_AGGREGATION_SQL = {
+    Aggregation.MIN.value: 'min(n.min_value)',
+    Aggregation.MAX.value: 'max(n.max_value)',
+    Aggregation.AVG.value: '(sum(n.sum_value) / nullif(sum(n.value_count), 0))::double precision',
+    Aggregation.SUM.value: 'sum(n.sum_value)',
+    Aggregation.COUNT.value: 'sum(n.value_count)::bigint'
+}
+
+GROUPING_SECONDS = {
+    Grouping.SECOND.value: 1,
+    Grouping.MINUTE.value: 60,
+    Grouping.HOURLY.value: 3600,
+    Grouping.DAILY.value: 86400,
+    Grouping.WEEKLY.value: 604800
+}
@@ -1,7 +1,13 @@
+import numpy as np
 import pandas as pd
+from datetime import datetime
+from iot_libs.proto.batch import unpack_samples
+from typing import AsyncIterable, Callable
 # local
-from analytics_api.graphql.types.metrics import MetricsBase, Value, MetricsModel
+from analytics_api.graphql.enums import Aggregation
+from analytics_api.graphql.types.metrics import MetricsArray, MetricsBase, Value, MetricsModel, Window
 from analytics_api.graphql.types.ml import ModelResult
+from analytics_api.utils.timezone import convert_to_local_time
 
 
 def format_base_metrics(df: pd.DataFrame) -> list[MetricsBase]:
@@ -15,6 +21,120 @@ def format_base_metrics(df: pd.DataFrame) -> list[MetricsBase]:
   return metrics_list
 
 
+async def format_base_metrics_chunks(chunks: AsyncIterable[pd.DataFrame],
+                                     prepare: Callable[[pd.DataFrame], pd.DataFrame] = None) -> list[MetricsBase]:
+  ''' Format the metrics chunk by chunk, so that only one chunk of the query result is held as DataFrame. '''
+  metrics: dict[tuple[str, str], MetricsBase] = {}
+  async for df in chunks:
+    if df.empty:
+      continue
+    if prepare is not None:
+      df = prepare(df)
+    for (device_id, metric_id), group in df.groupby(['device_identifier', 'metric_identifier'], sort=False):
+      metric = metrics.get((device_id, metric_id))
+      if metric is None:
+        metric = metrics[(device_id, metric_id)] = MetricsBase(device_identifier=device_id,
+                                                               metric_identifier=metric_id,
+                                                               unit=group['unit'].iloc[0],
+                                                               values=[])
+      metric.values.extend(
+          Value(value=value, timestamp_local=timestamp.isoformat())
+          for value, timestamp in zip(group['value'].tolist(), group['timestamp_local']))
+  return [metrics[key] for key in sorted(metrics)]
+
+
+async def format_array_windows_chunks(chunks: AsyncIterable[pd.DataFrame],
+                                      prepare: Callable[[pd.DataFrame], pd.DataFrame] = None) -> list[MetricsArray]:
+  ''' Format the windows chunk by chunk with the samples of every window as list of values. '''
+  metrics: dict[tuple[str, str], MetricsArray] = {}
+  async for df in chunks:
+    if df.empty:
+      continue
+    if prepare is not None:
+      df = prepare(df)
+    for row in df.itertuples(index=False):
+      metric = metrics.get((row.device_identifier, row.metric_identifier))
+      if metric is None:
+        metric = metrics[(row.device_identifier, row.metric_identifier)] = MetricsArray(
+            device_identifier=row.device_identifier, metric_identifier=row.metric_identifier, unit=row.unit, windows=[])
+      metric.windows.append(
+          Window(start_local=row.timestamp_local.isoformat(),
+                 sample_rate=row.sample_rate,
+                 values=unpack_samples(row.samples).tolist()))
+  return [metrics[key] for key in sorted(metrics)]
+
+
+def epoch_us(timestamp: pd.Series | datetime) -> np.ndarray | int:
+  ''' Microseconds since the unix epoch of naive utc timestamps. '''
+  if isinstance(timestamp, datetime):
+    return int((timestamp - datetime(1970, 1, 1)).total_seconds() * 1000000)
+  return pd.to_datetime(timestamp).to_numpy(dtype='datetime64[us]').astype(np.int64)
+
+
+class SeriesDecimator:
+  ''' Aggregate the samples of the windows into max_points buckets of equal duration between start and end, so that a
+      waveform of any range is returned as series of at most max_points values. The windows are added chunk by chunk,
+      only the buckets are kept.
+  '''
+
+  def __init__(self, start: datetime, end: datetime, max_points: int):
+    if max_points < 1:
+      raise ValueError('max_points has to be positive.')
+    self.start_us = epoch_us(start)
+    self.bucket_us = max(-(-(epoch_us(end) - self.start_us) // max_points), 1)
+    self.max_points = max_points
+    self.units: dict[tuple[str, str], str] = {}
+    self.buckets: dict[tuple[str, str], dict[str, np.ndarray]] = {}
+
+  def add(self, df: pd.DataFrame):
+    for (device_id, metric_id), group in df.groupby(['device_identifier', 'metric_identifier'], sort=False):
+      samples = [unpack_samples(samples) for samples in group['samples']]
+      counts = np.array([len(values) for values in samples])
+      values = np.concatenate(samples).astype(np.float64)
+      # the timestamp of every sample is the start of its window plus its offset at the sample rate
+      offsets = np.arange(len(values)) - np.repeat(np.cumsum(counts) - counts, counts)
+      timestamps = np.repeat(epoch_us(group['timestamp']), counts) + (
+          offsets * 1000000 / np.repeat(group['sample_rate'].to_numpy(dtype=np.float64), counts)).astype(np.int64)
+      index = (timestamps - self.start_us) // self.bucket_us
+      inside = (index >= 0) & (index < self.max_points)
+      index, values = index[inside], values[inside]
+      buckets = self.buckets.get((device_id, metric_id))
+      if buckets is None:
+        self.units[(device_id, metric_id)] = group['unit'].iloc[0]
+        buckets = self.buckets[(device_id, metric_id)] = {
+            'sum': np.zeros(self.max_points),
+            'count': np.zeros(self.max_points, dtype=np.int64),
+            'min': np.full(self.max_points, np.inf),
+            'max': np.full(self.max_points, -np.inf)
+        }
+      buckets['sum'] += np.bincount(index, weights=values, minlength=self.max_points)
+      buckets['count'] += np.bincount(index, minlength=self.max_points)
+      np.minimum.at(buckets['min'], index, values)
+      np.maximum.at(buckets['max'], index, values)
+
+  def metrics(self, timezone: str, aggregation: Aggregation = Aggregation.AVG) -> list[MetricsBase]:
+    ''' One value per bucket with samples, with the local start of the bucket as timestamp. '''
+    metrics = []
+    for key in sorted(self.buckets):
+      buckets = self.buckets[key]
+      filled = np.flatnonzero(buckets['count'])
+      if aggregation == Aggregation.AVG:
+        values = buckets['sum'][filled] / buckets['count'][filled]
+      else:
+        values = buckets[aggregation.value][filled]
+      timestamps = (self.start_us + filled * self.bucket_us).astype('datetime64[us]')
+      timestamps_local = convert_to_local_time(timestamp=pd.Series(timestamps), timezone=timezone)
+      metrics.append(
+          MetricsBase(device_identifier=key[0],
+                      metric_identifier=key[1],
+                      unit=self.units[key],
+                      values=[
+                          Value(value=value, timestamp_local=timestamp.isoformat())
+                          for value, timestamp in zip(values.tolist(), timestamps_local)
+                      ]))
+    return metrics
+
+
 def format_model_metrics(df: pd.DataFrame, model_metrics: set, model_result: ModelResult) -> list[MetricsModel]:
   model_metrics = model_metrics or set()
   grouped = df.groupby(['device_identifier', 'metric_identifier'])
@@ -1,30 +1,43 @@
+import asyncio
 import strawberry
 import math
+import pandas as pd
 from strawberry.fastapi import GraphQLRouter
 # local
-from analytics_api.graphql.types.metrics import NumericScalarInput, NumericScalarModelInput, MetricsBase, MetricsModel
+from analytics_api.graphql.types.metrics import (NumericArrayInput, NumericArraySeriesInput, NumericScalarInput,
+                                                 NumericScalarModelInput, MetricsArray, MetricsBase, MetricsModel)
 from analytics_api.graphql.types.devices import Device
 from analytics_api.graphql.types.common import TenantInput
-from analytics_api.graphql.formatters.metrics_formatter import format_base_metrics, format_model_metrics
+from analytics_api.graphql.formatters.metrics_formatter import (SeriesDecimator, format_array_windows_chunks,
+                                                                format_base_metrics_chunks, format_model_metrics)
 from analytics_api.gls.gls import db_manager
 from analytics_api.queries.devices import select_all_devices, select_device_timezone
-from analytics_api.queries.metrics import select_numeric_scalar_metrics
+from analytics_api.queries.metrics import (parse_utc, select_numeric_scalar_metrics, stream_numeric_array_metrics,
+                                           stream_numeric_scalar_metrics)
 from analytics_api.utils.timezone import convert_to_local_time
 from analytics_api.ml.models import load_model
 from analytics_api.ml.models import create_prediction, voting_prediction
-from analytics_api.graphql.enums import status_map, DeviceStatus
+from analytics_api.graphql.enums import status_map, Aggregation, DeviceStatus
 from analytics_api.gls.gls import logger
 
 
+def with_local_time(df: pd.DataFrame) -> pd.DataFrame:
+  ''' Add the local timestamps, the metrics query returns the timezone of the device with every row. '''
+  timezone = df['timezone'].iloc[0]
+  df['timestamp_local'] = convert_to_local_time(timestamp=df['timestamp'],
+                                                timezone=timezone if isinstance(timezone, str) else df['timezone'])
+  return df
+
+
 @strawberry.type
 class Query:
 
   @strawberry.field(name='devices')
-  def devices(self, body: TenantInput) -> list[Device]:
+  async def devices(self, body: TenantInput) -> list[Device]:
     body.validate()
     logger.info(f'Received request for devices: {body}')
-    with db_manager(f'tenant_{body.tenant_identifier}') as conn:
-      df = select_all_devices(conn=conn)
+    async with db_manager(f'tenant_{body.tenant_identifier}') as conn:
+      df = await select_all_devices(conn=conn)
     df['latest_alive_local'] = convert_to_local_time(timestamp=df['latest_alive'], timezone=df['timezone'])
     return [
         Device(device_identifier=row.device_identifier,
@@ -38,36 +51,62 @@ class Query:
     ]
 
   @strawberry.field(name='numericScalar')
-  def numeric_scalar_metrics(self, body: NumericScalarInput) -> list[MetricsBase]:
+  async def numeric_scalar_metrics(self, body: NumericScalarInput) -> list[MetricsBase]:
     if body.grouping and not body.aggregation:
       raise ValueError('aggregation is required when grouping is used.')
     logger.info(f'Received request for numeric scalar metrics: {body}')
-    with db_manager(f'tenant_{body.tenant_identifier}') as conn:
-      df = select_numeric_scalar_metrics(conn=conn, body=body)
-    if df.empty:
-      return []
-    timezone = select_device_timezone(device_identifier=body.device_identifier, conn=conn)
-    df['timestamp_local'] = convert_to_local_time(timestamp=df['timestamp'], timezone=timezone)
-    return format_base_metrics(df=df)
+    async with db_manager(f'tenant_{body.tenant_identifier}') as conn:
+      return await format_base_metrics_chunks(chunks=stream_numeric_scalar_metrics(conn=conn, body=body),
+                                              prepare=with_local_time)
+
+  @strawberry.field(name='numericArray')
+  async def numeric_array_metrics(self, body: NumericArrayInput) -> list[MetricsArray]:
+    logger.info(f'Received request for numeric array metrics: {body}')
+    async with db_manager(f'tenant_{body.tenant_identifier}') as conn:
+      timezone = await select_device_timezone(device_identifier=body.device_identifier, conn=conn)
+
+      def prepare(df):
+        df['timestamp_local'] = convert_to_local_time(timestamp=df['timestamp'], timezone=timezone)
+        return df
+
+      return await format_array_windows_chunks(chunks=stream_numeric_array_metrics(conn=conn, body=body),
+                                               prepare=prepare)
+
+  @strawberry.field(name='numericArraySeries')
+  async def numeric_array_series(self, body: NumericArraySeriesInput) -> list[MetricsBase]:
+    ''' The waveforms decimated to at most max_points values per metric, e.g. to plot a long range. '''
+    logger.info(f'Received request for numeric array series: {body}')
+    decimator = SeriesDecimator(start=parse_utc(body.start), end=parse_utc(body.end), max_points=body.max_points)
+    async with db_manager(f'tenant_{body.tenant_identifier}') as conn:
+      timezone = await select_device_timezone(device_identifier=body.device_identifier, conn=conn)
+      async for df in stream_numeric_array_metrics(conn=conn, body=body):
+        if not df.empty:
+          await asyncio.to_thread(decimator.add, df)
+    return decimator.metrics(timezone=timezone, aggregation=body.aggregation or Aggregation.AVG)
 
   @strawberry.field(name='numericScalarModel')
-  def numeric_scalar_model_prediction(self, body: NumericScalarModelInput) -> list[MetricsModel]:
+  async def numeric_scalar_model_prediction(self, body: NumericScalarModelInput) -> list[MetricsModel]:
     if body.grouping and not body.aggregation:
       raise ValueError('aggregation is required when grouping is used.')
     logger.info(f'Received request for numeric scalar model metrics: {body}')
-    with db_manager(f'tenant_{body.tenant_identifier}') as conn:
-      df = select_numeric_scalar_metrics(conn=conn, body=body)
-    if df.empty:
-      return []
-    timezone = select_device_timezone(device_identifier=body.device_identifier, conn=conn)
+    async with db_manager(f'tenant_{body.tenant_identifier}') as conn:
+      df = await select_numeric_scalar_metrics(conn=conn, body=body)
+      if df.empty:
+        return []
+      timezone = await select_device_timezone(device_identifier=body.device_identifier, conn=conn)
     df['timestamp_local'] = convert_to_local_time(timestamp=df['timestamp'], timezone=timezone)
     df = df.sort_values(by='timestamp_local')
     # df['daily_date_local'] = df['timestamp_local'].dt.strftime('%A, %Y-%m-%d')
     model_metrics = set(body.metric_identifier) if body.model else set()
-    model = load_model(model_input=body.model)
+    # Loading the model and the prediction block, run them in threads to keep serving other requests meanwhile.
+    model = await asyncio.to_thread(load_model, model_input=body.model)
     if model is None:
       raise ValueError(f'Model {body.model.name} not found.')
-    model_result = create_prediction(df=df, model=model, model_input=body.model, model_metrics=model_metrics)
+    model_result = await asyncio.to_thread(create_prediction,
+                                           df=df,
+                                           model=model,
+                                           model_input=body.model,
+                                           model_metrics=model_metrics)
     return format_model_metrics(df=df, model_metrics=model_metrics, model_result=model_result)
 
 
@@ -28,6 +28,21 @@ class NumericScalarModelInput(NumericScalarBase):
   model: ModelInput
 
 
+@strawberry.input
+class NumericArrayInput(TenantInput):
+  device_identifier: str
+  metric_identifier: Optional[list[str]] = None
+  start: str
+  end: str
+  path: Optional[str] = None
+
+
+@strawberry.input
+class NumericArraySeriesInput(NumericArrayInput):
+  max_points: int = 1000
+  aggregation: Optional[Aggregation] = None
+
+
 @strawberry.type
 class Value:
   value: float
@@ -44,6 +59,21 @@ class MetricsBase:
   values: list[Value]
 
 
+@strawberry.type
+class Window:
+  start_local: str
+  sample_rate: float
+  values: list[float]
+
+
+@strawberry.type
+class MetricsArray:
+  device_identifier: str
+  metric_identifier: str
+  unit: str
+  windows: list[Window]
+
+
 @strawberry.type
 class MetricsModel(MetricsBase):
   model: ModelResult
@@ -3,17 +3,24 @@ import uvicorn
 import mlflow
 import requests
 import logging
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 # local
-from analytics_api.gls.gls import logger
+from analytics_api.gls.gls import logger, db_manager
 from analytics_api.graphql import schema
 from analytics_api.routes import home
 
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  yield
+  await db_manager.dispose()
+
+
 def create_app() -> FastAPI:
-  app = FastAPI(title='IoT Web API', description='IoT Web API', version='0.0.1')
+  app = FastAPI(title='IoT Web API', description='IoT Web API', version='0.0.1', lifespan=lifespan)
   app.include_router(home.router, include_in_schema=False)
   app.include_router(schema.graphql_app, prefix='/graphql')
   app.add_middleware(
@@ -1,11 +1,14 @@
-from sqlalchemy.orm import scoped_session
-from iot_libs.postgres import execute_select_query
+from sqlalchemy.ext.asyncio import AsyncConnection
+import pandas as pd
+from typing import AsyncIterator
+from iot_libs.const.timescale import NUMERIC_SCALAR_ROLLUPS, Rollup
+from iot_libs.postgres_aio import execute_select_query, stream_select_query
 from zoneinfo import ZoneInfo
 from datetime import datetime
 # local
-from analytics_api.queries.devices import select_device_timezone
-from analytics_api.graphql.types.metrics import NumericScalarInput
-from analytics_api.graphql.enums import GROUPING_SQL, AGGREGATION_SQL
+from analytics_api.graphql.types.metrics import NumericArrayInput, NumericScalarInput
+from analytics_api.graphql.enums import (GROUPING_SQL, AGGREGATION_SQL, GROUPING_SECONDS, ROLLUP_GROUPING_SQL,
+                                         ROLLUP_AGGREGATION_SQL)
 
 
 def local_range_to_utc(start: str, end: str, timezone: str) -> tuple[datetime, datetime]:
@@ -15,36 +18,80 @@ def local_range_to_utc(start: str, end: str, timezone: str) -> tuple[datetime, d
   return start_utc.strftime('%Y-%m-%d %H:%M:%S'), end_utc.strftime('%Y-%m-%d %H:%M:%S')
 
 
-def select_numeric_scalar_metrics(body: NumericScalarInput, conn: scoped_session) -> list:
-  timezone = select_device_timezone(device_identifier=body.device_identifier, conn=conn)
+def parse_utc(timestamp: str) -> datetime:
+  ''' Naive utc datetime of an iso timestamp, timestamps without offset are taken as utc like in the queries. '''
+  moment = datetime.fromisoformat(timestamp)
+  if moment.tzinfo is not None:
+    moment = moment.astimezone(ZoneInfo('UTC')).replace(tzinfo=None)
+  return moment
+
+
+def to_utc(timestamp: str) -> str:
+  ''' The naive utc timestamp which Postgres compares with the timestamp columns. Postgres drops the offset of a
+      timestamp instead of converting it, so offsets are converted here. Invalid timestamps are passed on unchanged.
+  '''
+  try:
+    return parse_utc(timestamp).isoformat(sep=' ')
+  except ValueError:
+    return timestamp
+
+
+def is_aligned(timestamp: str, seconds: int) -> bool:
+  try:
+    moment = parse_utc(timestamp)
+  except ValueError:
+    return False
+  return (moment - datetime(1970, 1, 1)).total_seconds() % seconds == 0
+
+
+def select_rollup(body: NumericScalarInput) -> Rollup | None:
+  ''' The coarsest rollup whose buckets fit into the requested groups and whose bucket boundaries match the requested
+      range, None if the query has to aggregate the raw values. The range is checked in utc, as it is bound to the
+      query, see to_utc.
+  '''
+  if not body.grouping or not body.aggregation:
+    return None
+  group_seconds = GROUPING_SECONDS[body.grouping.value]
+  for rollup in reversed(NUMERIC_SCALAR_ROLLUPS):
+    if (group_seconds % rollup.seconds == 0 and is_aligned(body.start, rollup.seconds) and
+        is_aligned(body.end, rollup.seconds)):
+      return rollup
+  return None
+
+
+def numeric_scalar_metrics_query(body: NumericScalarInput) -> tuple[str, dict]:
+  ''' Grouped and aggregated queries read from the coarsest matching rollup, otherwise from the raw values. Both select
+      the range from start up to end, so that the same request gives the same rows from either source.
+  '''
   # start, end = local_range_to_utc(start=body.start, end=body.end, timezone=timezone)
+  rollup = select_rollup(body=body)
   select_fields = ['d.device_identifier', 'm.metric_identifier', 'm.unit', 'm.display_name', 'p.path', 'm.metric_type', 'd.timezone'] # yapf: disable
   group_by_fields = select_fields.copy()
   # Add time bucket if grouping is provided
   if body.grouping:
-    time_bucket_expr = GROUPING_SQL[body.grouping.value]
+    time_bucket_expr = (ROLLUP_GROUPING_SQL if rollup else GROUPING_SQL)[body.grouping.value]
     select_fields.append(f"{time_bucket_expr} as timestamp")
     group_by_fields.append(f"{time_bucket_expr}")
   else:
     select_fields.append("n.timestamp")
   # Add aggregation
   if body.aggregation:
-    agg_expr = AGGREGATION_SQL[body.aggregation.value]
+    agg_expr = (ROLLUP_AGGREGATION_SQL if rollup else AGGREGATION_SQL)[body.aggregation.value]
     select_fields.append(f"{agg_expr} as value")
   else:
     select_fields.append("n.value")
   # Base query
   query = f'''
     select {', '.join(select_fields)}
-    from numeric_scalar_values as n
-    join metrics as m on n.metric_id = m.id
+    from {rollup.view if rollup else 'numeric_scalar_values'} as n
+    join metrics as m on n.metric_key = m.metric_key
     join paths as p on m.path_id = p.id
     join devices as d on m.device_identifier = d.device_identifier
     where d.device_identifier = :device_identifier 
-    and n.timestamp between :start and :end
+    and {'n.bucket >= :start and n.bucket < :end' if rollup else 'n.timestamp >= :start and n.timestamp < :end'}
   '''
   # optinal path filter
-  params = {'start': body.start, 'end': body.end, 'device_identifier': body.device_identifier}
+  params = {'start': to_utc(body.start), 'end': to_utc(body.end), 'device_identifier': body.device_identifier}
   if body.path:
     query += ' and p.path <@ :path'
     params['path'] = body.path
@@ -57,4 +104,47 @@ def select_numeric_scalar_metrics(body: NumericScalarInput, conn: scoped_session
     query += ' order by timestamp desc'
   else:
     query += ' order by n.timestamp desc'
-  return execute_select_query(conn=conn, query=query, params=params)
+  return query, params
+
+
+async def select_numeric_scalar_metrics(body: NumericScalarInput, conn: AsyncConnection) -> pd.DataFrame:
+  query, params = numeric_scalar_metrics_query(body=body)
+  return await execute_select_query(conn=conn, query=query, params=params)
+
+
+def stream_numeric_scalar_metrics(body: NumericScalarInput,
+                                  conn: AsyncConnection,
+                                  chunk_size: int = 10000) -> AsyncIterator[pd.DataFrame]:
+  ''' Select the metrics in chunks of chunk_size rows with a server side cursor. '''
+  query, params = numeric_scalar_metrics_query(body=body)
+  return stream_select_query(conn=conn, query=query, params=params, chunk_size=chunk_size)
+
+
+def numeric_array_metrics_query(body: NumericArrayInput) -> tuple[str, dict]:
+  ''' The windows of the waveform metrics which start from start up to end, one row per window. '''
+  query = '''
+    select d.device_identifier, m.metric_identifier, m.unit, n.timestamp, n.sample_rate, n.samples
+    from numeric_array_values as n
+    join metrics as m on n.metric_key = m.metric_key
+    join paths as p on m.path_id = p.id
+    join devices as d on m.device_identifier = d.device_identifier
+    where d.device_identifier = :device_identifier
+    and n.timestamp >= :start and n.timestamp < :end
+  '''
+  params = {'start': to_utc(body.start), 'end': to_utc(body.end), 'device_identifier': body.device_identifier}
+  if body.path:
+    query += ' and p.path <@ :path'
+    params['path'] = body.path
+  if body.metric_identifier:
+    query += ' and m.metric_identifier = any(:metric_identifier)'
+    params['metric_identifier'] = body.metric_identifier
+  query += ' order by m.metric_identifier, n.timestamp'
+  return query, params
+
+
+def stream_numeric_array_metrics(body: NumericArrayInput,
+                                 conn: AsyncConnection,
+                                 chunk_size: int = 1000) -> AsyncIterator[pd.DataFrame]:
+  ''' Select the windows in chunks of chunk_size windows with a server side cursor. '''
+  query, params = numeric_array_metrics_query(body=body)
+  return stream_select_query(conn=conn, query=query, params=params, chunk_size=chunk_size)
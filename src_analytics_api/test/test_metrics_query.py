@@ -0,0 +1,94 @@
+import pytest
+from analytics_api.graphql.enums import Aggregation, Grouping
+from analytics_api.graphql.types.metrics import NumericArrayInput, NumericScalarInput
+from analytics_api.queries.metrics import (is_aligned, numeric_array_metrics_query, numeric_scalar_metrics_query,
+                                           select_rollup, to_utc)
+
+
+def scalar_input(start: str = '2025-01-06T00:00:00',
+                 end: str = '2025-02-03T00:00:00',
+                 grouping: Grouping | None = Grouping.WEEKLY,
+                 aggregation: Aggregation | None = Aggregation.AVG) -> NumericScalarInput:
+  return NumericScalarInput(tenant_identifier='100000',
+                            device_identifier='device',
+                            start=start,
+                            end=end,
+                            grouping=grouping,
+                            aggregation=aggregation)
+
+
+@pytest.mark.parametrize('timestamp, seconds, aligned', [
+    ('2025-01-06T00:00:00', 86400, True),
+    ('2025-01-06T00:00:01', 60, False),
+    ('2025-01-06T01:00:00+01:00', 86400, True),
+    ('2025-01-06T00:00:00+05:30', 3600, False),
+    ('2025-01-06T00:00:00+05:30', 60, True),
+    ('yesterday', 60, False),
+])
+def test_is_aligned(timestamp, seconds, aligned):
+  assert is_aligned(timestamp, seconds) == aligned
+
+
+def test_weekly_groups_read_the_daily_rollup():
+  assert select_rollup(scalar_input()).view == 'numeric_scalar_values_1d'
+
+
+def test_coarsest_rollup_aligned_with_the_range_is_selected():
+  body = scalar_input(start='2025-01-06T06:00:00', end='2025-01-07T06:30:00', grouping=Grouping.DAILY)
+  assert select_rollup(body).view == 'numeric_scalar_values_1m'
+
+
+@pytest.mark.parametrize('timestamp, utc', [
+    ('2025-01-06T01:00:00+01:00', '2025-01-06 00:00:00'),
+    ('2025-01-06T00:00:00+05:30', '2025-01-05 18:30:00'),
+    ('2025-01-06T00:00:00', '2025-01-06 00:00:00'),
+    ('yesterday', 'yesterday'),
+])
+def test_to_utc(timestamp, utc):
+  assert to_utc(timestamp) == utc
+
+
+def test_offsets_are_checked_and_bound_in_utc():
+  body = scalar_input(start='2025-01-06T01:00:00+01:00', end='2025-02-03T01:00:00+01:00')
+  assert select_rollup(body).view == 'numeric_scalar_values_1d'
+  _, params = numeric_scalar_metrics_query(body)
+  assert (params['start'], params['end']) == ('2025-01-06 00:00:00', '2025-02-03 00:00:00')
+  body = scalar_input(start='2025-01-06T00:00:00+05:30', end='2025-02-03T00:00:00+05:30')
+  assert select_rollup(body).view == 'numeric_scalar_values_1m'
+  _, params = numeric_scalar_metrics_query(body)
+  assert (params['start'], params['end']) == ('2025-01-05 18:30:00', '2025-02-02 18:30:00')
+
+
+@pytest.mark.parametrize('body', [
+    scalar_input(grouping=None),
+    scalar_input(aggregation=None),
+    scalar_input(grouping=Grouping.SECOND),
+    scalar_input(start='2025-01-06T00:00:30'),
+])
+def test_raw_values_are_aggregated_without_matching_rollup(body):
+  assert select_rollup(body) is None
+
+
+def test_rollup_and_raw_queries_select_the_same_range():
+  rollup_query, _ = numeric_scalar_metrics_query(scalar_input())
+  raw_query, _ = numeric_scalar_metrics_query(scalar_input(start='2025-01-06T00:00:30'))
+  assert 'n.bucket >= :start and n.bucket < :end' in rollup_query
+  assert 'n.timestamp >= :start and n.timestamp < :end' in raw_query
+  assert 'between' not in raw_query
+
+
+def test_array_query_selects_the_half_open_range():
+  query, _ = numeric_array_metrics_query(NumericArrayInput(tenant_identifier='100000',
+                                                           device_identifier='device',
+                                                           start='2025-01-06T00:00:00',
+                                                           end='2025-01-07T00:00:00'))
+  assert 'n.timestamp >= :start and n.timestamp < :end' in query
+  assert 'between' not in query
+
+
+def test_array_query_binds_the_range_in_utc():
+  _, params = numeric_array_metrics_query(NumericArrayInput(tenant_identifier='100000',
+                                                            device_identifier='device',
+                                                            start='2025-01-06T01:00:00+01:00',
+                                                            end='2025-01-07T01:00:00+01:00'))
+  assert (params['start'], params['end']) == ('2025-01-06 00:00:00', '2025-01-07 00:00:00')
@@ -0,0 +1,59 @@
+from datetime import timedelta
+from iot_libs.const.timescale import NUMERIC_SCALAR_ROLLUPS
+from iot_libs.postgres import dict_row, execute_query, execute_select_query
+from sqlalchemy.engine import Connection
+# local
+from db_manager.gls.gls import logger
+from db_manager.schemas.metrics import add_metric_key
+from db_manager.schemas.numeric_scalar_values import create_numeric_scalar_values_table
+from db_manager.schemas.timescale import create_hypertable, create_index, drop_continuous_aggregate
+
+MIGRATION_TABLE = 'numeric_scalar_values_metric_key'
+
+
+def has_column(conn: Connection, table: str, column: str) -> bool:
+  query = 'select 1 from information_schema.columns where table_name = :table and column_name = :column'
+  return bool(execute_select_query(conn, query, params={'table': table, 'column': column}, row_factory=dict_row))
+
+
+def migrate_metric_keys(conn: Connection, window: timedelta = timedelta(days=1)):
+  ''' Replace the uuid metric_id of the values by the integer metric_key of the metrics.
+
+      The values are copied window by window into a new hypertable, every window in its own transaction, which then
+      replaces the old one. The rollups are dropped and have to be created again. The hub has to be stopped meanwhile
+      and started with the metric_key insert path afterwards. A failed migration can be started again, values without
+      metric are dropped.
+
+      Parameters
+      ----------
+      conn:    Connection of the tenant database without open transaction.
+      window:  The time range of the values copied in one transaction.
+  '''
+  if has_column(conn, table='numeric_scalar_values', column='metric_key'):
+    return
+  db_name = conn.engine.url.database
+  execute_query(conn, add_metric_key())
+  for rollup in NUMERIC_SCALAR_ROLLUPS:
+    execute_query(conn, drop_continuous_aggregate(view=rollup.view))
+  execute_query(conn, f'drop table if exists {MIGRATION_TABLE}')
+  execute_query(conn, create_numeric_scalar_values_table(table=MIGRATION_TABLE))
+  execute_query(conn, create_hypertable(table=MIGRATION_TABLE))
+  bounds = execute_select_query(conn,
+                                'select min(timestamp) as first, max(timestamp) as last from numeric_scalar_values',
+                                row_factory=dict_row)[0]
+  query = f'''insert into {MIGRATION_TABLE} (metric_key, value, timestamp)
+    select m.metric_key, n.value, n.timestamp
+    from numeric_scalar_values as n
+    join metrics as m on n.metric_id = m.id
+    where n.timestamp >= :start and n.timestamp < :end
+  '''
+  start = bounds['first']
+  while start is not None and start <= bounds['last']:
+    result = execute_query(conn, query, params={'start': start, 'end': start + window})
+    logger.info(f'Copied {result.rowcount} value(s) of {db_name} from {start}')
+    start += window
+  with conn.begin():
+    execute_query(conn, 'drop table numeric_scalar_values')
+    execute_query(conn, f'alter table {MIGRATION_TABLE} rename to numeric_scalar_values')
+    execute_query(conn, create_index(table='numeric_scalar_values'))
+  logger.info(f'Values of {db_name} reference the metric_key.')
@@ -0,0 +1,162 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+from iot_libs.const.timescale import NUMERIC_SCALAR_ROLLUPS
+from iot_libs.postgres import dict_row, execute_query, execute_select_query
+from sqlalchemy.engine import Connection
+# local
+from db_manager.gls.gls import db_manager, logger
+from db_manager.metric_keys import migrate_metric_keys
+from db_manager.schemas.devices import create_devices_table
+from db_manager.schemas.metrics import add_metric_key, create_metrics_table
+from db_manager.schemas.migrations import (create_schema_migrations_table, insert_schema_migration,
+                                           select_schema_migrations, select_tenant_databases)
+from db_manager.schemas.numeric_array_values import create_numeric_array_values_table
+from db_manager.schemas.numeric_scalar_values import create_numeric_scalar_values_table
+from db_manager.schemas.paths import create_metric_paths_table
+from db_manager.schemas.setup import create_lree_extension, create_pgcrypto_extension
+from db_manager.schemas.timescale import (add_continuous_aggregate_policy, create_continuous_aggregate,
+                                          create_hypertable, create_index, enable_timescale,
+                                          refresh_continuous_aggregate)
+from db_manager.storage import configure_storage, storage_options_from_env
+
+
+@dataclass(frozen=True)
+class Migration:
+  ''' Step of the tenant schema, applied once per database in the order of its version.
+
+      A transactional step and its version are committed together. Other steps run on a connection without open
+      transaction and manage their transactions themselves, they have to be safe to run again after a failure.
+  '''
+  version: int
+  name: str
+  apply: Callable[[Connection], None]
+  transactional: bool = True
+
+
+def create_schema(conn: Connection):
+  execute_query(conn, enable_timescale())
+  execute_query(conn, create_lree_extension())
+  execute_query(conn, create_pgcrypto_extension())
+  execute_query(conn, create_devices_table())
+  execute_query(conn, create_metric_paths_table())
+  execute_query(conn, create_metrics_table())
+  execute_query(conn, add_metric_key())
+  execute_query(conn, create_numeric_scalar_values_table())
+  execute_query(conn, create_hypertable(table='numeric_scalar_values'))
+
+
+def create_value_index(conn: Connection):
+  execute_query(conn, create_index(table='numeric_scalar_values'))
+
+
+def create_storage_policies(conn: Connection):
+  configure_storage(conn, **storage_options_from_env())
+
+
+def create_rollups(conn: Connection):
+  for rollup in NUMERIC_SCALAR_ROLLUPS:
+    query = create_continuous_aggregate(view=rollup.view, table='numeric_scalar_values', bucket=rollup.bucket)
+    execute_query(conn, query)
+    query = add_continuous_aggregate_policy(view=rollup.view,
+                                            start_offset=rollup.start_offset,
+                                            end_offset=rollup.end_offset,
+                                            schedule_interval=rollup.schedule_interval)
+    execute_query(conn, query)
+
+
+def refresh_rollups(conn: Connection):
+  ''' Materialize the existing values once, the refresh policies only cover the recent buckets. '''
+  with conn.engine.connect() as autocommit:
+    autocommit.execution_options(isolation_level='AUTOCOMMIT')
+    for rollup in NUMERIC_SCALAR_ROLLUPS:
+      execute_query(autocommit, refresh_continuous_aggregate(view=rollup.view))
+
+
+def create_array_values(conn: Connection):
+  execute_query(conn, create_numeric_array_values_table())
+  execute_query(conn, create_hypertable(table='numeric_array_values'))
+  execute_query(conn, create_index(table='numeric_array_values', name='ix_array_metric_key_time'))
+  configure_storage(conn, table='numeric_array_values', **storage_options_from_env())
+
+
+MIGRATIONS = (
+    Migration(version=1, name='create_schema', apply=create_schema),
+    Migration(version=2, name='metric_keys', apply=migrate_metric_keys, transactional=False),
+    Migration(version=3, name='value_index', apply=create_value_index),
+    Migration(version=4, name='storage_policies', apply=create_storage_policies),
+    Migration(version=5, name='rollups', apply=create_rollups),
+    Migration(version=6, name='refresh_rollups', apply=refresh_rollups, transactional=False),
+    Migration(version=7, name='array_values', apply=create_array_values),
+)
+
+
+def migrate_tenant(db_name: str, migrations: tuple[Migration, ...] = MIGRATIONS) -> list[int]:
+  ''' Apply the pending migrations to a tenant database and return their versions. A database which is migrated by
+      another runner at the same time is skipped.
+  '''
+  with db_manager.connection(db_name) as conn:
+    if not execute_select_query(conn, 'select pg_try_advisory_lock(hashtext(:lock)) as locked',
+                                params={'lock': 'schema_migrations'},
+                                row_factory=dict_row)[0]['locked']:
+      logger.warning(f'Skip {db_name}, it is migrated by another runner.')
+      return []
+    try:
+      execute_query(conn, create_schema_migrations_table())
+      applied = {row['version'] for row in execute_select_query(conn, select_schema_migrations(), row_factory=dict_row)}
+      pending = sorted((migration for migration in migrations if migration.version not in applied),
+                       key=lambda migration: migration.version)
+      for migration in pending:
+        logger.info(f'Apply migration {migration.version} {migration.name} to {db_name}')
+        params = {'version': migration.version, 'name': migration.name}
+        if migration.transactional:
+          with conn.begin():
+            migration.apply(conn)
+            execute_query(conn, insert_schema_migration(), params=params)
+        else:
+          migration.apply(conn)
+          execute_query(conn, insert_schema_migration(), params=params)
+      return [migration.version for migration in pending]
+    finally:
+      execute_query(conn, 'select pg_advisory_unlock(hashtext(:lock))', params={'lock': 'schema_migrations'})
+
+
+def tenant_databases() -> list[str]:
+  with db_manager.connection('postgres') as conn:
+    return [row['datname'] for row in execute_select_query(conn, select_tenant_databases(), row_factory=dict_row)]
+
+
+def migrate_tenants(db_names: list[str] = None, workers: int = 8) -> dict[str, Exception]:
+  ''' Apply the pending migrations to the tenant databases concurrently and return the errors per database.
+
+      Parameters
+      ----------
+      db_names:  The tenant databases, all tenant_* databases if None.
+      workers:   Maximum number of databases migrated at the same time.
+  '''
+  db_names = tenant_databases() if db_names is None else db_names
+  errors: dict[str, Exception] = {}
+
+  def migrate(db_name: str):
+    try:
+      versions = migrate_tenant(db_name)
+      logger.info(f'{db_name} is up to date, applied {len(versions)} migration(s).')
+    except Exception as exc:
+      logger.error(f'Failed to migrate {db_name}: {exc}')
+      errors[db_name] = exc
+
+  with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='migrate') as executor:
+    list(executor.map(migrate, db_names))
+  logger.info(f'Migrated {len(db_names) - len(errors)} of {len(db_names)} tenant database(s).')
+  return errors
+
+
+def main():
+  errors = migrate_tenants(workers=int(os.getenv('MIGRATION_WORKERS', 8)))
+  if errors:
+    raise SystemExit(1)
+
+
+if __name__ == '__main__':
+  main()
@@ -1,6 +1,7 @@
 def create_metrics_table() -> str:
   return '''create table if not exists metrics (
     id uuid not null primary key default gen_random_uuid(),
+    metric_key integer generated always as identity unique,
     device_identifier char(6) references devices(device_identifier),
     path_id uuid references paths(id),
     metric_identifier text not null ,
@@ -10,3 +11,8 @@ def create_metrics_table() -> str:
     unique(device_identifier, metric_identifier)
   )
   '''
+
+
+def add_metric_key() -> str:
+  ''' Compact surrogate key of the metrics, referenced by the value tables instead of the uuid. '''
+  return 'alter table metrics add column if not exists metric_key integer generated always as identity unique'
@@ -0,0 +1,19 @@
+def create_schema_migrations_table() -> str:
+  return '''create table if not exists schema_migrations (
+    version integer not null primary key,
+    name text not null,
+    applied_at timestamptz not null default now()
+  )
+  '''
+
+
+def insert_schema_migration() -> str:
+  return 'insert into schema_migrations (version, name) values (:version, :name)'
+
+
+def select_schema_migrations() -> str:
+  return 'select version from schema_migrations'
+
+
+def select_tenant_databases() -> str:
+  return r"select datname from pg_database where datname like 'tenant\_%' order by datname"
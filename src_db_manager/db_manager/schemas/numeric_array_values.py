@@ -0,0 +1,10 @@
+def create_numeric_array_values_table(table: str = 'numeric_array_values') -> str:
+  ''' Waveform windows, one row per window with the samples packed as little-endian float32 values. '''
+  return f'''create table if not exists {table} (
+    metric_key integer not null references metrics(metric_key),
+    timestamp timestamp not null,
+    sample_rate double precision not null,
+    sample_count integer not null,
+    samples bytea compression lz4 not null
+  )
+  '''
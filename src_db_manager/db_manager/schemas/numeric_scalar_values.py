@@ -1,6 +1,6 @@
-def create_numeric_scalar_values_table() -> str:
-  return '''create table if not exists numeric_scalar_values (
-    metric_id uuid references metrics(id),
+def create_numeric_scalar_values_table(table: str = 'numeric_scalar_values') -> str:
+  return f'''create table if not exists {table} (
+    metric_key integer not null references metrics(metric_key),
     value double precision,
     timestamp timestamp not null
   )
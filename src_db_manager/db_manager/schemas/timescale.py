@@ -3,8 +3,80 @@ def enable_timescale() -> str:
 
 
 def create_hypertable(table: str) -> str:
-  return f"select create_hypertable('{table}', 'timestamp')"
+  return f"select create_hypertable('{table}', 'timestamp', if_not_exists => true)"
 
 
-def create_index(table: str) -> str:
-  return f"create index ix_metric_id_time on {table} (metric_id, timestamp)"
+def create_index(table: str, name: str = 'ix_metric_key_time') -> str:
+  return f"create index if not exists {name} on {table} (metric_key, timestamp)"
+
+
+def create_continuous_aggregate(view: str, table: str, bucket: str) -> str:
+  ''' Rollup of a value table with min, max, avg, sum and count per metric and bucket. It is created without data,
+      the refresh policy or refresh_continuous_aggregate materializes it, until then it is aggregated at query time.
+  '''
+  return f'''create materialized view if not exists {view}
+    with (timescaledb.continuous, timescaledb.materialized_only = false) as
+    select metric_key,
+           time_bucket(interval '{bucket}', timestamp) as bucket,
+           min(value) as min_value,
+           max(value) as max_value,
+           avg(value) as avg_value,
+           sum(value) as sum_value,
+           count(value) as value_count
+    from {table}
+    group by metric_key, time_bucket(interval '{bucket}', timestamp)
+    with no data
+  '''
+
+
+def add_continuous_aggregate_policy(view: str, start_offset: str, end_offset: str, schedule_interval: str) -> str:
+  return f"""select add_continuous_aggregate_policy('{view}',
+    start_offset => interval '{start_offset}',
+    end_offset => interval '{end_offset}',
+    schedule_interval => interval '{schedule_interval}',
+    if_not_exists => true)
+  """
+
+
+def refresh_continuous_aggregate(view: str) -> str:
+  ''' Materialize the whole history of a rollup, it can not run inside a transaction. '''
+  return f"call refresh_continuous_aggregate('{view}', null, null)"
+
+
+def compression_enabled(table: str) -> str:
+  return f"select compression_enabled from timescaledb_information.hypertables where hypertable_name = '{table}'"
+
+
+def enable_compression(table: str, segment_by: str, order_by: str) -> str:
+  ''' Compressed chunks keep the rows of a segment_by value together, sorted by order_by. '''
+  return f"""alter table {table} set (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = '{segment_by}',
+    timescaledb.compress_orderby = '{order_by}')
+  """
+
+
+def add_compression_policy(table: str, compress_after: str) -> str:
+  return f"""select add_compression_policy('{table}',
+    compress_after => interval '{compress_after}',
+    if_not_exists => true)
+  """
+
+
+def remove_compression_policy(table: str) -> str:
+  return f"select remove_compression_policy('{table}', if_exists => true)"
+
+
+def add_retention_policy(table: str, drop_after: str) -> str:
+  return f"""select add_retention_policy('{table}',
+    drop_after => interval '{drop_after}',
+    if_not_exists => true)
+  """
+
+
+def remove_retention_policy(table: str) -> str:
+  return f"select remove_retention_policy('{table}', if_exists => true)"
+
+
+def drop_continuous_aggregate(view: str) -> str:
+  return f'drop materialized view if exists {view}'
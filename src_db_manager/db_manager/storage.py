@@ -0,0 +1,50 @@
+import os
+from iot_libs.postgres import dict_row, execute_query, execute_select_query
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import Session
+# local
+from db_manager.gls.gls import db_manager, logger
+from db_manager.schemas.timescale import (add_compression_policy, add_retention_policy, compression_enabled,
+                                          enable_compression, remove_compression_policy, remove_retention_policy)
+
+
+def storage_options_from_env() -> dict:
+  ''' Read the storage policies of the tenant from the environment, e.g. COMPRESS_AFTER='7 days'. '''
+  return {'compress_after': os.getenv('COMPRESS_AFTER', '7 days'), 'drop_after': os.getenv('DROP_AFTER')}
+
+
+def configure_storage(conn: Session | Connection,
+                      table: str = 'numeric_scalar_values',
+                      compress_after: str = None,
+                      drop_after: str = None):
+  ''' Enable compression of a hypertable and replace its compression and retention policies. It can run again on
+      existing tenants to apply changed policies.
+
+      Parameters
+      ----------
+      conn:            The database connection.
+      table:           The hypertable.
+      compress_after:  Age of the chunks to compress, e.g. '7 days', None to keep the chunks uncompressed.
+      drop_after:      Age of the chunks to drop, e.g. '1 year', None to keep the chunks forever. It has to exceed the
+                       start_offset of the rollups, which keep their aggregates of dropped chunks.
+  '''
+  result = execute_select_query(conn, compression_enabled(table=table), row_factory=dict_row)
+  if not result or not result[0]['compression_enabled']:
+    execute_query(conn, enable_compression(table=table, segment_by='metric_key', order_by='timestamp desc'))
+  execute_query(conn, remove_compression_policy(table=table))
+  if compress_after:
+    execute_query(conn, add_compression_policy(table=table, compress_after=compress_after))
+  execute_query(conn, remove_retention_policy(table=table))
+  if drop_after:
+    execute_query(conn, add_retention_policy(table=table, drop_after=drop_after))
+  logger.info(f'Storage of {table}: compress after {compress_after or "never"}, drop after {drop_after or "never"}')
+
+
+def main():
+  ''' Apply the storage policies to an existing tenant. '''
+  with db_manager(f'tenant_{os.getenv("TENANT_IDENTIFIER")}') as conn:
+    configure_storage(conn, **storage_options_from_env())
+
+
+if __name__ == '__main__':
+  main()
@@ -1,14 +1,18 @@
 import grpc
 import threading
-from iot_libs.proto.hub_pb2 import NumericScalarValues, DeviceStatus
+from dataclasses import dataclass, field
+from iot_libs.proto.batch import ACCEPTED_BATCHES_KEY, DescriptorKey, descriptor_key, pack_numeric_scalar_values
+from iot_libs.proto.hub_pb2 import (MetricRegistration, NumericArrayWindow, NumericScalarBatch, NumericScalarValues,
+                                    DeviceStatus)
 from iot_libs.proto.hub_pb2_grpc import HubStub
 from iot_libs.proto.enums import StubMethod
 # local
 from edge_device.gls.gls import logger
+from edge_device.api.stream import IngestStream
 from edge_device.utils.decorators import retry
 
 
-def log_metrics(metrics: list[NumericScalarValues] | NumericScalarValues | DeviceStatus) -> None:
+def log_metrics(metrics: list[NumericScalarValues | NumericScalarBatch] | NumericScalarValues | DeviceStatus) -> None:
   if isinstance(metrics, list):
     for metric in metrics:
       logger.info(f'Send metric: {metric}')
@@ -16,31 +20,63 @@ def log_metrics(metrics: list[NumericScalarValues] | NumericScalarValues | Devic
     logger.info(f'Send metric: {metrics}')
 
 
+def accepted_batches(exc: grpc.RpcError) -> int:
+  ''' The number of batches the hub accepted before it rejected the stream, as reported in the trailing metadata. '''
+  for key, value in exc.trailing_metadata() or ():
+    if key == ACCEPTED_BATCHES_KEY:
+      return int(value)
+  return 0
+
+
+@dataclass
+class MetricSession:
+  ''' The handles the hub assigned to the registered metrics of a device. '''
+  session_id: str
+  handles: dict[DescriptorKey, int] = field(default_factory=dict)
+
+
 class GrpcClient:
 
-  def __init__(self, host: str = 'localhost', port: int | str = 50051):
+  def __init__(self, host: str = 'localhost', port: int | str = 50051, use_handles: bool = True):
     self.host = host
     self.port = port
     self.channel = None
     self.stub = None
     self.lock = threading.Lock()
+    self.use_handles = use_handles
+    self.sessions: dict[tuple[str, str], MetricSession] = {}
+    self.stream: IngestStream = None
 
   def send(self,
-           data: NumericScalarValues | DeviceStatus | list[NumericScalarValues],
+           data: NumericScalarValues | NumericScalarBatch | NumericArrayWindow | DeviceStatus |
+           list[NumericScalarValues | NumericScalarBatch | NumericArrayWindow],
            stub_method: StubMethod,
-           log: bool = False):
-    ''' Send metrics to the gRPC server. '''
+           log: bool = False) -> bool:
+    ''' Send metrics to the gRPC server and return False if they could not be sent. Samples sent with
+        SendNumericScalarBatch or StreamNumericScalarBatches are packed into one batch per device. Batches for the
+        stream are only queued, they are sent and acknowledged in the background.
+    '''
+    stream = None
     try:
       with self.lock:
         method_name, method_type = stub_method.value
         stub_method = getattr(self.stub, method_name, None)
         if not stub_method:
           raise AttributeError(f'Stub method {method_name} does not exist')
-        if isinstance(data, NumericScalarValues):
+        if isinstance(data, (NumericScalarValues, NumericScalarBatch, NumericArrayWindow)):
           data = [data]
+        if method_name in (StubMethod.SEND_NUMERIC_SCALAR_BATCH.value[0],
+                           StubMethod.STREAM_NUMERIC_SCALAR_BATCHES.value[0]):
+          data = pack_numeric_scalar_values([d for d in data if isinstance(d, NumericScalarValues)]) + [
+              d for d in data if isinstance(d, NumericScalarBatch)
+          ]
         log_metrics(metrics=data) if log else None
-        if method_type == 'unary':
+        if method_type == 'bidi':
+          stream = self._ingest_stream()
+        elif method_type == 'unary':
           stub_method(data)
+        elif method_name == StubMethod.SEND_NUMERIC_SCALAR_BATCH.value[0] and self.use_handles:
+          self._send_with_handles(stub_method=stub_method, batches=data)
         elif method_type == 'stream':
           stub_method(iter(data))
         else:
@@ -48,6 +84,82 @@ class GrpcClient:
     except grpc.RpcError as exc:
       logger.error(f'Failed to send metrics: with exception\n{exc}')
       self.connect()
+      return False
+    if stream is not None and not stream.send(data):
+      if stream.supported:
+        logger.error(f'Failed to queue {len(data)} metric batch(es), the ingest stream is closed.')
+        return False
+      return self.send(data=data, stub_method=StubMethod.SEND_NUMERIC_SCALAR_BATCH)
+    return True
+
+  def _ingest_stream(self) -> IngestStream:
+    ''' Start the ingest stream on first use. '''
+    if self.stream is None:
+      self.stream = IngestStream(open_stream=lambda requests: self.stub.StreamNumericScalarBatches(requests),
+                                 encode=self._encode,
+                                 clear_sessions=self._clear_sessions,
+                                 fallback=lambda batches: self.send(data=batches,
+                                                                    stub_method=StubMethod.SEND_NUMERIC_SCALAR_BATCH))
+    return self.stream
+
+  def _encode(self, batch: NumericScalarBatch) -> NumericScalarBatch:
+    with self.lock:
+      return self._to_handles(batch) if self.use_handles else batch
+
+  def _clear_sessions(self):
+    with self.lock:
+      self.sessions.clear()
+
+  def _send_with_handles(self, stub_method, batches: list[NumericScalarBatch]):
+    ''' Send the batches with metric handles instead of the metric descriptors. If the hub lost the session, e.g.
+        after a restart, the metrics are registered again and the batches the hub did not accept are sent once more.
+    '''
+    try:
+      stub_method(iter([self._to_handles(batch) for batch in batches]))
+    except grpc.RpcError as exc:
+      if exc.code() == grpc.StatusCode.UNIMPLEMENTED:
+        logger.warning('Hub does not support metric handles, send metric descriptors instead.')
+        self.use_handles = False
+        stub_method(iter(batches))
+      elif exc.code() == grpc.StatusCode.FAILED_PRECONDITION:
+        accepted = accepted_batches(exc)
+        logger.info(f'Metric session expired after {accepted} batch(es), register metrics again: {exc.details()}')
+        self.sessions.clear()
+        stub_method(iter([self._to_handles(batch) for batch in batches[accepted:]]))
+      else:
+        raise
+
+  def _to_handles(self, batch: NumericScalarBatch) -> NumericScalarBatch:
+    ''' Replace the metric descriptors of a batch by their handles, unknown metrics are registered first. '''
+    key = (batch.tenant_identifier, batch.device_identifier)
+    session = self.sessions.get(key)
+    unknown = {descriptor_key(metric): metric for metric in batch.metrics}
+    if session is not None:
+      unknown = {metric_key: metric for metric_key, metric in unknown.items() if metric_key not in session.handles}
+    if unknown:
+      session = self.sessions[key] = self._register(tenant_identifier=batch.tenant_identifier,
+                                                    device_identifier=batch.device_identifier,
+                                                    metrics=list(unknown.values()),
+                                                    session=session)
+    handles = [session.handles[descriptor_key(metric)] for metric in batch.metrics]
+    return NumericScalarBatch(session_id=session.session_id,
+                              metric_index=[handles[index] for index in batch.metric_index],
+                              values=batch.values,
+                              timestamps_us=batch.timestamps_us)
+
+  def _register(self, tenant_identifier: str, device_identifier: str, metrics: list,
+                session: MetricSession = None) -> MetricSession:
+    registration = MetricRegistration(tenant_identifier=tenant_identifier,
+                                      device_identifier=device_identifier,
+                                      metrics=metrics,
+                                      session_id=session.session_id if session else '')
+    response = self.stub.RegisterMetrics(registration)
+    if session is None or session.session_id != response.session_id:
+      session = MetricSession(session_id=response.session_id)
+    for metric, handle in zip(metrics, response.handles):
+      session.handles[descriptor_key(metric)] = handle
+    logger.info(f'Registered {len(metrics)} metric(s) in session {session.session_id}')
+    return session
 
   @retry((grpc.RpcError, grpc.FutureTimeoutError), delay=10)
   def connect(self):
@@ -55,10 +167,13 @@ class GrpcClient:
     with self.lock:
       self.channel = grpc.insecure_channel(f'{self.host}:{self.port}')
       self.stub = HubStub(self.channel)
+      self.sessions.clear()
       grpc.channel_ready_future(self.channel).result(timeout=10)
       logger.info(f'Connected to gRPC server at {self.host}:{self.port}')
 
   def close(self):
+    if self.stream is not None:
+      self.stream.close()
     with self.lock:
       if self.channel:
         logger.info(f'Closing gRPC channel: {self.channel}')
@@ -0,0 +1,215 @@
+import grpc
+import threading
+import time
+from collections import OrderedDict, deque
+from typing import Callable
+from iot_libs.proto.hub_pb2 import FAILED, PENDING, IngestAck, IngestRequest, NumericScalarBatch
+# local
+from edge_device.gls.gls import logger
+
+
+class IngestStream:
+  ''' Long-lived bidirectional stream sending metric batches to the hub.
+
+      Every batch gets a sequence number and is kept until the hub acknowledges it, the hub grants credits which limit
+      the number of batches in flight. If the stream breaks, it is opened again and all unacknowledged batches are
+      sent once more, so a batch is delivered at least once.
+  '''
+
+  def __init__(self,
+               open_stream: Callable,
+               encode: Callable[[NumericScalarBatch], NumericScalarBatch],
+               clear_sessions: Callable[[], None],
+               fallback: Callable[[list[NumericScalarBatch]], bool],
+               max_pending: int = 10000,
+               retry_delay: float = 1,
+               max_reconnect_delay: float = 30):
+    ''' Parameters
+        ----------
+        open_stream:          Opens the StreamNumericScalarBatches call for an iterator of requests.
+        encode:               Prepares a batch for sending, e.g. replaces the metric descriptors by handles.
+        clear_sessions:       Forgets the metric sessions after the hub lost them.
+        fallback:             Sends batches if the hub does not implement the stream, returns False if they could
+                              not be sent.
+        max_pending:          Maximum number of unacknowledged batches, send blocks while it is reached.
+        retry_delay:          Seconds before a batch the hub could not commit is sent again.
+        max_reconnect_delay:  Maximum seconds between two attempts to open the stream.
+    '''
+    self.open_stream = open_stream
+    self.encode = encode
+    self.clear_sessions = clear_sessions
+    self.fallback = fallback
+    self.max_pending = max_pending
+    self.retry_delay = retry_delay
+    self.max_reconnect_delay = max_reconnect_delay
+    self.condition = threading.Condition()
+    self.pending: OrderedDict[int, NumericScalarBatch] = OrderedDict()
+    self.outbox: deque[int] = deque()
+    self.deferred: list[tuple[float, int]] = []
+    self.sequence = 0
+    self.credits = 0
+    self.generation = 0
+    self.call = None
+    self.closed = False
+    self.supported = True
+    self.thread = threading.Thread(target=self._run, name='ingest-stream', daemon=True)
+    self.thread.start()
+
+  def send(self, batches: list[NumericScalarBatch], timeout: float = None) -> bool:
+    ''' Queue batches for sending, returns False if they could not be queued within the timeout or the stream is
+        closed or not supported by the hub.
+    '''
+    with self.condition:
+      if not self.condition.wait_for(
+          lambda: self.closed or not self.supported or len(self.pending) < self.max_pending, timeout=timeout):
+        return False
+      if self.closed or not self.supported:
+        return False
+      for batch in batches:
+        self.sequence += 1
+        self.pending[self.sequence] = batch
+        self.outbox.append(self.sequence)
+      self.condition.notify_all()
+    return True
+
+  def close(self, timeout: float = 10):
+    ''' Wait up to timeout seconds for the pending batches to be acknowledged and close the stream. '''
+    with self.condition:
+      self.condition.wait_for(lambda: not self.pending or not self.supported, timeout=timeout)
+      self.closed = True
+      self.condition.notify_all()
+    self.thread.join(timeout=timeout)
+    if self.thread.is_alive() and self.call is not None:
+      self.call.cancel()
+
+  def _requests(self, generation: int):
+    ''' Requests of one stream, ends as soon as another stream is opened or the stream is closed. '''
+    while True:
+      with self.condition:
+        while True:
+          if self.closed or self.generation != generation:
+            return
+          self._release_deferred()
+          if self.outbox and self.credits > 0:
+            break
+          self.condition.wait(timeout=self.retry_delay / 10 if self.deferred else 1)
+        sequence = self.outbox.popleft()
+        batch = self.pending.get(sequence)
+        if batch is None:
+          continue
+        self.credits -= 1
+      try:
+        request = IngestRequest(sequence=sequence, batch=self.encode(batch))
+      except grpc.RpcError as exc:
+        logger.error(f'Failed to prepare metric batch {sequence}: {exc}')
+        with self.condition:
+          self.credits += 1
+          self.deferred.append((time.monotonic() + self.retry_delay, sequence))
+        continue
+      except Exception as exc:
+        logger.error(f'Dropped metric batch {sequence} which cannot be sent: {exc}')
+        with self.condition:
+          self.credits += 1
+          self.pending.pop(sequence, None)
+          self.condition.notify_all()
+        continue
+      yield request
+
+  def _release_deferred(self):
+    now = time.monotonic()
+    due = [sequence for retry_at, sequence in self.deferred if retry_at <= now]
+    if due:
+      self.deferred = [(retry_at, sequence) for retry_at, sequence in self.deferred if retry_at > now]
+      self.outbox.extend(due)
+
+  def _acknowledge(self, ack: IngestAck):
+    with self.condition:
+      self.credits += ack.credits
+      if ack.sequence in self.pending:
+        if ack.status == PENDING:
+          self.deferred.append((time.monotonic() + self.retry_delay, ack.sequence))
+        else:
+          self.pending.pop(ack.sequence)
+          if ack.status == FAILED:
+            logger.error(f'Hub rejected metric batch {ack.sequence}: {ack.message}')
+      self.condition.notify_all()
+
+  def _run(self):
+    delay = self.retry_delay
+    while True:
+      with self.condition:
+        if self.closed:
+          return
+        self.generation += 1
+        generation = self.generation
+        self.credits = 0
+        self.outbox = deque(self.pending)
+        self.deferred = []
+      try:
+        self.call = self.open_stream(self._requests(generation))
+        for ack in self.call:
+          delay = self.retry_delay
+          self._acknowledge(ack)
+      except grpc.RpcError as exc:
+        if exc.code() == grpc.StatusCode.UNIMPLEMENTED:
+          self._fall_back()
+          return
+        if exc.code() == grpc.StatusCode.RESOURCE_EXHAUSTED:
+          logger.warning(f'Hub refused the ingest stream, send {len(self.pending)} batch(es) without stream.')
+          self._drain()
+        elif exc.code() == grpc.StatusCode.FAILED_PRECONDITION:
+          logger.info(f'Metric session expired, register metrics again: {exc.details()}')
+          self.clear_sessions()
+          delay = 0
+        elif exc.code() != grpc.StatusCode.CANCELLED or not self.closed:
+          logger.error(f'Ingest stream failed, {len(self.pending)} batch(es) unacknowledged: {exc}')
+      except Exception as exc:
+        logger.error(f'Ingest stream failed, {len(self.pending)} batch(es) unacknowledged: {exc}')
+      finally:
+        with self.condition:
+          self.generation += 1
+          self.condition.notify_all()
+      with self.condition:
+        if self.condition.wait_for(lambda: self.closed, timeout=delay):
+          return
+      delay = min(max(delay * 2, self.retry_delay), self.max_reconnect_delay)
+
+  def _send_pending(self) -> bool:
+    ''' Send the pending batches with the fallback, they are only removed from pending once they have been sent. '''
+    with self.condition:
+      pending = list(self.pending.items())
+    if not pending:
+      return True
+    try:
+      sent = self.fallback([batch for _, batch in pending])
+    except Exception as exc:
+      logger.error(f'Failed to send {len(pending)} metric batch(es) without stream: {exc}')
+      sent = False
+    if sent:
+      with self.condition:
+        for sequence, _ in pending:
+          self.pending.pop(sequence, None)
+        self.condition.notify_all()
+    return sent
+
+  def _drain(self):
+    ''' Send the pending batches with SendNumericScalarBatch while the hub has no stream slot, the stream is opened
+        again after the reconnect delay. Batches which could not be sent stay pending for the next stream.
+    '''
+    if not self._send_pending():
+      logger.warning(f'Keep {len(self.pending)} batch(es) pending until the ingest stream is open again.')
+
+  def _fall_back(self):
+    ''' Send the pending batches with SendNumericScalarBatch if the hub does not implement the stream, retried until
+        they are sent or the stream is closed.
+    '''
+    logger.warning('Hub does not support the ingest stream, send metric batches instead.')
+    with self.condition:
+      self.supported = False
+      self.condition.notify_all()
+    delay = self.retry_delay
+    while not self._send_pending():
+      with self.condition:
+        if self.condition.wait_for(lambda: self.closed, timeout=delay):
+          return
+      delay = min(delay * 2, self.max_reconnect_delay)
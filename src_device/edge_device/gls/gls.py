@@ -1,5 +1,7 @@
+import os
 #local
 from iot_libs.logger import LoggerSetup
 
 setup_logger = LoggerSetup()
 logger = setup_logger.get_logger()
+sampled_logger = setup_logger.get_sampled_logger(every=int(os.getenv('LOG_SAMPLE_EVERY', 10)))
@@ -5,14 +5,15 @@ from dataclasses import dataclass, field
 from threading import Event
 from google.protobuf.timestamp_pb2 import Timestamp
 from iot_libs.proto.enums import StubMethod
-from iot_libs.proto.hub_pb2 import NumericScalarValues
+from iot_libs.proto.batch import pack_samples, timestamp_us
+from iot_libs.proto.hub_pb2 import MetricDescriptor, NumericArrayWindow, NumericScalarBatch
 from pathlib import Path
 # local
 from edge_device.gls.gls import logger
 from edge_device.gls.const import SENSOR_TYPES
 from edge_device.api.grpc_client import GrpcClient
 from edge_device.device import Device
-from edge_device.sensors.sensor_simulator import DisturbanceSimulator, SensorSimulator
+from edge_device.sensors.sensor_simulator import DisturbanceSimulator, SensorSimulator, WaveformSimulator
 
 
 def create_sensor(sensor_identifier: str,
@@ -144,38 +145,73 @@ class SimulationManager:
 
   def run_simulation(self, sensor: SensorSimulator):
     ''' Run the simulation for a single sensor. '''
+    if isinstance(sensor, WaveformSimulator):
+      self.run_window_simulation(sensor)
+      return
     while not self.stop_event.is_set():
       try:
         value = sensor.simulate()
         self.timestamp.GetCurrentTime()
-        metrics = []
-        if isinstance(value, dict):
-          for key, val in value.items():
-            metrics.append(
-                NumericScalarValues(tenant_identifier=self.device.tenant_identifier,
-                                    device_identifier=self.device.device_identifier,
-                                    metric_identifier=f'{sensor.metric_identifier}.{key}',
-                                    path=sensor.path,
-                                    value=val,
-                                    timestamp=self.timestamp))
-        else:
-          metrics.append(
-              NumericScalarValues(tenant_identifier=self.device.tenant_identifier,
-                                  device_identifier=self.device.device_identifier,
-                                  metric_identifier=sensor.metric_identifier,
-                                  path=sensor.path,
-                                  value=value,
-                                  timestamp=self.timestamp))
+        metrics = NumericScalarBatch(tenant_identifier=self.device.tenant_identifier,
+                                     device_identifier=self.device.device_identifier)
+        values = value if isinstance(value, dict) else {None: value}
+        for index, (key, val) in enumerate(values.items()):
+          metric_identifier = sensor.metric_identifier if key is None else f'{sensor.metric_identifier}.{key}'
+          metrics.metrics.add(metric_identifier=metric_identifier, path=sensor.path)
+          metrics.metric_index.append(index)
+          metrics.values.append(val)
+          metrics.timestamps_us.append(timestamp_us(self.timestamp))
       except Exception as exc:
         logger.critical(f'Failed to simulate sensor {sensor.sensor_identifier} with exception\n{exc}')
         return
       try:
-        self.grpc_client.send(data=metrics, stub_method=StubMethod.SEND_NUMERIC_SCALAR_VALUES)
+        self.grpc_client.send(data=metrics, stub_method=StubMethod.STREAM_NUMERIC_SCALAR_BATCHES)
       except Exception as exc:
         logger.error(f'Failed to send metric: {metrics} with exception\n{exc}')
       if self.stop_event.wait(sensor.sampling_interval):
         break
 
+  def run_window_simulation(self, sensor: WaveformSimulator):
+    ''' Run the simulation of a waveform sensor, every window of an axis is sent as one NumericArrayWindow. The
+        windows follow each other without gap, the scalar values are sent once per window. The waveforms get their own
+        metric identifiers, e.g. vibration.1.x_axis.waveform, the identifiers of the axes are numeric_scalar metrics
+        of the devices which sent them sample by sample.
+    '''
+    self.timestamp.GetCurrentTime()
+    start_us = timestamp_us(self.timestamp)
+    window_us = int(sensor.window_size / sensor.sample_rate * 1000000)
+    while not self.stop_event.is_set():
+      try:
+        waveforms, values = sensor.simulate_window()
+        windows = [
+            NumericArrayWindow(tenant_identifier=self.device.tenant_identifier,
+                               device_identifier=self.device.device_identifier,
+                               metric=MetricDescriptor(metric_identifier=f'{sensor.metric_identifier}.{key}.waveform',
+                                                       path=sensor.path),
+                               start_us=start_us,
+                               sample_rate=sensor.sample_rate,
+                               samples=pack_samples(samples)) for key, samples in waveforms.items()
+        ]
+        metrics = NumericScalarBatch(tenant_identifier=self.device.tenant_identifier,
+                                     device_identifier=self.device.device_identifier)
+        for index, (key, val) in enumerate(values.items()):
+          metrics.metrics.add(metric_identifier=f'{sensor.metric_identifier}.{key}', path=sensor.path)
+          metrics.metric_index.append(index)
+          metrics.values.append(val)
+          metrics.timestamps_us.append(start_us)
+      except Exception as exc:
+        logger.critical(f'Failed to simulate sensor {sensor.sensor_identifier} with exception\n{exc}')
+        return
+      try:
+        self.grpc_client.send(data=windows, stub_method=StubMethod.SEND_NUMERIC_ARRAY_WINDOWS)
+        if values:
+          self.grpc_client.send(data=metrics, stub_method=StubMethod.STREAM_NUMERIC_SCALAR_BATCHES)
+      except Exception as exc:
+        logger.error(f'Failed to send windows of sensor {sensor.sensor_identifier} with exception\n{exc}')
+      start_us += window_us
+      if self.stop_event.wait(max(start_us + window_us - time.time() * 1000000, 0) / 1000000):
+        break
+
   def _restart_simulations(self):
     ''' Restart all simulations. '''
     self.stop_simulations()
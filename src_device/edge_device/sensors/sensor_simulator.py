@@ -1,7 +1,13 @@
+import numpy as np
 from abc import ABC, abstractmethod
+from iot_libs.logger import Lazy
 # local
 from edge_device.disturbances.disturbance import parse_disturbances
-from edge_device.gls.gls import logger
+from edge_device.gls.gls import logger, sampled_logger
+
+
+def format_disturbances(disturbances: list[tuple[str, float]]) -> str:
+  return ', '.join(f'{disturbance_type}={value}' for disturbance_type, value in disturbances)
 
 
 class SensorSimulator(ABC):
@@ -39,6 +45,22 @@ class SensorSimulator(ABC):
     return f'{self.__class__.__name__}(metric_identifier={self.metric_identifier}, path={self.path}, sampling_interval={self.sampling_interval})'
 
 
+class WaveformSimulator(SensorSimulator):
+  ''' Sensor which sends its waveforms as windows of window_size samples taken at sample_rate, e.g.
+      data={'window_size': 1024, 'sample_rate': 1000}.
+  '''
+
+  def __init__(self, **kwargs):
+    super().__init__(**kwargs)
+    self.window_size = int(self.data.get('window_size', 1024))
+    self.sample_rate = float(self.data.get('sample_rate', 1000))
+
+  @abstractmethod
+  def simulate_window(self) -> tuple[dict[str, np.ndarray], dict[str, float]]:
+    ''' The next window_size samples of each waveform and the scalar values at the start of the window. '''
+    pass
+
+
 class DisturbanceSimulator(SensorSimulator):
   ''' Sensor class to simulate sensor data. '''
 
@@ -52,7 +74,7 @@ class DisturbanceSimulator(SensorSimulator):
     for disturbance in self.disturbance:
       try:
         value = disturbance.simulate()
-        disturbance_logs.append(f'{disturbance.disturbance_type}={value}')
+        disturbance_logs.append((disturbance.disturbance_type, value))
         disturbance_value += value
       except Exception as exc:
         logger.error(f'Failed to simulate disturbance {disturbance.disturbance_type}: {exc}')
@@ -63,6 +85,11 @@ class DisturbanceSimulator(SensorSimulator):
       logger.error(f'Failed to simulate model value: {exc}')
       return 0.0
     if log:
-      values_txt = ', '.join(disturbance_logs)
-      logger.info(f'{self.sensor_type}(metric_identifier={self.metric_identifier}, value={value}, offset={self.offset}, {values_txt})') # yapf: disable
+      sampled_logger.info('%s(metric_identifier=%s, value=%s, offset=%s, %s)',
+                          self.sensor_type,
+                          self.metric_identifier,
+                          value,
+                          self.offset,
+                          Lazy(format_disturbances, disturbance_logs),
+                          key=self.metric_identifier)
     return value
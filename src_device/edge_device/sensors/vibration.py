@@ -1,10 +1,13 @@
 import os
+import numpy as np
 import pandas as pd
 from pathlib import Path
 from iot_libs.const.edge_device import FaultTypes
 # local
-from edge_device.sensors.sensor_simulator import SensorSimulator
-from edge_device.gls.gls import logger
+from edge_device.sensors.sensor_simulator import WaveformSimulator
+from edge_device.gls.gls import sampled_logger
+
+WAVEFORM_COLUMNS = ['x_axis', 'y_axis']
 
 
 def load_data(path: Path) -> pd.DataFrame:
@@ -25,13 +28,20 @@ def load_data(path: Path) -> pd.DataFrame:
   return df
 
 
-class Vibration(SensorSimulator):
+class Vibration(WaveformSimulator):
+  ''' Gear vibration replayed from recorded data. The axes are sent as windows of window_size samples taken at
+      sample_rate, e.g. data={'fault_type': ..., 'window_size': 1024, 'sample_rate': 1000}, the load and speed once per
+      window.
+  '''
   sensor_type = 'vibration'
 
   def __init__(self, **kwags):
     super().__init__(sensor_type=self.sensor_type, **kwags)
     self._load_model()
     self._sample_iter = self.sample_generator()
+    self._waveforms = self.df[WAVEFORM_COLUMNS].to_numpy(dtype=np.float32)
+    self._conditions = self.df.drop(columns=['timestamp', 'fault', *WAVEFORM_COLUMNS])
+    self._position = 0
 
   def sample_generator(self):
     if self.df is None:
@@ -45,9 +55,34 @@ class Vibration(SensorSimulator):
   def simulate(self, log: bool = True) -> float:
     values = next(self._sample_iter)
     if log:
-      logger.info(f'{self.sensor_type}(identifier={self.metric_identifier}, value={values}, fault_type={self.data.get("fault_type")})') # yapf: disable
+      sampled_logger.info('%s(identifier=%s, value=%s, fault_type=%s)',
+                          self.sensor_type,
+                          self.metric_identifier,
+                          values,
+                          self.data.get('fault_type'),
+                          key=self.metric_identifier)
     return values
 
+  def simulate_window(self, log: bool = True) -> tuple[dict[str, np.ndarray], dict[str, float]]:
+    ''' The next window_size samples of each axis and the load and speed at the start of the window, the recorded
+        data is repeated endlessly.
+    '''
+    if self.df.empty:
+      raise ValueError('Gear vibration DataFrame is empty!')
+    indices = (self._position + np.arange(self.window_size)) % len(self._waveforms)
+    window = self._waveforms[indices]
+    conditions = self._conditions.iloc[self._position].to_dict()
+    self._position = int((self._position + self.window_size) % len(self._waveforms))
+    if log:
+      sampled_logger.info('%s(identifier=%s, window_size=%s, conditions=%s, fault_type=%s)',
+                          self.sensor_type,
+                          self.metric_identifier,
+                          self.window_size,
+                          conditions,
+                          self.data.get('fault_type'),
+                          key=self.metric_identifier)
+    return {column: window[:, index] for index, column in enumerate(WAVEFORM_COLUMNS)}, conditions
+
   def _load_model(self):
     try:
       model_path = os.getenv('SENSOR_MODELS_PATH', 'sensor_models')
@@ -0,0 +1,94 @@
+import grpc
+import threading
+from edge_device.api.stream import IngestStream
+from iot_libs.proto.hub_pb2 import NumericScalarBatch
+
+
+class StreamError(grpc.RpcError):
+
+  def __init__(self, code: grpc.StatusCode):
+    self._code = code
+
+  def code(self):
+    return self._code
+
+  def details(self):
+    return self._code.name
+
+
+class FailingStream:
+  ''' Opens streams which the hub rejects with the given status codes, one per attempt. '''
+
+  def __init__(self, *codes: grpc.StatusCode):
+    self.codes = list(codes)
+    self.opened = threading.Event()
+    self.queued = threading.Event()
+    self.attempts = 0
+
+  def __call__(self, requests):
+    self.attempts += 1
+    self.opened.set()
+    self.queued.wait(timeout=5)
+    if self.codes:
+      raise StreamError(self.codes.pop(0))
+    raise StreamError(grpc.StatusCode.UNAVAILABLE)
+
+
+class FlakyFallback:
+  ''' Fallback which fails the given number of times before it sends the batches. '''
+
+  def __init__(self, failures: int, raises: bool = False):
+    self.failures = failures
+    self.raises = raises
+    self.calls: list[list[NumericScalarBatch]] = []
+    self.sent = threading.Event()
+
+  def __call__(self, batches):
+    self.calls.append(batches)
+    if len(self.calls) <= self.failures:
+      if self.raises:
+        raise ConnectionError('hub unavailable')
+      return False
+    self.sent.set()
+    return True
+
+
+def open_ingest_stream(open_stream: FailingStream, fallback: FlakyFallback) -> IngestStream:
+  stream = IngestStream(open_stream=open_stream,
+                        encode=lambda batch: batch,
+                        clear_sessions=lambda: None,
+                        fallback=fallback,
+                        retry_delay=0.01,
+                        max_reconnect_delay=0.05)
+  open_stream.opened.wait(timeout=5)
+  batches = [NumericScalarBatch(tenant_identifier='tenant', values=[float(value)]) for value in range(3)]
+  assert stream.send(batches)
+  open_stream.queued.set()
+  return stream
+
+
+def test_failed_drain_keeps_the_batches_pending():
+  open_stream = FailingStream(grpc.StatusCode.RESOURCE_EXHAUSTED)
+  fallback = FlakyFallback(failures=1, raises=True)
+  stream = open_ingest_stream(open_stream=open_stream, fallback=fallback)
+  try:
+    with stream.condition:
+      assert stream.condition.wait_for(lambda: open_stream.attempts >= 2, timeout=5)
+    assert len(fallback.calls) == 1
+    assert len(stream.pending) == 3
+  finally:
+    stream.close(timeout=0)
+
+
+def test_fallback_is_retried_until_the_batches_are_sent():
+  open_stream = FailingStream(grpc.StatusCode.UNIMPLEMENTED)
+  fallback = FlakyFallback(failures=2)
+  stream = open_ingest_stream(open_stream=open_stream, fallback=fallback)
+  try:
+    assert fallback.sent.wait(timeout=5)
+    assert [[batch.values[0] for batch in batches] for batches in fallback.calls] == [[0, 1, 2]] * 3
+    with stream.condition:
+      assert stream.condition.wait_for(lambda: not stream.pending, timeout=5)
+    assert not stream.supported
+  finally:
+    stream.close(timeout=0)
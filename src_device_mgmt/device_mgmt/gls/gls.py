@@ -1,9 +1,11 @@
 import os
 from iot_libs.logger import LoggerSetup
-from iot_libs.postgres import PostgresManager
+from iot_libs.postgres import pool_options_from_env
+from iot_libs.postgres_aio import AsyncPostgresManager
 
 logger = LoggerSetup().get_logger()
-db_manager = PostgresManager(username=os.getenv('DB_USERNAME'),
-                             password=os.getenv('DB_PASSWORD'),
-                             host=os.getenv('DB_HOST'),
-                             port=os.getenv('DB_PORT', 50000))
+db_manager = AsyncPostgresManager(username=os.getenv('DB_USERNAME'),
+                                  password=os.getenv('DB_PASSWORD'),
+                                  host=os.getenv('DB_HOST'),
+                                  port=os.getenv('DB_PORT', 50000),
+                                  **pool_options_from_env())
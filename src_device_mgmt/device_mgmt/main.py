@@ -1,16 +1,24 @@
 import os
 import uvicorn
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 from fastapi import FastAPI
 # local
 from device_mgmt.routers import home, devices, sensors, ws_endpoint
-from device_mgmt.gls.gls import logger
+from device_mgmt.gls.gls import logger, db_manager
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+  yield
+  await db_manager.dispose()
 
 
 def create_app() -> FastAPI:
   app = FastAPI(title='Iot Device Management API',
                 description='Iot device management API for the MSE project work.',
-                version='0.0.1')
+                version='0.0.1',
+                lifespan=lifespan)
   app.include_router(home.router, include_in_schema=False)
   app.include_router(devices.router)
   app.include_router(sensors.router)
@@ -0,0 +1,221 @@
+import asyncio
+import grpc
+from google.protobuf.empty_pb2 import Empty
+from iot_libs.proto.batch import (ACCEPTED_BATCHES_KEY, pack_numeric_scalar_values, validate_batch, validate_window,
+                                  window_sample_count)
+from iot_libs.proto.hub_pb2 import IngestAck, MetricHandles
+from iot_libs.proto.hub_pb2_grpc import HubServicer, add_HubServicer_to_server
+# local
+from hub.gls.gls import logger, sampled_logger
+from hub.buffer import Buffer, OnCommit, OverflowPolicy
+from hub.telemetry import SAMPLES_RECEIVED
+from hub.handles import HandleRegistry, UnknownSessionError
+from hub.ingest import IngestStream
+from hub.liveness import LivenessIndex
+
+
+async def put_async(buffer: Buffer, item, on_commit: OnCommit = None, max_delay: float = 0.1):
+  ''' Hand data to a buffer without blocking the event loop. If the queue is full the stream waits, which applies
+      backpressure to the client through the gRPC flow control, or the data is spilled to the spool in a worker
+      thread.
+  '''
+  delay = 0.001
+  while not buffer.try_put(item, on_commit=on_commit):
+    if buffer.overflow_policy == OverflowPolicy.SPILL:
+      await asyncio.to_thread(buffer.put, item, on_commit)
+      return
+    await asyncio.sleep(delay)
+    delay = min(delay * 2, max_delay)
+
+
+class AsyncHubService(HubServicer):
+  ''' Asyncio service for receiving metrics from devices, all streams are served by a single event loop. '''
+
+  def __init__(self,
+               metrics_buffer: Buffer,
+               device_status_buffer: Buffer,
+               liveness: LivenessIndex = None,
+               handles: HandleRegistry = None,
+               ingest_window: int = 64,
+               array_buffer: Buffer = None):
+    super().__init__()
+    self.metrics_buffer = metrics_buffer
+    self.device_status_buffer = device_status_buffer
+    self.liveness = liveness
+    self.handles = HandleRegistry() if handles is None else handles
+    self.ingest_window = ingest_window
+    self.array_buffer = array_buffer
+
+  async def SendNumericScalarValues(self, request_iterator, context: grpc.aio.ServicerContext) -> Empty:
+    try:
+      async for request in request_iterator:
+        sampled_logger.info('Received metrics: \n%s', request)
+        SAMPLES_RECEIVED.inc(tenant=request.tenant_identifier, type='numeric_scalar')
+        for batch in pack_numeric_scalar_values([request]):
+          await put_async(buffer=self.metrics_buffer, item=batch)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendNumericData: {exc}')
+      context.set_details(f'Error processing data: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+  async def SendNumericScalarBatch(self, request_iterator, context: grpc.aio.ServicerContext) -> Empty:
+    accepted = 0
+    try:
+      async for request in request_iterator:
+        request = self.handles.expand(request)
+        validate_batch(request)
+        sampled_logger.info('Received %d metric(s) of device %s', len(request.values), request.device_identifier)
+        SAMPLES_RECEIVED.inc(len(request.values), tenant=request.tenant_identifier, type='numeric_scalar')
+        await put_async(buffer=self.metrics_buffer, item=request)
+        accepted += 1
+      return Empty()
+    except UnknownSessionError as exc:
+      context.set_trailing_metadata(((ACCEPTED_BATCHES_KEY, str(accepted)),))
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+      return Empty()
+    except ValueError as exc:
+      logger.warning(f'Rejected invalid batch in SendNumericScalarBatch: {exc}')
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendNumericScalarBatch: {exc}')
+      context.set_details(f'Error processing data: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+  async def StreamNumericScalarBatches(self, request_iterator, context: grpc.aio.ServicerContext):
+    ''' Acknowledge every batch once it is committed, the writer threads hand the acknowledgements to the event
+        loop.
+    '''
+    loop = asyncio.get_running_loop()
+    acks = asyncio.Queue()
+    stream = IngestStream(emit=lambda ack: loop.call_soon_threadsafe(acks.put_nowait, ack))
+    reader = asyncio.create_task(self._read_ingest_requests(request_iterator, stream))
+    try:
+      yield IngestAck(credits=self.ingest_window)
+      while True:
+        ack = await acks.get()
+        if ack is None:
+          return
+        if isinstance(ack, UnknownSessionError):
+          await context.abort(grpc.StatusCode.FAILED_PRECONDITION, str(ack))
+        yield ack
+    finally:
+      reader.cancel()
+
+  async def _read_ingest_requests(self, request_iterator, stream: IngestStream):
+    try:
+      async for request in request_iterator:
+        try:
+          batch = self.handles.expand(request.batch)
+          validate_batch(batch)
+        except ValueError as exc:
+          logger.warning(f'Rejected invalid batch in StreamNumericScalarBatches: {exc}')
+          stream.reject(sequence=request.sequence, message=str(exc))
+          continue
+        SAMPLES_RECEIVED.inc(len(batch.values), tenant=batch.tenant_identifier, type='numeric_scalar')
+        await put_async(buffer=self.metrics_buffer, item=batch, on_commit=stream.accept(sequence=request.sequence))
+    except UnknownSessionError as exc:
+      stream.fail(exc)
+    except asyncio.CancelledError:
+      raise
+    except Exception as exc:
+      logger.info(f'Ingest stream closed: {exc}')
+    finally:
+      stream.close_reader()
+
+  async def SendNumericArrayWindows(self, request_iterator, context: grpc.aio.ServicerContext) -> Empty:
+    if self.array_buffer is None:
+      context.set_details('Array windows are not enabled.')
+      context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+      return Empty()
+    try:
+      async for window in request_iterator:
+        validate_window(window)
+        sample_count = window_sample_count(window)
+        sampled_logger.info('Received window of %d sample(s) of device %s', sample_count, window.device_identifier)
+        SAMPLES_RECEIVED.inc(sample_count, tenant=window.tenant_identifier, type='numeric_array')
+        await put_async(buffer=self.array_buffer, item=window)
+      return Empty()
+    except ValueError as exc:
+      logger.warning(f'Rejected invalid window in SendNumericArrayWindows: {exc}')
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendNumericArrayWindows: {exc}')
+      context.set_details(f'Error processing data: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+  async def RegisterMetrics(self, request, context: grpc.aio.ServicerContext) -> MetricHandles:
+    try:
+      handles = self.handles.register(request)
+      logger.info(f'Registered {len(request.metrics)} metric(s) of device {request.device_identifier}')
+      return handles
+    except UnknownSessionError as exc:
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+      return MetricHandles()
+    except ValueError as exc:
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return MetricHandles()
+
+  async def SendDeviceStatus(self, request, context: grpc.aio.ServicerContext) -> Empty:
+    try:
+      sampled_logger.info('Received Device Status: \n%s', request)
+      SAMPLES_RECEIVED.inc(tenant=request.tenant_identifier, type='device_status')
+      if self.liveness is not None:
+        self.liveness.observe(request)
+      await put_async(buffer=self.device_status_buffer, item=request)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendDeviceStatus: {exc}')
+      context.set_details(f'Error processing device status: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+
+async def serve(host: str,
+                port: str | int,
+                metrics_buffer: Buffer,
+                device_status_buffer: Buffer,
+                liveness: LivenessIndex = None,
+                handles: HandleRegistry = None,
+                ingest_window: int = 64,
+                grace_seconds: float = 5,
+                array_buffer: Buffer = None) -> None:
+  ''' Run the asyncio gRPC server until it is terminated.
+
+      Parameters
+      ----------
+      host:                  The host to bind the server to.
+      port:                  The port to bind the server to.
+      metrics_buffer:        The buffer for the numeric scalar metrics.
+      device_status_buffer:  The buffer for the device status.
+      liveness:              The liveness index fed by the received device status.
+      handles:               The sessions of the registered metric handles.
+      ingest_window:         Batches a client may send on an ingest stream before it has to wait for acknowledgements.
+      grace_seconds:         Seconds active streams get to finish when the server is stopped.
+      array_buffer:          The buffer for the windows of the waveform metrics, None rejects them.
+  '''
+  server = grpc.aio.server(options=[('grpc.so_reuseport', 1)])
+  add_HubServicer_to_server(
+      AsyncHubService(metrics_buffer=metrics_buffer,
+                      device_status_buffer=device_status_buffer,
+                      liveness=liveness,
+                      handles=handles,
+                      ingest_window=ingest_window,
+                      array_buffer=array_buffer), server)
+  server.add_insecure_port(f'{host}:{port}')
+  await server.start()
+  logger.info(f'Asyncio gRPC server listening on {host}:{port}')
+  try:
+    await server.wait_for_termination()
+  finally:
+    await server.stop(grace_seconds)
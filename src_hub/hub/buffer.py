@@ -1,16 +1,29 @@
 import threading
+import time
+from functools import partial
 from abc import ABC, abstractmethod
 from collections import defaultdict
-from sqlalchemy.orm import scoped_session
-from queue import Empty, Queue
+from dataclasses import dataclass, field
+from enum import Enum
+from google.protobuf.message import Message
+from sqlalchemy.engine import Connection
+from queue import Empty, Full, Queue
 from typing import Callable
-from iot_libs.proto.hub_pb2 import NumericScalarValues, DeviceStatus
+from iot_libs.logger import Lazy
+from iot_libs.postgres import is_connection_error
+from iot_libs.proto.hub_pb2 import NumericArrayWindow, NumericScalarBatch, NumericScalarValues, DeviceStatus
 # local
-from hub.gls.gls import logger, db_manager
+from hub.gls.gls import logger, db_manager, rate_limited_logger
+from hub.spool import Spool, SpoolFullError, SpoolReplayer
+from hub.telemetry import (BATCH_ROWS, BATCH_WAIT_SECONDS, DROPPED_ROWS, FAILED_BATCHES, FLUSH_SECONDS,
+                           LANE_OVERFLOWS, QUEUE_DEPTH, QUEUE_WAIT_SECONDS, ROWS_WRITTEN, SPOOLED_ROWS,
+                           WRITE_SECONDS, WRITER_PENDING)
+from hub.writer import WriterPool
+from hub.queries.arrays import update_array_windows
 from hub.queries.metrics import update_metrics
 from hub.queries.devices import update_device_status
 
-DatabaseQuery = Callable[[list, scoped_session], None]
+DatabaseQuery = Callable[[list, Connection], None]
 
 
 def check_tenant_identifier(metrics_batch: list[NumericScalarValues]):
@@ -24,11 +37,18 @@ def check_tenant_identifier(metrics_batch: list[NumericScalarValues]):
   return tenant_identifiers.pop()
 
 
+def count_rows(item: Message) -> int:
+  ''' The number of rows an item writes, a batch of samples writes one row per sample. '''
+  if isinstance(item, NumericScalarBatch):
+    return len(item.values)
+  return 1
+
+
 def count_metrics_per_device(metrics_batch: list[NumericScalarValues]) -> str:
   ''' Count the number of metrics per device in the batch. '''
   device_metrics_count = defaultdict(int)
   for metric in metrics_batch:
-    device_metrics_count[metric.device_identifier] += 1
+    device_metrics_count[metric.device_identifier] += count_rows(metric)
   return ', '.join([f'device {device}: {count}' for device, count in device_metrics_count.items()])
 
 
@@ -46,70 +66,355 @@ def write_to_database(batch: list[NumericScalarValues],
       log:                Log the data written to the database.
   '''
   tenant_identifier = check_tenant_identifier(batch)
+  query_name = database_query.__name__
   try:
-    with db_manager(f'tenant_{tenant_identifier}') as conn:
+    with WRITE_SECONDS.time(query=query_name), db_manager.connection(f'tenant_{tenant_identifier}') as conn:
       if log:
-        device_counts = count_metrics_per_device(batch)
-        logger.info(f'Writing to tenant database: {tenant_identifier}, {device_counts} metrics.')
+        rate_limited_logger.info('Writing to tenant database: %s, %s metrics.', tenant_identifier,
+                                 Lazy(count_metrics_per_device, batch))
       database_query(batch=batch, conn=conn)
   except Exception as exc:
     logger.error(f'Failed to write to database: {exc}')
+    raise
+  ROWS_WRITTEN.inc(sum(count_rows(item) for item in batch), query=query_name, tenant=tenant_identifier)
+
+
+class CommitResult(Enum):
+  ''' Outcome of buffered data reported to its sender. '''
+  COMMITTED = 'committed'
+  RETRY = 'retry'
+  REJECTED = 'rejected'
+
+
+OnCommit = Callable[[CommitResult], None]
+
+
+class OverflowPolicy(Enum):
+  ''' Behaviour of a buffer if its queue is full. '''
+  BLOCK = 'block'
+  DROP_OLDEST = 'drop_oldest'
+  SPILL = 'spill'
+
+
+@dataclass
+class TenantBatch:
+  ''' Pending data of a single tenant. '''
+  items: list = field(default_factory=list)
+  rows: int = 0
+  size_bytes: int = 0
+  started: float = field(default_factory=time.monotonic)
+  positions: dict = field(default_factory=dict)
+  callbacks: list[OnCommit] = field(default_factory=list)
+
+
+def notify(callbacks: list[OnCommit], result: CommitResult):
+  ''' Tell the senders of the data whether it has been committed to the database or the spool. '''
+  for callback in callbacks:
+    try:
+      callback(result)
+    except Exception as exc:
+      logger.error(f'Commit callback failed: {exc}')
 
 
 class Buffer(ABC):
-  ''' Metrics buffer before the metrics will be written into the database. '''
+  ''' Metrics buffer before the metrics will be written into the database.
 
-  def __init__(self, queue: Queue, batch_size: int = 5):
+      A batch of a tenant is written as soon as it reaches max_batch_rows, max_batch_bytes or is older than linger_ms,
+      whichever comes first. Batches which can not be written because the database is unavailable are appended to
+      the spool and replayed once the database is healthy again.
+  '''
+  message_type: type[Message] = None
+
+  def __init__(self,
+               queue: Queue,
+               max_batch_rows: int = 5,
+               max_batch_bytes: int = 1048576,
+               linger_ms: int = 1000,
+               overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+               spool: Spool = None,
+               writer_pool_size: int = 0,
+               spool_on_failure: bool = False,
+               replay_rows_per_second: float = 1000):
     ''' Paramters
         ---------
-        queue:      The queue to read the data from.
-        batch_size: The number of data to write to the database at once.
+        queue:            The bounded queue to read the data from.
+        max_batch_rows:   The maximum number of data to write to the database at once.
+        max_batch_bytes:  The maximum serialized size of the data to write to the database at once.
+        linger_ms:        The maximum time in milliseconds data waits in a batch before it is written.
+        overflow_policy:  What to do with new data if the queue is full.
+        spool:            The disk spool for data which does not fit into the queue or failed to be written.
+        writer_pool_size: The number of threads writing the tenant batches concurrently, 0 writes them inline.
+        spool_on_failure: Spool batches which failed to be written because the database is unavailable.
+        replay_rows_per_second: The maximum rate at which spooled data is written to the database.
     '''
+    if (overflow_policy == OverflowPolicy.SPILL or spool_on_failure) and spool is None:
+      raise ValueError('The spill overflow policy and spooling on failure require a spool.')
     self.shutdown_event = threading.Event()
     self.queue = queue
-    self.batch_size = batch_size
+    self.max_batch_rows = max_batch_rows
+    self.max_batch_bytes = max_batch_bytes
+    self.linger_seconds = linger_ms / 1000
+    self.overflow_policy = overflow_policy
+    self.spool = spool
+    self.spool_on_failure = spool_on_failure
+    self.dropped = 0
+    self.replayer = None
+    if spool is not None:
+      self.replayer = SpoolReplayer(spool=spool,
+                                    decode=self.message_type.FromString,
+                                    write_batch=self.write_data,
+                                    is_retryable=is_connection_error,
+                                    count_rows=count_rows,
+                                    rows_per_second=replay_rows_per_second,
+                                    batch_rows=max_batch_rows)
+    self.writer_pool = None
+    if writer_pool_size > 0:
+      self.writer_pool = WriterPool(size=writer_pool_size, name=f'{self.__class__.__name__}-writer')
+      WRITER_PENDING.set_function(self.writer_pool.pending, buffer=self.__class__.__name__)
+    QUEUE_DEPTH.set_function(self.queue.qsize, buffer=self.__class__.__name__)
+
+  def put(self, item: NumericScalarValues | DeviceStatus, on_commit: OnCommit = None):
+    ''' Add data to the queue according to the overflow policy.
+
+        Parameters
+        ----------
+        item:       The data to write to the database.
+        on_commit:  Called with the commit result once the data is committed to the database or the spool, or has
+                    been dropped. Data dropped because of an overload or an unavailable database can be retried.
+    '''
+    entry = (item, on_commit, time.monotonic())
+    if self.overflow_policy == OverflowPolicy.BLOCK:
+      self.queue.put(entry)
+      return
+    try:
+      self.queue.put_nowait(entry)
+      return
+    except Full:
+      pass
+    if self.overflow_policy == OverflowPolicy.SPILL:
+      try:
+        self.spool.append([item.SerializeToString()])
+        SPOOLED_ROWS.inc(buffer=self.__class__.__name__)
+        result = CommitResult.COMMITTED
+      except SpoolFullError as exc:
+        self.dropped += 1
+        DROPPED_ROWS.inc(buffer=self.__class__.__name__, reason='spool_full')
+        logger.error(f'Dropped {self.__class__.__name__} data: {exc}')
+        result = CommitResult.RETRY
+      if on_commit is not None:
+        notify([on_commit], result=result)
+      return
+    while True:
+      try:
+        _, dropped_on_commit, _ = self.queue.get_nowait()
+        self.queue.task_done()
+        if dropped_on_commit is not None:
+          notify([dropped_on_commit], result=CommitResult.RETRY)
+        self.dropped += 1
+        DROPPED_ROWS.inc(buffer=self.__class__.__name__, reason='drop_oldest')
+        if self.dropped % 1000 == 1:
+          logger.warning(f'{self.__class__.__name__} queue is full, dropped {self.dropped} oldest item(s) so far.')
+      except Empty:
+        pass
+      try:
+        self.queue.put_nowait(entry)
+        return
+      except Full:
+        continue
+
+  def try_put(self, item: NumericScalarValues | DeviceStatus, on_commit: OnCommit = None) -> bool:
+    ''' Add data to the queue without blocking or writing to disk, returns False if the queue is full and the block
+        policy would have to wait or the spill policy would have to append to the spool.
+    '''
+    try:
+      self.queue.put_nowait((item, on_commit, time.monotonic()))
+      return True
+    except Full:
+      pass
+    if self.overflow_policy == OverflowPolicy.DROP_OLDEST:
+      self.put(item, on_commit=on_commit)
+      return True
+    return False
 
   def process(self):
     ''' Process the queue data. '''
-    batches: dict[list] = defaultdict(list)
+    batches: dict[str, TenantBatch] = {}
+    if self.writer_pool:
+      self.writer_pool.start()
+    if self.replayer:
+      replayer_thread = threading.Thread(target=self.replayer.run, name=f'{self.__class__.__name__}-replayer')
+      replayer_thread.start()
     while not self.shutdown_event.is_set() or not self.queue.empty():
       try:
-        metric = self.queue.get(timeout=1)
-        if metric is None:
+        entry = self.queue.get(timeout=self._next_timeout(batches))
+        if entry is None:
           break
-        batches[metric.tenant_identifier].append(metric)
-        if len(batches[metric.tenant_identifier]) >= self.batch_size:
-          self.write_data(batches[metric.tenant_identifier])
-          batches[metric.tenant_identifier] = []
+        QUEUE_WAIT_SECONDS.observe(time.monotonic() - entry[2], buffer=self.__class__.__name__)
+        self._add(batches=batches, item=entry[0], on_commit=entry[1])
         self.queue.task_done()
       except Empty:
-        continue
-    for _, batch in batches.items():
-      self.write_data(batch=batch)
+        pass
+      self._flush_expired(batches=batches)
+    for tenant, batch in batches.items():
+      self._dispatch(tenant_identifier=tenant, batch=batch)
+    if self.writer_pool:
+      self.writer_pool.stop()
+    if self.replayer:
+      self.replayer.stop()
+      replayer_thread.join()
+      self.spool.close()
+
+  def _add(self, batches: dict[str, TenantBatch], item: NumericScalarValues | DeviceStatus, on_commit: OnCommit = None):
+    batch = batches.get(item.tenant_identifier)
+    if batch is None:
+      batch = batches[item.tenant_identifier] = TenantBatch()
+    if on_commit is not None:
+      batch.callbacks.append(on_commit)
+    key = self.coalesce_key(item)
+    if key is not None and key in batch.positions:
+      position = batch.positions[key]
+      if self.supersedes(item, batch.items[position]):
+        batch.items[position] = item
+      return
+    if key is not None:
+      batch.positions[key] = len(batch.items)
+    batch.items.append(item)
+    batch.rows += count_rows(item)
+    batch.size_bytes += item.ByteSize()
+    if batch.rows >= self.max_batch_rows or batch.size_bytes >= self.max_batch_bytes:
+      del batches[item.tenant_identifier]
+      self._dispatch(tenant_identifier=item.tenant_identifier, batch=batch)
+
+  def coalesce_key(self, item: NumericScalarValues | DeviceStatus) -> str | None:
+    ''' Items of a batch with the same key are coalesced into one, None keeps every item. '''
+    return None
+
+  def supersedes(self, item: NumericScalarValues | DeviceStatus, current: NumericScalarValues | DeviceStatus) -> bool:
+    ''' Check if an item replaces the pending item with the same coalesce key. '''
+    return True
+
+  def _flush_expired(self, batches: dict[str, TenantBatch]):
+    now = time.monotonic()
+    expired = [tenant for tenant, batch in batches.items() if now - batch.started >= self.linger_seconds]
+    for tenant in expired:
+      self._dispatch(tenant_identifier=tenant, batch=batches.pop(tenant))
+
+  def _dispatch(self, tenant_identifier: str, batch: TenantBatch):
+    ''' Hand a full batch to the lane of its tenant or write it inline without writer pool. '''
+    BATCH_ROWS.observe(batch.rows, buffer=self.__class__.__name__)
+    BATCH_WAIT_SECONDS.observe(time.monotonic() - batch.started, buffer=self.__class__.__name__)
+    if not self.writer_pool:
+      self.flush(batch=batch.items, callbacks=batch.callbacks)
+      return
+    # only the block policy without spool waits for a full lane, which stalls the batches of all tenants
+    block = self.spool is None and self.overflow_policy == OverflowPolicy.BLOCK
+    if not self.writer_pool.submit(tenant_identifier=tenant_identifier,
+                                   write_batch=partial(self.flush, callbacks=batch.callbacks),
+                                   batch=batch.items,
+                                   block=block):
+      self._overflow_lane(tenant_identifier=tenant_identifier, batch=batch)
+
+  def _overflow_lane(self, tenant_identifier: str, batch: TenantBatch):
+    ''' The lane of a slow tenant is full. The batch is spilled to the spool, from where the replayer writes it later,
+        or dropped without spool, so that the batches of the other tenants keep being dispatched.
+    '''
+    buffer_name = self.__class__.__name__
+    if self.spool is not None:
+      try:
+        self.spool.append([item.SerializeToString() for item in batch.items])
+        LANE_OVERFLOWS.inc(buffer=buffer_name, action='spooled')
+        SPOOLED_ROWS.inc(batch.rows, buffer=buffer_name)
+        rate_limited_logger.warning('Writer lane of tenant %s is full, spooled %d row(s).', tenant_identifier,
+                                    batch.rows)
+        notify(batch.callbacks, result=CommitResult.COMMITTED)
+        return
+      except SpoolFullError as exc:
+        logger.error(f'Dropped {buffer_name} batch of tenant {tenant_identifier}: {exc}')
+    self.dropped += len(batch.items)
+    LANE_OVERFLOWS.inc(buffer=buffer_name, action='dropped')
+    DROPPED_ROWS.inc(batch.rows, buffer=buffer_name, reason='lane_full')
+    rate_limited_logger.warning('Writer lane of tenant %s is full, dropped %d row(s).', tenant_identifier, batch.rows)
+    notify(batch.callbacks, result=CommitResult.RETRY)
+
+  def flush(self, batch: list[NumericScalarValues] | list[DeviceStatus], callbacks: list[OnCommit] = ()):
+    ''' Write a batch to the database, the batch is spooled if the database is unavailable. Afterwards the
+        callbacks are notified whether the batch has been committed.
+    '''
+    result = self._flush(batch=batch)
+    if callbacks:
+      notify(callbacks, result=result)
+
+  def _flush(self, batch: list[NumericScalarValues] | list[DeviceStatus]) -> CommitResult:
+    buffer_name = self.__class__.__name__
+    rows = sum(count_rows(item) for item in batch)
+    try:
+      with FLUSH_SECONDS.time(buffer=buffer_name):
+        self.write_data(batch=batch)
+      return CommitResult.COMMITTED
+    except Exception as exc:
+      if not (self.spool_on_failure and is_connection_error(exc)):
+        FAILED_BATCHES.inc(buffer=buffer_name, action='dropped')
+        DROPPED_ROWS.inc(rows, buffer=buffer_name, reason='write_failed')
+        logger.error(f'Failed to write {buffer_name} batch to database: {exc}', exc_info=True)
+        return CommitResult.RETRY if is_connection_error(exc) else CommitResult.REJECTED
+    try:
+      self.spool.append([item.SerializeToString() for item in batch])
+      FAILED_BATCHES.inc(buffer=buffer_name, action='spooled')
+      SPOOLED_ROWS.inc(rows, buffer=buffer_name)
+      logger.warning(f'Database unavailable, spooled {len(batch)} {self.message_type.__name__} item(s).')
+      return CommitResult.COMMITTED
+    except SpoolFullError as exc:
+      self.dropped += len(batch)
+      FAILED_BATCHES.inc(buffer=buffer_name, action='dropped')
+      DROPPED_ROWS.inc(rows, buffer=buffer_name, reason='spool_full')
+      logger.error(f'Dropped {self.__class__.__name__} batch: {exc}')
+      return CommitResult.RETRY
+
+  def _next_timeout(self, batches: dict[str, TenantBatch]) -> float:
+    if not batches:
+      return 1
+    oldest = min(batch.started for batch in batches.values())
+    return min(1, max(0, oldest + self.linger_seconds - time.monotonic()))
 
   @abstractmethod
   def write_data(self, batch: list[NumericScalarValues] | list[DeviceStatus]):
-    ''' Write the queue data to the database. '''
+    ''' Write the queue data to the database, raises if the data could not be written. '''
     pass
 
 
 class NumericScalarMetricsBuffer(Buffer):
-  ''' Buffer implementation for writing numeric scalar metrics to the database. '''
+  ''' Buffer implementation for writing numeric scalar metrics to the database, the samples are buffered as packed
+      batches.
+  '''
+  message_type = NumericScalarBatch
 
-  def write_data(self, batch: list[NumericScalarValues]):
-    try:
-      logger.info('Insert metrics into database')
-      write_to_database(batch=batch, database_query=update_metrics, log=True)
-    except Exception as exc:
-      logger.error(f'Failed to write metrics batch to database: {exc}', exc_info=True)
+  def write_data(self, batch: list[NumericScalarBatch]):
+    rate_limited_logger.info('Insert metrics into database')
+    write_to_database(batch=batch, database_query=update_metrics, log=True)
+
+
+class NumericArrayWindowsBuffer(Buffer):
+  ''' Buffer implementation for writing the windows of waveform metrics to the database, one row per window. '''
+  message_type = NumericArrayWindow
+
+  def write_data(self, batch: list[NumericArrayWindow]):
+    rate_limited_logger.info('Insert %d array window(s) into database', len(batch))
+    write_to_database(batch=batch, database_query=update_array_windows, log=True)
 
 
 class DeviceStatusBuffer(Buffer):
-  ''' Buffer implementation for writing device metrics to the database. '''
+  ''' Buffer implementation for writing device metrics to the database.
+
+      Only the latest status of a device within a batch is kept, so a flush writes one row per device.
+  '''
+  message_type = DeviceStatus
+
+  def coalesce_key(self, item: DeviceStatus) -> str:
+    return item.device_identifier
+
+  def supersedes(self, item: DeviceStatus, current: DeviceStatus) -> bool:
+    return (item.timestamp.seconds, item.timestamp.nanos) >= (current.timestamp.seconds, current.timestamp.nanos)
 
   def write_data(self, batch: list[DeviceStatus]):
-    try:
-      logger.info('Updating device status')
-      write_to_database(batch=batch, database_query=update_device_status, log=True)
-    except Exception as exc:
-      logger.error(f'Failed to write metrics batch to database: {exc}', exc_info=True)
+    rate_limited_logger.info('Updating device status of %d device(s)', len(batch))
+    write_to_database(batch=batch, database_query=update_device_status, log=True)
@@ -0,0 +1,77 @@
+import threading
+import time
+from collections import OrderedDict
+
+# (tenant, device, name) or (tenant, device, name, type), the first two items identify the device
+CacheKey = tuple[str, ...]
+
+
+class IdCache:
+  ''' Thread safe LRU cache which maps (tenant, device, name) keys to their database ids.
+
+      Failed lookups are remembered for a short time (negative entries) so that samples of an unknown device do not
+      hit the database again for every sample.
+  '''
+
+  def __init__(self, max_size: int = 100000, negative_ttl_seconds: float = 30):
+    ''' Parameters
+        ----------
+        max_size:              Maximum number of cached ids, the least recently used ids are evicted first.
+        negative_ttl_seconds:  Seconds a failed lookup is remembered before the database is queried again.
+    '''
+    self.max_size = max_size
+    self.negative_ttl_seconds = negative_ttl_seconds
+    self.entries: OrderedDict[CacheKey, str] = OrderedDict()
+    self.negative_entries: dict[CacheKey, float] = {}
+    self.lock = threading.Lock()
+
+  def get(self, key: CacheKey) -> str | None:
+    ''' Return the cached id and mark the key as recently used. '''
+    with self.lock:
+      value = self.entries.get(key)
+      if value is not None:
+        self.entries.move_to_end(key)
+      return value
+
+  def put(self, key: CacheKey, value: str):
+    ''' Cache the id of the key and evict the least recently used ids if the cache is full. '''
+    with self.lock:
+      self.entries[key] = value
+      self.entries.move_to_end(key)
+      self.negative_entries.pop(key, None)
+      while len(self.entries) > self.max_size:
+        self.entries.popitem(last=False)
+
+  def is_negative(self, key: CacheKey) -> bool:
+    ''' Check if a lookup of the key failed within the negative ttl. '''
+    with self.lock:
+      expires = self.negative_entries.get(key)
+      if expires is None:
+        return False
+      if expires < time.monotonic():
+        del self.negative_entries[key]
+        return False
+      return True
+
+  def put_negative(self, key: CacheKey):
+    ''' Remember a failed lookup of the key. '''
+    with self.lock:
+      self.negative_entries[key] = time.monotonic() + self.negative_ttl_seconds
+      while len(self.negative_entries) > self.max_size:
+        self.negative_entries.pop(next(iter(self.negative_entries)))
+
+  def invalidate_device(self, tenant_identifier: str, device_identifier: str):
+    ''' Remove all cached ids and negative entries of a device, e.g. after the device was removed. '''
+    with self.lock:
+      for entries in (self.entries, self.negative_entries):
+        keys = [key for key in entries if key[0] == tenant_identifier and key[1] == device_identifier]
+        for key in keys:
+          del entries[key]
+
+  def clear(self):
+    with self.lock:
+      self.entries.clear()
+      self.negative_entries.clear()
+
+  def __len__(self) -> int:
+    return len(self.entries)
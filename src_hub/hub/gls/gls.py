@@ -1,11 +1,21 @@
 import os
 from iot_libs.logger import LoggerSetup
-from iot_libs.postgres import PostgresManager
+from iot_libs.postgres import PostgresManager, pool_options_from_env
 from dotenv import load_dotenv
+# local
+from hub.cache import IdCache
 
 load_dotenv()
-logger = LoggerSetup().get_logger()
+setup_logger = LoggerSetup()
+logger = setup_logger.get_logger()
+sampled_logger = setup_logger.get_sampled_logger(every=int(os.getenv('LOG_SAMPLE_EVERY', 1000)))
+rate_limited_logger = setup_logger.get_rate_limited_logger(per_second=float(os.getenv('LOG_RATE_PER_SECOND', 1)))
 db_manager = PostgresManager(username=os.getenv('DB_USERNAME'),
                              password=os.getenv('DB_PASSWORD'),
                              host=os.getenv('DB_HOST'),
-                             port=os.getenv('DB_PORT', 50000))
+                             port=os.getenv('DB_PORT', 50000),
+                             **pool_options_from_env())
+path_id_cache = IdCache(max_size=int(os.getenv('ID_CACHE_SIZE', 100000)),
+                        negative_ttl_seconds=float(os.getenv('ID_CACHE_NEGATIVE_TTL_SECONDS', 30)))
+metric_id_cache = IdCache(max_size=int(os.getenv('ID_CACHE_SIZE', 100000)),
+                          negative_ttl_seconds=float(os.getenv('ID_CACHE_NEGATIVE_TTL_SECONDS', 30)))
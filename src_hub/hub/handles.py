@@ -0,0 +1,91 @@
+import threading
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from iot_libs.proto.batch import DescriptorKey, descriptor_key
+from iot_libs.proto.hub_pb2 import MetricDescriptor, MetricHandles, MetricRegistration, NumericScalarBatch
+
+
+class UnknownSessionError(Exception):
+  pass
+
+
+@dataclass
+class MetricSession:
+  ''' The metrics a device registered, the handle of a metric is its position in metrics. '''
+  tenant_identifier: str
+  device_identifier: str
+  metrics: list[MetricDescriptor] = field(default_factory=list)
+  handles: dict[DescriptorKey, int] = field(default_factory=dict)
+
+
+class HandleRegistry:
+  ''' Sessions of registered metrics, so that devices send integer handles instead of the metric strings.
+
+      The sessions only live in the memory of the hub process. A device whose session is unknown, e.g. after a
+      restart of the hub, has to register its metrics again. Batches are expanded back to metric descriptors before
+      they are buffered, so spooled data does not depend on the session.
+  '''
+
+  def __init__(self, max_sessions: int = 100000):
+    ''' Parameters
+        ----------
+        max_sessions:  Maximum number of sessions, the least recently used sessions are dropped first.
+    '''
+    self.max_sessions = max_sessions
+    self.sessions: OrderedDict[str, MetricSession] = OrderedDict()
+    self.lock = threading.Lock()
+
+  def register(self, registration: MetricRegistration) -> MetricHandles:
+    ''' Register metrics in a new session or add them to the given session, already registered metrics keep their
+        handle.
+    '''
+    with self.lock:
+      if registration.session_id:
+        session = self._get(registration.session_id)
+        if (session.tenant_identifier, session.device_identifier) != (registration.tenant_identifier,
+                                                                      registration.device_identifier):
+          raise ValueError(f'Session {registration.session_id} belongs to another device.')
+        session_id = registration.session_id
+      else:
+        session = MetricSession(tenant_identifier=registration.tenant_identifier,
+                                device_identifier=registration.device_identifier)
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session
+        while len(self.sessions) > self.max_sessions:
+          self.sessions.popitem(last=False)
+      handles = []
+      for descriptor in registration.metrics:
+        key = descriptor_key(descriptor)
+        handle = session.handles.get(key)
+        if handle is None:
+          handle = session.handles[key] = len(session.metrics)
+          session.metrics.append(descriptor)
+        handles.append(handle)
+    return MetricHandles(session_id=session_id, handles=handles)
+
+  def expand(self, batch: NumericScalarBatch) -> NumericScalarBatch:
+    ''' Replace the session of a batch by its tenant, device and metric descriptors, the handles become the metric
+        indices. Batches without session are returned unchanged.
+    '''
+    if not batch.session_id:
+      return batch
+    with self.lock:
+      session = self._get(batch.session_id)
+      metrics = list(session.metrics)
+    batch.tenant_identifier = session.tenant_identifier
+    batch.device_identifier = session.device_identifier
+    del batch.metrics[:]
+    batch.metrics.extend(metrics)
+    batch.ClearField('session_id')
+    return batch
+
+  def _get(self, session_id: str) -> MetricSession:
+    session = self.sessions.get(session_id)
+    if session is None:
+      raise UnknownSessionError(f'Unknown metric session {session_id}, register the metrics again.')
+    self.sessions.move_to_end(session_id)
+    return session
+
+  def __len__(self) -> int:
+    return len(self.sessions)
@@ -0,0 +1,55 @@
+import threading
+from functools import partial
+from typing import Callable
+from iot_libs.proto.hub_pb2 import FAILED, PENDING, SUCCESS, IngestAck
+# local
+from hub.buffer import CommitResult, OnCommit
+
+ACK_STATUS = {CommitResult.COMMITTED: SUCCESS, CommitResult.RETRY: PENDING, CommitResult.REJECTED: FAILED}
+
+
+class IngestStream:
+  ''' Acknowledgements and credits of one bidirectional ingest stream.
+
+      Every accepted request is acknowledged once the buffer reports its commit result, every acknowledgement returns
+      one credit to the client, so a client never has more than the initial credits in flight. The acknowledgements are
+      handed to emit, which may be called from the writer threads. emit receives None once the client closed its side
+      of the stream and all accepted requests are acknowledged, or an exception which aborts the stream.
+  '''
+
+  def __init__(self, emit: Callable[[IngestAck | Exception | None], None]):
+    self.emit = emit
+    self.lock = threading.Lock()
+    self.in_flight = 0
+    self.reader_done = False
+
+  def accept(self, sequence: int) -> OnCommit:
+    ''' Register an accepted request and return the callback acknowledging it. '''
+    with self.lock:
+      self.in_flight += 1
+    return partial(self._commit, sequence)
+
+  def reject(self, sequence: int, message: str):
+    ''' Acknowledge a request which is not accepted and must not be sent again. '''
+    self.emit(IngestAck(sequence=sequence, status=FAILED, credits=1, message=message))
+
+  def fail(self, exc: Exception):
+    ''' Abort the stream. '''
+    self.emit(exc)
+
+  def close_reader(self):
+    ''' Mark the requests of the client as completely read. '''
+    with self.lock:
+      self.reader_done = True
+      finished = self.in_flight == 0
+    if finished:
+      self.emit(None)
+
+  def _commit(self, sequence: int, result: CommitResult):
+    message = 'Failed to write the batch to the database.' if result == CommitResult.REJECTED else ''
+    self.emit(IngestAck(sequence=sequence, status=ACK_STATUS[result], credits=1, message=message))
+    with self.lock:
+      self.in_flight -= 1
+      finished = self.reader_done and self.in_flight == 0
+    if finished:
+      self.emit(None)
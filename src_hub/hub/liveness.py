@@ -0,0 +1,142 @@
+import heapq
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from iot_libs.postgres import PostgresManager
+from iot_libs.proto.enums import DeviceHealthStatus
+from iot_libs.proto.hub_pb2 import DeviceStatus
+# local
+from hub.gls.gls import logger
+from hub.queries.devices import select_alive_devices, select_tenant_identifiers, set_devices_offline
+
+DeviceKey = tuple[str, str]
+
+
+class LivenessIndex:
+  ''' Deadline index of the next expected heartbeat of every device of all tenants.
+
+      The deadlines are kept in a min-heap, a heartbeat pushes the new deadline and leaves the old entry behind, which
+      is skipped once it is popped. Finding the expired devices therefore only touches the devices which are actually
+      overdue instead of all devices.
+  '''
+
+  def __init__(self, timeout_seconds: float = 30):
+    ''' Parameters
+        ----------
+        timeout_seconds:  Seconds without a heartbeat after which a device is considered offline.
+    '''
+    self.timeout_seconds = timeout_seconds
+    self.deadlines: dict[DeviceKey, float] = {}
+    self.heap: list[tuple[float, str, str]] = []
+    self.lock = threading.Lock()
+
+  def heartbeat(self, tenant_identifier: str, device_identifier: str, alive: float, status: int = None):
+    ''' Register a heartbeat of a device at the unix time alive, a device reporting itself offline is removed. '''
+    key = (tenant_identifier, device_identifier)
+    with self.lock:
+      if status == DeviceHealthStatus.OFFLINE.value:
+        self.deadlines.pop(key, None)
+        return
+      deadline = min(alive, time.time()) + self.timeout_seconds
+      if deadline <= self.deadlines.get(key, 0):
+        return
+      self.deadlines[key] = deadline
+      heapq.heappush(self.heap, (deadline, tenant_identifier, device_identifier))
+
+  def observe(self, status: DeviceStatus):
+    ''' Register a received device status. '''
+    self.heartbeat(tenant_identifier=status.tenant_identifier,
+                   device_identifier=status.device_identifier,
+                   alive=status.timestamp.seconds + status.timestamp.nanos / 1e9,
+                   status=status.status)
+
+  def pop_expired(self, now: float = None) -> list[tuple[str, str, float]]:
+    ''' Remove and return the tenant, device and deadline of all devices whose deadline has passed. '''
+    now = time.time() if now is None else now
+    expired = []
+    with self.lock:
+      while self.heap and self.heap[0][0] <= now:
+        deadline, tenant_identifier, device_identifier = heapq.heappop(self.heap)
+        key = (tenant_identifier, device_identifier)
+        if self.deadlines.get(key) == deadline:
+          del self.deadlines[key]
+          expired.append((tenant_identifier, device_identifier, deadline))
+    return expired
+
+  def restore(self, expired: list[tuple[str, str, float]]):
+    ''' Put expired devices back, e.g. if their offline transition could not be written. '''
+    with self.lock:
+      for tenant_identifier, device_identifier, deadline in expired:
+        key = (tenant_identifier, device_identifier)
+        if key not in self.deadlines:
+          self.deadlines[key] = deadline
+          heapq.heappush(self.heap, (deadline, tenant_identifier, device_identifier))
+
+  def __len__(self) -> int:
+    return len(self.deadlines)
+
+
+class LivenessMonitor:
+  ''' Seed the liveness index from the tenant databases and write the offline transitions of expired devices. '''
+
+  def __init__(self, index: LivenessIndex, db_manager: PostgresManager, interval_seconds: float = 5):
+    ''' Parameters
+        ----------
+        index:             The liveness index fed by the received device status.
+        db_manager:        The database connection manager.
+        interval_seconds:  Seconds between two checks for expired devices.
+    '''
+    self.index = index
+    self.db_manager = db_manager
+    self.interval_seconds = interval_seconds
+    self.shutdown_event = threading.Event()
+
+  def seed(self):
+    ''' Load the latest alive time of all devices which are not offline from every tenant database. '''
+    with self.db_manager.connection('postgres') as conn:
+      tenant_identifiers = select_tenant_identifiers(conn=conn)
+    for tenant_identifier in tenant_identifiers:
+      try:
+        with self.db_manager.connection(f'tenant_{tenant_identifier}') as conn:
+          devices = select_alive_devices(conn=conn)
+      except Exception as exc:
+        logger.error(f'Failed to load the device status of tenant {tenant_identifier}: {exc}')
+        continue
+      for device_identifier, latest_alive in devices:
+        self.index.heartbeat(tenant_identifier=tenant_identifier,
+                             device_identifier=device_identifier,
+                             alive=latest_alive.replace(tzinfo=timezone.utc).timestamp())
+    logger.info(f'Seeded liveness index with {len(self.index)} device(s) of {len(tenant_identifiers)} tenant(s).')
+
+  def check(self, now: float = None):
+    ''' Set all devices without a heartbeat within the timeout offline, one statement per tenant. '''
+    now = time.time() if now is None else now
+    expired_by_tenant = defaultdict(list)
+    for expired in self.index.pop_expired(now=now):
+      expired_by_tenant[expired[0]].append(expired)
+    cutoff = datetime.fromtimestamp(now - self.index.timeout_seconds, tz=timezone.utc).replace(tzinfo=None)
+    for tenant_identifier, expired in expired_by_tenant.items():
+      device_identifiers = [device_identifier for _, device_identifier, _ in expired]
+      try:
+        with self.db_manager.connection(f'tenant_{tenant_identifier}') as conn:
+          offline = set_devices_offline(device_identifiers=device_identifiers, cutoff=cutoff, conn=conn)
+      except Exception as exc:
+        logger.error(f'Failed to set devices of tenant {tenant_identifier} offline: {exc}')
+        self.index.restore(expired)
+        continue
+      if offline:
+        logger.warning(f'Update device status to offline for devices of tenant {tenant_identifier}: {offline}')
+
+  def run(self, seed: bool = True):
+    ''' Seed the index and check for expired devices until the monitor is stopped. '''
+    try:
+      if seed:
+        self.seed()
+    except Exception as exc:
+      logger.error(f'Failed to seed liveness index: {exc}')
+    while not self.shutdown_event.wait(self.interval_seconds):
+      self.check()
+
+  def stop(self):
+    self.shutdown_event.set()
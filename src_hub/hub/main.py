@@ -1,30 +1,61 @@
+import asyncio
 import grpc
+import multiprocessing
 import queue
 import os
+import signal
 import threading
+import time
+from multiprocessing.connection import wait
 from dotenv import load_dotenv
 from concurrent import futures
 from google.protobuf.empty_pb2 import Empty
+from iot_libs.proto.batch import (ACCEPTED_BATCHES_KEY, pack_numeric_scalar_values, validate_batch, validate_window,
+                                  window_sample_count)
+from iot_libs.proto.hub_pb2 import IngestAck, MetricHandles
 from iot_libs.proto.hub_pb2_grpc import HubServicer, add_HubServicer_to_server
 # local
-from hub.gls.gls import logger
-from hub.buffer import NumericScalarMetricsBuffer, DeviceStatusBuffer
-from hub.processes import check_device_status
+from hub.gls.gls import logger, db_manager, sampled_logger, setup_logger
+from hub.aio import serve as serve_async
+from hub.buffer import Buffer, NumericArrayWindowsBuffer, NumericScalarMetricsBuffer, DeviceStatusBuffer, OverflowPolicy
+from hub.spool import Spool
+from hub.telemetry import LOG_RECORDS, SAMPLES_RECEIVED, WorkerRegistry, serve_metrics
+from hub.handles import HandleRegistry, UnknownSessionError
+from hub.ingest import IngestStream
+from hub.liveness import LivenessIndex, LivenessMonitor
 
 
 class HubService(HubServicer):
-  ''' Service for receiving metrics from devices. '''
+  ''' Service for receiving metrics from devices.
 
-  def __init__(self, metrics_buffer: queue.Queue, device_status_buffer: queue.Queue):
+      Every open ingest stream holds a worker thread of the server for its whole life. With max_streams further
+      streams are refused, so that the unary calls, e.g. the heartbeats of SendDeviceStatus, always find a free worker.
+  '''
+
+  def __init__(self,
+               metrics_buffer: Buffer,
+               device_status_buffer: Buffer,
+               liveness: LivenessIndex = None,
+               handles: HandleRegistry = None,
+               ingest_window: int = 64,
+               array_buffer: Buffer = None,
+               max_streams: int = None):
     super().__init__()
+    self.stream_slots = threading.BoundedSemaphore(max_streams) if max_streams else None
     self.metrics_buffer = metrics_buffer
     self.device_status_buffer = device_status_buffer
+    self.liveness = liveness
+    self.handles = HandleRegistry() if handles is None else handles
+    self.ingest_window = ingest_window
+    self.array_buffer = array_buffer
 
   def SendNumericScalarValues(self, request_iterator, context) -> Empty:
     try:
       for request in request_iterator:
-        logger.info(f'Received metrics: \n{request}')
-        self.metrics_buffer.queue.put(request)
+        sampled_logger.info('Received metrics: \n%s', request)
+        SAMPLES_RECEIVED.inc(tenant=request.tenant_identifier, type='numeric_scalar')
+        for batch in pack_numeric_scalar_values([request]):
+          self.metrics_buffer.put(batch)
       return Empty()
     except Exception as exc:
       logger.error(f'Error in SendNumericData: {exc}')
@@ -32,10 +63,125 @@ class HubService(HubServicer):
       context.set_code(grpc.StatusCode.INTERNAL)
       return Empty()
 
+  def SendNumericScalarBatch(self, request_iterator, context) -> Empty:
+    accepted = 0
+    try:
+      for request in request_iterator:
+        request = self.handles.expand(request)
+        validate_batch(request)
+        sampled_logger.info('Received %d metric(s) of device %s', len(request.values), request.device_identifier)
+        SAMPLES_RECEIVED.inc(len(request.values), tenant=request.tenant_identifier, type='numeric_scalar')
+        self.metrics_buffer.put(request)
+        accepted += 1
+      return Empty()
+    except UnknownSessionError as exc:
+      context.set_trailing_metadata(((ACCEPTED_BATCHES_KEY, str(accepted)),))
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+      return Empty()
+    except ValueError as exc:
+      logger.warning(f'Rejected invalid batch in SendNumericScalarBatch: {exc}')
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendNumericScalarBatch: {exc}')
+      context.set_details(f'Error processing data: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+  def StreamNumericScalarBatches(self, request_iterator, context):
+    ''' Acknowledge every batch once it is committed. The requests are read by a separate thread, so that the
+        acknowledgements are sent while the client keeps sending.
+    '''
+    if self.stream_slots is not None and not self.stream_slots.acquire(blocking=False):
+      logger.warning('Refused ingest stream, all stream slots are taken.')
+      context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, 'Too many ingest streams, send the batches without stream.')
+    try:
+      acks = queue.Queue()
+      stream = IngestStream(emit=acks.put)
+      threading.Thread(target=self._read_ingest_requests, args=(request_iterator, stream), daemon=True).start()
+      yield IngestAck(credits=self.ingest_window)
+      while True:
+        try:
+          ack = acks.get(timeout=1)
+        except queue.Empty:
+          if not context.is_active():
+            return
+          continue
+        if ack is None:
+          return
+        if isinstance(ack, UnknownSessionError):
+          context.abort(grpc.StatusCode.FAILED_PRECONDITION, str(ack))
+        yield ack
+    finally:
+      if self.stream_slots is not None:
+        self.stream_slots.release()
+
+  def _read_ingest_requests(self, request_iterator, stream: IngestStream):
+    try:
+      for request in request_iterator:
+        try:
+          batch = self.handles.expand(request.batch)
+          validate_batch(batch)
+        except ValueError as exc:
+          logger.warning(f'Rejected invalid batch in StreamNumericScalarBatches: {exc}')
+          stream.reject(sequence=request.sequence, message=str(exc))
+          continue
+        SAMPLES_RECEIVED.inc(len(batch.values), tenant=batch.tenant_identifier, type='numeric_scalar')
+        self.metrics_buffer.put(batch, on_commit=stream.accept(sequence=request.sequence))
+    except UnknownSessionError as exc:
+      stream.fail(exc)
+    except Exception as exc:
+      logger.info(f'Ingest stream closed: {exc}')
+    finally:
+      stream.close_reader()
+
+  def SendNumericArrayWindows(self, request_iterator, context) -> Empty:
+    if self.array_buffer is None:
+      context.set_details('Array windows are not enabled.')
+      context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+      return Empty()
+    try:
+      for window in request_iterator:
+        validate_window(window)
+        sample_count = window_sample_count(window)
+        sampled_logger.info('Received window of %d sample(s) of device %s', sample_count, window.device_identifier)
+        SAMPLES_RECEIVED.inc(sample_count, tenant=window.tenant_identifier, type='numeric_array')
+        self.array_buffer.put(window)
+      return Empty()
+    except ValueError as exc:
+      logger.warning(f'Rejected invalid window in SendNumericArrayWindows: {exc}')
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return Empty()
+    except Exception as exc:
+      logger.error(f'Error in SendNumericArrayWindows: {exc}')
+      context.set_details(f'Error processing data: {str(exc)}')
+      context.set_code(grpc.StatusCode.INTERNAL)
+      return Empty()
+
+  def RegisterMetrics(self, request, context) -> MetricHandles:
+    try:
+      handles = self.handles.register(request)
+      logger.info(f'Registered {len(request.metrics)} metric(s) of device {request.device_identifier}')
+      return handles
+    except UnknownSessionError as exc:
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.FAILED_PRECONDITION)
+      return MetricHandles()
+    except ValueError as exc:
+      context.set_details(str(exc))
+      context.set_code(grpc.StatusCode.INVALID_ARGUMENT)
+      return MetricHandles()
+
   def SendDeviceStatus(self, request, context) -> Empty:
     try:
-      logger.info(f'Received Device Status: \n{request}')
-      self.device_status_buffer.queue.put(request)
+      sampled_logger.info('Received Device Status: \n%s', request)
+      SAMPLES_RECEIVED.inc(tenant=request.tenant_identifier, type='device_status')
+      if self.liveness is not None:
+        self.liveness.observe(request)
+      self.device_status_buffer.put(request)
       return Empty()
     except Exception as exc:
       logger.error(f'Error in SendDeviceStatus: {exc}')
@@ -44,35 +190,240 @@ class HubService(HubServicer):
       return Empty()
 
 
-def main(host: str, port: str | int) -> None:
-  metrics_buffer = NumericScalarMetricsBuffer(batch_size=int(os.getenv('BATCH_SIZE', 2)), queue=queue.Queue())
-  device_status_buffer = DeviceStatusBuffer(batch_size=int(os.getenv('BATCH_SIZE', 1)), queue=queue.Queue())
-  metrics_thread = threading.Thread(target=metrics_buffer.process)
-  device_status_thread = threading.Thread(target=device_status_buffer.process)
-  check_device_status_thread = threading.Thread(target=check_device_status,
-                                                args=(os.getenv('TENANT_IDENTIFIER', '100000'),
-                                                      int(os.getenv('CHECK_DEVICE_STATUS_INTERVAL_SECONDS'), 20)),
-                                                daemon=True)
-  metrics_thread.start()
-  device_status_thread.start()
-  check_device_status_thread.start()
-  server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
+def serve(host: str,
+          port: str | int,
+          metrics_buffer: Buffer,
+          device_status_buffer: Buffer,
+          liveness: LivenessIndex = None,
+          handles: HandleRegistry = None,
+          ingest_window: int = 64,
+          max_workers: int = 10,
+          grace_seconds: float = 5,
+          array_buffer: Buffer = None,
+          max_streams: int = None):
+  ''' Run the threaded gRPC server until it is terminated, every active stream occupies one worker thread. The port
+      is bound with SO_REUSEPORT, so that several hub processes can share it. At most max_streams ingest streams, by
+      default half of the workers, are served at the same time and at least one worker is kept for the other calls.
+  '''
+  max_streams = max(min(max_streams or max_workers // 2, max_workers - 1), 1)
+  server = grpc.server(futures.ThreadPoolExecutor(max_workers=max_workers), options=[('grpc.so_reuseport', 1)])
   add_HubServicer_to_server(
-      HubService(metrics_buffer=metrics_buffer, device_status_buffer=device_status_buffer), server)
+      HubService(metrics_buffer=metrics_buffer,
+                 device_status_buffer=device_status_buffer,
+                 liveness=liveness,
+                 handles=handles,
+                 ingest_window=ingest_window,
+                 array_buffer=array_buffer,
+                 max_streams=max_streams), server)
   server.add_insecure_port(f'{host}:{port}')
   try:
     server.start()
     server.wait_for_termination()
+  finally:
+    server.stop(grace_seconds).wait()
+
+
+def buffer_options(prefix: str, max_batch_rows: int, linger_ms: int, writer_pool_size: int, spool_on_failure: bool,
+                   worker_index: int = None) -> dict:
+  ''' Read the buffer options from the environment, e.g. METRICS_MAX_BATCH_ROWS for the prefix METRICS. Every worker
+      process gets its own spool directory, the spool is only created if the buffer spills or spools on failure.
+  '''
+  overflow_policy = OverflowPolicy(os.getenv(f'{prefix}_OVERFLOW_POLICY', OverflowPolicy.BLOCK.value))
+  spool_on_failure = os.getenv(f'{prefix}_SPOOL_ON_FAILURE', str(spool_on_failure)).lower() == 'true'
+  spool = None
+  if spool_on_failure or overflow_policy == OverflowPolicy.SPILL:
+    spool_directory = os.path.join(os.getenv('SPOOL_DIR', 'spool'), prefix.lower())
+    if worker_index is not None:
+      spool_directory = os.path.join(spool_directory, f'worker-{worker_index}')
+    spool = Spool(directory=spool_directory,
+                  segment_bytes=int(os.getenv('SPOOL_SEGMENT_BYTES', 4194304)),
+                  max_bytes=int(os.getenv('SPOOL_MAX_BYTES', 1073741824)))
+  return {
+      'queue': queue.Queue(maxsize=int(os.getenv(f'{prefix}_MAX_QUEUE_SIZE', 10000))),
+      'max_batch_rows': int(os.getenv(f'{prefix}_MAX_BATCH_ROWS', max_batch_rows)),
+      'max_batch_bytes': int(os.getenv(f'{prefix}_MAX_BATCH_BYTES', 1048576)),
+      'linger_ms': int(os.getenv(f'{prefix}_LINGER_MS', linger_ms)),
+      'overflow_policy': overflow_policy,
+      'spool': spool,
+      'writer_pool_size': int(os.getenv(f'{prefix}_WRITER_POOL_SIZE', writer_pool_size)),
+      'spool_on_failure': spool_on_failure,
+      'replay_rows_per_second': float(os.getenv(f'{prefix}_REPLAY_ROWS_PER_SECOND', 1000))
+  }
+
+
+def run_hub(host: str, port: str | int, worker_index: int = None) -> None:
+  ''' Run the buffers, the liveness monitor and the gRPC server of one hub process until it is interrupted.
+
+      Parameters
+      ----------
+      host:          The host to bind the server to.
+      port:          The port to bind the server to.
+      worker_index:  The index of the worker process, None if the hub runs in a single process.
+  '''
+  metrics_buffer = NumericScalarMetricsBuffer(**buffer_options(prefix='METRICS',
+                                                               max_batch_rows=500,
+                                                               linger_ms=1000,
+                                                               writer_pool_size=4,
+                                                               spool_on_failure=True,
+                                                               worker_index=worker_index))
+  device_status_buffer = DeviceStatusBuffer(**buffer_options(prefix='STATUS',
+                                                             max_batch_rows=1000,
+                                                             linger_ms=2000,
+                                                             writer_pool_size=0,
+                                                             spool_on_failure=False,
+                                                             worker_index=worker_index))
+  array_buffer = NumericArrayWindowsBuffer(**buffer_options(prefix='ARRAYS',
+                                                           max_batch_rows=100,
+                                                           linger_ms=1000,
+                                                           writer_pool_size=2,
+                                                           spool_on_failure=True,
+                                                           worker_index=worker_index))
+  metrics_thread = threading.Thread(target=metrics_buffer.process)
+  array_thread = threading.Thread(target=array_buffer.process)
+  device_status_thread = threading.Thread(target=device_status_buffer.process)
+  liveness = LivenessIndex(timeout_seconds=float(os.getenv('DEVICE_TIMEOUT_SECONDS', 30)))
+  liveness_monitor = LivenessMonitor(index=liveness,
+                                     db_manager=db_manager,
+                                     interval_seconds=float(os.getenv('CHECK_DEVICE_STATUS_INTERVAL_SECONDS', 5)))
+  # every worker tracks the devices connected to it, the first one also picks up the devices known to the databases
+  liveness_thread = threading.Thread(target=liveness_monitor.run, kwargs={'seed': not worker_index}, daemon=True)
+  handles = HandleRegistry(max_sessions=int(os.getenv('METRIC_SESSIONS_MAX', 100000)))
+  ingest_window = int(os.getenv('INGEST_WINDOW', 64))
+  grace_seconds = float(os.getenv('SHUTDOWN_GRACE_SECONDS', 5))
+  loki_handler = setup_logger.loki_handler
+  if loki_handler is not None:
+    LOG_RECORDS.set_function(lambda: loki_handler.sent, result='sent')
+    LOG_RECORDS.set_function(lambda: loki_handler.dropped, result='dropped')
+  metrics_port = int(os.getenv('METRICS_PORT', 9464))
+  if metrics_port and worker_index is None:
+    serve_metrics(host=os.getenv('METRICS_HOST', '0.0.0.0'), port=metrics_port)
+    logger.info(f'Serving hub telemetry on port {metrics_port}')
+  elif metrics_port:
+    serve_metrics(host='127.0.0.1', port=worker_metrics_port(metrics_port, worker_index))
+  metrics_thread.start()
+  array_thread.start()
+  device_status_thread.start()
+  liveness_thread.start()
+  try:
+    # the ingest stream of the devices holds a worker thread per device in thread mode, aio serves them on one loop
+    if os.getenv('GRPC_SERVER_MODE', 'aio') == 'aio':
+      asyncio.run(serve_async(host=host,
+                              port=port,
+                              metrics_buffer=metrics_buffer,
+                              device_status_buffer=device_status_buffer,
+                              liveness=liveness,
+                              handles=handles,
+                              ingest_window=ingest_window,
+                              grace_seconds=grace_seconds,
+                              array_buffer=array_buffer))
+    else:
+      serve(host=host,
+            port=port,
+            metrics_buffer=metrics_buffer,
+            device_status_buffer=device_status_buffer,
+            liveness=liveness,
+            handles=handles,
+            ingest_window=ingest_window,
+            max_workers=int(os.getenv('GRPC_MAX_WORKERS', 10)),
+            max_streams=int(os.getenv('GRPC_MAX_STREAMS', 0)) or None,
+            grace_seconds=grace_seconds,
+            array_buffer=array_buffer)
   except KeyboardInterrupt:
     logger.info('KeyboardInterrupt: Stopping server')
-    server.stop(0)
+  finally:
+    liveness_monitor.stop()
     metrics_buffer.shutdown_event.set()
+    array_buffer.shutdown_event.set()
     device_status_buffer.shutdown_event.set()
     metrics_thread.join()
+    array_thread.join()
     device_status_thread.join()
     logger.info('Server stopped')
 
 
+def worker_metrics_port(metrics_port: int, worker_index: int) -> int:
+  ''' Port of the loopback metrics endpoint of a worker, the launcher serves the merged metrics on metrics_port. '''
+  return metrics_port + 1 + worker_index
+
+
+def stop_on_signal(signum, frame):
+  ''' Stop the process like Ctrl-C on the first signal and ignore further ones while it shuts down. '''
+  signal.signal(signal.SIGTERM, signal.SIG_IGN)
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  raise KeyboardInterrupt
+
+
+def run_worker(host: str, port: str | int, worker_index: int) -> None:
+  ''' Entry point of a worker process. Only the launcher reacts to Ctrl-C, the workers shut down on SIGTERM. '''
+  signal.signal(signal.SIGINT, signal.SIG_IGN)
+  signal.signal(signal.SIGTERM, stop_on_signal)
+  logger.info(f'Starting hub worker {worker_index} (pid {os.getpid()})')
+  run_hub(host=host, port=port, worker_index=worker_index)
+
+
+def launch_workers(host: str, port: str | int, workers: int) -> None:
+  ''' Run the hub in several worker processes sharing the port through SO_REUSEPORT.
+
+      Protobuf decoding and batch assembly are bound to the GIL, so one process only uses one core. The kernel
+      distributes the connections across the workers, each worker has its own buffers, writer threads, spool and metric
+      sessions. A device which reconnects to another worker registers its metrics again. A worker which dies is
+      started again with the same index, so that it replays its spool. On SIGTERM or Ctrl-C all workers are stopped
+      and flush their buffers.
+
+      Parameters
+      ----------
+      host:     The host to bind the server to.
+      port:     The port to bind the server to.
+      workers:  The number of worker processes.
+  '''
+  context = multiprocessing.get_context('spawn')
+  grace_seconds = float(os.getenv('SHUTDOWN_GRACE_SECONDS', 5))
+
+  def start(worker_index: int) -> multiprocessing.Process:
+    process = context.Process(target=run_worker,
+                              kwargs={'host': host, 'port': port, 'worker_index': worker_index},
+                              name=f'hub-worker-{worker_index}')
+    process.start()
+    return process
+
+  signal.signal(signal.SIGTERM, stop_on_signal)
+  signal.signal(signal.SIGINT, stop_on_signal)
+  processes = [start(worker_index) for worker_index in range(workers)]
+  metrics_port = int(os.getenv('METRICS_PORT', 9464))
+  if metrics_port:
+    urls = [f'http://127.0.0.1:{worker_metrics_port(metrics_port, index)}/metrics' for index in range(workers)]
+    serve_metrics(host=os.getenv('METRICS_HOST', '0.0.0.0'), port=metrics_port, registry=WorkerRegistry(urls=urls))
+    logger.info(f'Serving telemetry of {workers} hub workers on port {metrics_port}')
+  try:
+    while True:
+      wait([process.sentinel for process in processes])
+      for worker_index, process in enumerate(processes):
+        if not process.is_alive():
+          logger.error(f'Hub worker {worker_index} exited with code {process.exitcode}, restarting it')
+          time.sleep(1)
+          processes[worker_index] = start(worker_index)
+  except KeyboardInterrupt:
+    logger.info(f'Stopping {workers} hub workers')
+  finally:
+    for process in processes:
+      process.terminate()
+    deadline = time.monotonic() + grace_seconds + 30
+    for process in processes:
+      process.join(timeout=max(deadline - time.monotonic(), 0))
+      if process.is_alive():
+        logger.error(f'Hub worker {process.name} did not stop, killing it')
+        process.kill()
+    logger.info('Hub workers stopped')
+
+
+def main(host: str, port: str | int) -> None:
+  workers = int(os.getenv('HUB_WORKERS', 1))
+  if workers > 1:
+    launch_workers(host=host, port=port, workers=workers)
+  else:
+    run_hub(host=host, port=port)
+
+
 if __name__ == '__main__':
   logger.info('Starting gRPC server')
   load_dotenv()
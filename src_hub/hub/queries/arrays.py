@@ -0,0 +1,81 @@
+import numpy as np
+from iot_libs.postgres import PostgreException, execute_copy, execute_query, is_integrity_error
+from iot_libs.proto.batch import window_sample_count
+from iot_libs.proto.hub_pb2 import NumericArrayWindow, NumericScalarValues
+from sqlalchemy.orm import scoped_session
+# local
+from hub.gls.gls import logger
+from hub.queries.metrics import INSERT_METHOD, from_epoch_us, invalidate_devices, metric_key, resolve_metric_ids
+from hub.telemetry import SKIPPED_SAMPLES, STAGE_SECONDS
+
+COLUMNS = ['metric_key', 'timestamp', 'sample_rate', 'sample_count', 'samples']
+METRIC_TYPE = 'numeric_array'
+
+
+def describe_window(window: NumericArrayWindow) -> NumericScalarValues:
+  ''' The metric descriptor of a window as sample without value, as used to resolve the metric ids. '''
+  return NumericScalarValues(tenant_identifier=window.tenant_identifier,
+                             device_identifier=window.device_identifier,
+                             metric_identifier=window.metric.metric_identifier,
+                             path=window.metric.path,
+                             unit=window.metric.unit,
+                             display_name=window.metric.display_name)
+
+
+def update_array_windows(batch: NumericArrayWindow | list[NumericArrayWindow], conn: scoped_session):
+  ''' Write the windows of waveform metrics, every window is stored as one row with its samples as they were received.
+  '''
+  if isinstance(batch, NumericArrayWindow):
+    batch = [batch]
+  descriptors = [describe_window(window) for window in batch]
+  with STAGE_SECONDS.time(stage='resolve'):
+    resolved_ids = resolve_metric_ids(batch=descriptors, conn=conn, metric_type=METRIC_TYPE)
+  rows, skipped = [], 0
+  timestamps = from_epoch_us(np.array([window.start_us for window in batch], dtype=np.int64))
+  for window, descriptor, timestamp in zip(batch, descriptors, timestamps):
+    metric_id = resolved_ids.get(metric_key(descriptor, metric_type=METRIC_TYPE))
+    if metric_id is None:
+      skipped += window_sample_count(window)
+      continue
+    rows.append((metric_id, timestamp, window.sample_rate, window_sample_count(window), window.samples))
+  if skipped:
+    SKIPPED_SAMPLES.inc(skipped, tenant=batch[0].tenant_identifier)
+    logger.warning(f'Skip {skipped} sample(s) of unresolvable array metrics.')
+  if not rows:
+    return
+  try:
+    with STAGE_SECONDS.time(stage='write'):
+      write_windows(rows=rows, conn=conn)
+  except PostgreException as exc:
+    if is_integrity_error(exc):
+      invalidate_devices(batch=batch)
+    raise
+
+
+def write_windows(rows: list[tuple], conn: scoped_session, method: str = INSERT_METHOD):
+  ''' Write the window rows with a binary COPY, the executemany insert is used as fallback.
+
+      Parameters
+      ----------
+      rows:    The metric_key, naive utc start timestamp, sample rate, sample count and packed samples of each window.
+      conn:    The database connection.
+      method:  "copy" to bulk load the windows or "insert" to always use the executemany insert.
+  '''
+  if method == 'copy':
+    try:
+      execute_copy(conn=conn,
+                   table='numeric_array_values',
+                   columns=COLUMNS,
+                   rows=rows,
+                   types=['int4', 'timestamp', 'float8', 'int4', 'bytea'])
+      return
+    except PostgreException as exc:
+      if is_integrity_error(exc):
+        raise
+      logger.warning(f'Failed to copy array windows, fall back to insert: {exc.__cause__}')
+  query = f'insert into numeric_array_values ({", ".join(COLUMNS)}) values({", ".join(f":{c}" for c in COLUMNS)})'
+  try:
+    execute_query(conn=conn, query=query, params=[dict(zip(COLUMNS, row)) for row in rows])
+  except Exception as exc:
+    logger.error(f'Failed to write to database: {exc}')
+    raise
@@ -1,15 +1,50 @@
 import pandas as pd
 from datetime import datetime
 from sqlalchemy.orm import scoped_session
+from iot_libs.proto.enums import DeviceHealthStatus
 from iot_libs.proto.hub_pb2 import DeviceStatus
-from iot_libs.postgres import execute_query, execute_select_query
+from iot_libs.postgres import dict_row, execute_query, execute_select_query
 # local
 from hub.gls.gls import logger
 
 
-def get_device_status(conn: scoped_session):
-  query = '''select device_identifier, status, latest_alive from devices'''
-  return execute_select_query(conn=conn, query=query)
+def select_tenant_identifiers(conn: scoped_session) -> list[str]:
+  ''' The identifiers of all tenants with a tenant database. '''
+  query = '''select datname from pg_database where datname like 'tenant\\_%' '''
+  result = execute_select_query(conn=conn, query=query, row_factory=dict_row)
+  return [row['datname'].removeprefix('tenant_') for row in result]
+
+
+def select_alive_devices(conn: scoped_session) -> list[tuple[str, datetime]]:
+  ''' The device identifier and latest alive time of all devices which are not offline. '''
+  query = '''select device_identifier, latest_alive from devices
+             where status is distinct from :offline and latest_alive is not null'''
+  result = execute_select_query(conn=conn,
+                                query=query,
+                                params={'offline': DeviceHealthStatus.OFFLINE.value},
+                                row_factory=dict_row)
+  return [(row['device_identifier'].strip(), row['latest_alive']) for row in result]
+
+
+def set_devices_offline(device_identifiers: list[str], cutoff: datetime, conn: scoped_session) -> list[str]:
+  ''' Set the devices offline which have not been alive since the cutoff and return them. A device which sent a
+      heartbeat in the meantime, e.g. to another hub, keeps its status.
+  '''
+  query = '''update devices set status = :offline
+             where device_identifier = any(cast(:device_identifiers as text[]))
+             and status is distinct from :offline and latest_alive < :cutoff
+             returning device_identifier'''
+  params = {
+      'offline': DeviceHealthStatus.OFFLINE.value,
+      'device_identifiers': device_identifiers,
+      'cutoff': cutoff
+  }
+  try:
+    result = execute_select_query(conn=conn, query=query, params=params, row_factory=dict_row)
+  except Exception as exc:
+    logger.error(f'Failed to write to database: {exc}')
+    raise
+  return [row['device_identifier'].strip() for row in result]
 
 
 def set_device_status(status: dict[str, int] | list[dict[str, int]], conn: scoped_session):
@@ -49,13 +84,9 @@ def update_device_status(batch: DeviceStatus | list[DeviceStatus] | dict[str, in
     batch = batch.to_dict(orient='records')
   if isinstance(batch, list):
     if isinstance(batch[0], DeviceStatus):
-      params = [{
-          'device_identifier': d.device_identifier,
-          'status': d.status,
-          'latest_alive': datetime.fromtimestamp(d.timestamp.ToDatetime().timestamp())
-      } for d in batch]
-    else:
-      params = batch
+      bulk_update_device_status(batch=batch, conn=conn)
+      return
+    params = batch
   update_fields = ', '.join([f'{key} = :{key}' for key in params[0].keys() if key != 'device_identifier'])
   query = f'''update devices set {update_fields} where device_identifier = :device_identifier'''
   try:
@@ -63,3 +94,37 @@ def update_device_status(batch: DeviceStatus | list[DeviceStatus] | dict[str, in
   except Exception as exc:
     logger.error(f'Failed to write to database: {exc}')
     raise
+
+
+def latest_device_status(batch: list[DeviceStatus]) -> list[DeviceStatus]:
+  ''' Keep only the latest status of each device. '''
+  latest: dict[str, DeviceStatus] = {}
+  for status in batch:
+    current = latest.get(status.device_identifier)
+    if current is None or (status.timestamp.seconds, status.timestamp.nanos) >= (current.timestamp.seconds,
+                                                                                 current.timestamp.nanos):
+      latest[status.device_identifier] = status
+  return list(latest.values())
+
+
+def bulk_update_device_status(batch: list[DeviceStatus], conn: scoped_session):
+  ''' Update the status and latest alive time of all devices in the batch with one update ... from statement.
+      A status older than the latest alive time already stored, e.g. a replayed one, does not overwrite it.
+  '''
+  batch = latest_device_status(batch)
+  query = '''update devices as d set status = v.status, latest_alive = v.latest_alive
+             from unnest(cast(:device_identifiers as text[]),
+                         cast(:statuses as int[]),
+                         cast(:latest_alives as timestamp[])) as v(device_identifier, status, latest_alive)
+             where d.device_identifier = v.device_identifier
+             and (d.latest_alive is null or d.latest_alive <= v.latest_alive)'''
+  params = {
+      'device_identifiers': [status.device_identifier for status in batch],
+      'statuses': [status.status for status in batch],
+      'latest_alives': [status.timestamp.ToDatetime() for status in batch]
+  }
+  try:
+    execute_query(conn=conn, query=query, params=params)
+  except Exception as exc:
+    logger.error(f'Failed to write to database: {exc}')
+    raise
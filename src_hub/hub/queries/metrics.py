@@ -1,29 +1,46 @@
-from datetime import datetime
+import os
+import numpy as np
 from dataclasses import dataclass
+from typing import Callable
 from google.protobuf.timestamp_pb2 import Timestamp
-from iot_libs.postgres import execute_query, execute_select_query, dict_row
+from iot_libs.postgres import PostgreException, execute_copy, execute_query, execute_select_query, dict_row, is_integrity_error
 from sqlalchemy.orm import scoped_session
-from iot_libs.proto.hub_pb2 import NumericScalarValues
+from iot_libs.proto.batch import pack_numeric_scalar_values
+from iot_libs.proto.hub_pb2 import NumericScalarBatch, NumericScalarValues
 # local
-from hub.gls.gls import logger
+from hub.cache import CacheKey
+from hub.gls.gls import logger, path_id_cache, metric_id_cache
+from hub.telemetry import SKIPPED_SAMPLES, STAGE_SECONDS
+
+INSERT_METHOD = os.getenv('INSERT_METHOD', 'copy')
 
 
 class TimestampTypeError(Exception):
   pass
 
 
+class UnresolvableMetricError(Exception):
+  pass
+
+
 @dataclass
 class ScalarNumericMetric:
   device_identifier: str
-  metric_id: str
+  metric_id: int
   value: float
   timestamp: Timestamp
 
 
-def select_metrics_id(metric: NumericScalarValues, conn: scoped_session) -> str | None:
-  ''' Check if the metric exists in the database and return the metric id if it exist. '''
-  query = "select id from metrics where device_identifier = :device_identifier and metric_identifier = :metric_identifier and metric_type = 'numeric_scalar'"
-  params = {'device_identifier': metric.device_identifier, 'metric_identifier': metric.metric_identifier}
+def select_metrics_id(metric: NumericScalarValues,
+                      conn: scoped_session,
+                      metric_type: str = 'numeric_scalar') -> int | None:
+  ''' Check if the metric exists in the database and return its integer metric_key if it exist. '''
+  query = "select metric_key from metrics where device_identifier = :device_identifier and metric_identifier = :metric_identifier and metric_type = :metric_type"
+  params = {
+      'device_identifier': metric.device_identifier,
+      'metric_identifier': metric.metric_identifier,
+      'metric_type': metric_type
+  }
   try:
     result = execute_select_query(conn=conn, query=query, params=params, row_factory=dict_row)
   except Exception as exc:
@@ -31,12 +48,36 @@ def select_metrics_id(metric: NumericScalarValues, conn: scoped_session) -> str
     raise
   if not result:
     return
-  return result[0]['id']
+  return result[0]['metric_key']
+
+
+def get_metric_id(metric: NumericScalarValues,
+                  conn: scoped_session,
+                  path_id: str = None,
+                  metric_type: str = 'numeric_scalar') -> int | None:
+  ''' Get the metric_key of a metric from the cache or the database. '''
+  key = metric_key(metric, metric_type=metric_type)
+  metrics_id = metric_id_cache.get(key)
+  if metrics_id:
+    return metrics_id
+  if metric_id_cache.is_negative(key):
+    raise UnresolvableMetricError(f'Metric {metric.metric_identifier} of device {metric.device_identifier} could not be resolved recently') # yapf: disable
+  try:
+    metrics_id = _get_or_create_metric_id(metric=metric, conn=conn, path_id=path_id, metric_type=metric_type)
+  except PostgreException as exc:
+    if is_integrity_error(exc):
+      metric_id_cache.put_negative(key)
+      raise UnresolvableMetricError(f'Metric {metric.metric_identifier} of device {metric.device_identifier} could not be created') from exc
+    raise
+  metric_id_cache.put(key, metrics_id)
+  return metrics_id
 
 
-def get_metric_id(metric: NumericScalarValues, conn: scoped_session, path_id: str = None) -> str | None:
-  ''' Get the metric id from the database. '''
-  metrics_id = select_metrics_id(metric=metric, conn=conn)
+def _get_or_create_metric_id(metric: NumericScalarValues,
+                             conn: scoped_session,
+                             path_id: str = None,
+                             metric_type: str = 'numeric_scalar') -> int:
+  metrics_id = select_metrics_id(metric=metric, conn=conn, metric_type=metric_type)
   if metrics_id:
     return metrics_id
   query = "insert into metrics (device_identifier, path_id, metric_identifier, unit, display_name, metric_type) values(:device_identifier, :path_id, :metric_identifier, :unit, :display_name, :metric_type)"
@@ -46,11 +87,11 @@ def get_metric_id(metric: NumericScalarValues, conn: scoped_session, path_id: st
       'path_id': path_id,
       'unit': metric.unit,
       'display_name': metric.display_name,
-      'metric_type': 'numeric_scalar'
+      'metric_type': metric_type
   }
   try:
     execute_query(conn=conn, query=query, params=params)
-    metrics_id = select_metrics_id(metric=metric, conn=conn)
+    metrics_id = select_metrics_id(metric=metric, conn=conn, metric_type=metric_type)
     if not metrics_id:
       raise Exception(f'Failed to create metric with metric identifier {metric.metric_identifier}')
     return metrics_id
@@ -63,7 +104,7 @@ def insert_metrics(metrics: ScalarNumericMetric | list[ScalarNumericMetric], con
   ''' Insert metrics into the database. '''
   if isinstance(metrics, ScalarNumericMetric):
     metrics = [metrics]
-  query = "insert into numeric_scalar_values (metric_id, value, timestamp) values(:metric_id, :value, :timestamp)"
+  query = "insert into numeric_scalar_values (metric_key, value, timestamp) values(:metric_id, :value, :timestamp)"
   params = [{'metric_id': metric.metric_id, 'value': metric.value, 'timestamp': metric.timestamp} for metric in metrics]
   try:
     execute_query(conn=conn, query=query, params=params)
@@ -72,6 +113,26 @@ def insert_metrics(metrics: ScalarNumericMetric | list[ScalarNumericMetric], con
     raise
 
 
+def copy_metrics(metric_ids: list[int], values: list[float], timestamps: np.ndarray, conn: scoped_session):
+  ''' Bulk load metrics into the database with a binary COPY. '''
+  rows = zip(metric_ids, values, timestamps)
+  execute_copy(conn=conn,
+               table='numeric_scalar_values',
+               columns=['metric_key', 'value', 'timestamp'],
+               rows=rows,
+               types=['int4', 'float8', 'timestamp'])
+
+
+def to_timestamps(seconds: list[int], nanos: list[int]) -> np.ndarray:
+  ''' Convert the seconds and nanos of protobuf timestamps to naive utc datetimes in one vectorised step. '''
+  return from_epoch_us(np.asarray(seconds, dtype=np.int64) * 1000000 + np.asarray(nanos, dtype=np.int64) // 1000)
+
+
+def from_epoch_us(epoch_us: np.ndarray) -> np.ndarray:
+  ''' Convert microseconds since the unix epoch to naive utc datetimes. '''
+  return np.asarray(epoch_us, dtype=np.int64).astype('datetime64[us]').astype(object)
+
+
 def select_path_id(metric: NumericScalarValues, conn: scoped_session) -> str | None:
   ''' Check if the path exists in the database and return the path id if it exist. '''
   query = "select id from paths where device_identifier = :device_identifier and path = :path"
@@ -87,7 +148,25 @@ def select_path_id(metric: NumericScalarValues, conn: scoped_session) -> str | N
 
 
 def get_path_id(metric: NumericScalarValues, conn: scoped_session) -> str | None:
-  ''' Get the path id from the database. '''
+  ''' Get the path id from the cache or the database. '''
+  key = (metric.tenant_identifier, metric.device_identifier, metric.path)
+  path_id = path_id_cache.get(key)
+  if path_id:
+    return path_id
+  if path_id_cache.is_negative(key):
+    raise UnresolvableMetricError(f'Path {metric.path} of device {metric.device_identifier} could not be resolved recently') # yapf: disable
+  try:
+    path_id = _get_or_create_path_id(metric=metric, conn=conn)
+  except PostgreException as exc:
+    if is_integrity_error(exc):
+      path_id_cache.put_negative(key)
+      raise UnresolvableMetricError(f'Path {metric.path} of device {metric.device_identifier} could not be created') from exc
+    raise
+  path_id_cache.put(key, path_id)
+  return path_id
+
+
+def _get_or_create_path_id(metric: NumericScalarValues, conn: scoped_session) -> str:
   path_id = select_path_id(metric=metric, conn=conn)
   if path_id:
     return path_id
@@ -104,21 +183,255 @@ def get_path_id(metric: NumericScalarValues, conn: scoped_session) -> str | None
     raise
 
 
-def update_metrics(batch: NumericScalarValues | list[NumericScalarValues], conn: scoped_session):
-  ''' Update the metrics in the database. '''
-  if isinstance(batch, NumericScalarValues):
-    batch = [batch]
-  metrics_list: list[ScalarNumericMetric] = []
+def metric_key(metric: NumericScalarValues, metric_type: str = 'numeric_scalar') -> CacheKey:
+  ''' The cache key of a metric, the metric_type keeps the ids of array and scalar metrics apart. '''
+  return (metric.tenant_identifier, metric.device_identifier, metric.metric_identifier, metric_type)
+
+
+def path_key(metric: NumericScalarValues) -> CacheKey:
+  return (metric.tenant_identifier, metric.device_identifier, metric.path)
+
+
+def resolve_metric_ids(batch: list[NumericScalarValues],
+                       conn: scoped_session,
+                       metric_type: str = 'numeric_scalar') -> dict[CacheKey, int]:
+  ''' Resolve the metric ids, i.e. the integer metric_key of the metrics table, of all samples in a batch.
+
+      Cached ids are used as they are, all unknown paths and metrics of the batch are created or looked up with one
+      statement per table. Metrics which can not be resolved, e.g. because the metric exists with another
+      metric_type, are missing from the result.
+  '''
+  metric_ids: dict[CacheKey, int] = {}
+  unknown_metrics: dict[CacheKey, NumericScalarValues] = {}
   for metric in batch:
-    if not isinstance(metric.timestamp, Timestamp):
+    key = metric_key(metric, metric_type=metric_type)
+    if key in metric_ids or key in unknown_metrics:
+      continue
+    metric_id = metric_id_cache.get(key)
+    if metric_id:
+      metric_ids[key] = metric_id
+    elif not metric_id_cache.is_negative(key):
+      unknown_metrics[key] = metric
+  if not unknown_metrics:
+    return metric_ids
+  path_ids = resolve_path_ids(metrics=[metric for metric in unknown_metrics.values() if metric.path], conn=conn)
+  creatable_metrics = {
+      key: metric for key, metric in unknown_metrics.items() if not metric.path or path_key(metric) in path_ids
+  }
+  metric_ids.update(
+      upsert_metric_ids(metrics=creatable_metrics, path_ids=path_ids, conn=conn, metric_type=metric_type))
+  return metric_ids
+
+
+def resolve_path_ids(metrics: list[NumericScalarValues], conn: scoped_session) -> dict[CacheKey, str]:
+  ''' Resolve the path ids of the metrics, unknown paths are created with one statement. '''
+  path_ids: dict[CacheKey, str] = {}
+  unknown_paths: dict[CacheKey, NumericScalarValues] = {}
+  for metric in metrics:
+    key = path_key(metric)
+    if key in path_ids or key in unknown_paths:
+      continue
+    path_id = path_id_cache.get(key)
+    if path_id:
+      path_ids[key] = path_id
+    elif not path_id_cache.is_negative(key):
+      unknown_paths[key] = metric
+  if unknown_paths:
+    path_ids.update(upsert_path_ids(paths=unknown_paths, conn=conn))
+  return path_ids
+
+
+def upsert_path_ids(paths: dict[CacheKey, NumericScalarValues], conn: scoped_session) -> dict[CacheKey, str]:
+  ''' Create the paths or return their ids if they already exist with one insert ... on conflict ... returning.
+      If the statement violates a constraint, e.g. because a device does not exist, the paths are resolved one by
+      one so that only the invalid paths are skipped.
+  '''
+  query = """
+    insert into paths (device_identifier, path)
+    select v.device_identifier, cast(v.path as ltree)
+    from unnest(cast(:device_identifiers as text[]), cast(:paths as text[])) as v(device_identifier, path)
+    on conflict (device_identifier, path) do update set path = excluded.path
+    returning id, device_identifier, cast(path as text) as path
+  """
+  metrics = list(paths.values())
+  params = {
+      'device_identifiers': [metric.device_identifier for metric in metrics],
+      'paths': [metric.path for metric in metrics]
+  }
+  try:
+    result = execute_select_query(conn=conn, query=query, params=params, row_factory=dict_row)
+  except PostgreException as exc:
+    if not is_integrity_error(exc):
+      raise
+    logger.warning(f'Failed to create {len(paths)} path(s) at once, resolve them one by one.')
+    return _resolve_one_by_one(items=paths, resolve=lambda metric: get_path_id(metric=metric, conn=conn))
+  tenant_identifier = metrics[0].tenant_identifier
+  path_ids = {}
+  for row in result:
+    key = (tenant_identifier, row['device_identifier'].strip(), row['path'])
+    path_ids[key] = str(row['id'])
+    path_id_cache.put(key, path_ids[key])
+  return path_ids
+
+
+def upsert_metric_ids(metrics: dict[CacheKey, NumericScalarValues],
+                      path_ids: dict[CacheKey, str],
+                      conn: scoped_session,
+                      metric_type: str = 'numeric_scalar') -> dict[CacheKey, int]:
+  ''' Create the metrics or return their ids if they already exist with one insert ... on conflict ... returning.
+      Existing metrics are not modified and only returned if they have the metric_type, the others are remembered as
+      negative entries of the cache. If the statement violates a constraint the metrics are resolved one by one.
+  '''
+  if not metrics:
+    return {}
+  query = """
+    insert into metrics (device_identifier, path_id, metric_identifier, unit, display_name, metric_type)
+    select v.device_identifier, v.path_id, v.metric_identifier, v.unit, v.display_name, :metric_type
+    from unnest(cast(:device_identifiers as text[]),
+                cast(:path_ids as uuid[]),
+                cast(:metric_identifiers as text[]),
+                cast(:units as text[]),
+                cast(:display_names as text[])) as v(device_identifier, path_id, metric_identifier, unit, display_name)
+    on conflict (device_identifier, metric_identifier) do update set metric_identifier = excluded.metric_identifier
+    where metrics.metric_type = excluded.metric_type
+    returning metric_key, device_identifier, metric_identifier
+  """
+  items = list(metrics.values())
+  params = {
+      'device_identifiers': [metric.device_identifier for metric in items],
+      'path_ids': [path_ids.get(path_key(metric)) if metric.path else None for metric in items],
+      'metric_identifiers': [metric.metric_identifier for metric in items],
+      'units': [metric.unit for metric in items],
+      'display_names': [metric.display_name for metric in items],
+      'metric_type': metric_type
+  }
+  try:
+    result = execute_select_query(conn=conn, query=query, params=params, row_factory=dict_row)
+  except PostgreException as exc:
+    if not is_integrity_error(exc):
+      raise
+    logger.warning(f'Failed to create {len(metrics)} metric(s) at once, resolve them one by one.')
+    return _resolve_one_by_one(
+        items=metrics,
+        resolve=lambda metric: get_metric_id(
+            metric=metric, conn=conn, path_id=path_ids.get(path_key(metric)), metric_type=metric_type))
+  tenant_identifier = items[0].tenant_identifier
+  metric_ids = {}
+  for row in result:
+    key = (tenant_identifier, row['device_identifier'].strip(), row['metric_identifier'], metric_type)
+    metric_ids[key] = row['metric_key']
+    metric_id_cache.put(key, metric_ids[key])
+  rejected = [key for key in metrics if key not in metric_ids]
+  for key in rejected:
+    metric_id_cache.put_negative(key)
+  if rejected:
+    logger.warning(f'Skip {len(rejected)} metric(s) of tenant {tenant_identifier} which exist with another metric '
+                   f'type than {metric_type}.')
+  return metric_ids
+
+
+def _resolve_one_by_one(items: dict[CacheKey, NumericScalarValues],
+                        resolve: Callable[[NumericScalarValues], str | int]) -> dict[CacheKey, str | int]:
+  ids = {}
+  for key, metric in items.items():
+    try:
+      ids[key] = resolve(metric)
+    except UnresolvableMetricError as exc:
+      logger.warning(f'Skip metric: {exc}')
+  return ids
+
+
+def update_metrics(batch: NumericScalarBatch | NumericScalarValues | list[NumericScalarBatch | NumericScalarValues],
+                   conn: scoped_session):
+  ''' Update the metrics in the database. Single samples are packed into batches, the columns of the batches are
+      written without unpacking them into single samples.
+  '''
+  if isinstance(batch, (NumericScalarBatch, NumericScalarValues)):
+    batch = [batch]
+  samples = [item for item in batch if isinstance(item, NumericScalarValues)]
+  for sample in samples:
+    if not isinstance(sample.timestamp, Timestamp):
       raise TimestampTypeError(f'Timestamp is not of type Timestamp')
-    path_id = None
-    if metric.path:
-      path_id = get_path_id(metric=metric, conn=conn)
-    metric_id = get_metric_id(metric=metric, conn=conn, path_id=path_id)
-    metrics_list.append(
-        ScalarNumericMetric(device_identifier=metric.device_identifier,
-                            metric_id=metric_id,
-                            value=metric.value,
-                            timestamp=datetime.fromtimestamp(metric.timestamp.ToDatetime().timestamp())))
-  insert_metrics(metrics=metrics_list, conn=conn)
+  batches = [item for item in batch if isinstance(item, NumericScalarBatch)] + pack_numeric_scalar_values(samples)
+  descriptors = [describe_metrics(item) for item in batches]
+  with STAGE_SECONDS.time(stage='resolve'):
+    resolved_ids = resolve_metric_ids(batch=[metric for metrics in descriptors for metric in metrics], conn=conn)
+  skipped = 0
+  device_identifiers, metric_ids, values, timestamps_us = [], [], [], []
+  for item, metrics in zip(batches, descriptors):
+    ids = [resolved_ids.get(metric_key(metric)) for metric in metrics]
+    index = np.asarray(item.metric_index, dtype=np.intp)
+    resolved = np.array([metric_id is not None for metric_id in ids], dtype=bool)[index]
+    resolved_count = int(resolved.sum())
+    skipped += len(index) - resolved_count
+    device_identifiers.extend([item.device_identifier] * resolved_count)
+    metric_ids.append(np.array(ids, dtype=object)[index][resolved])
+    values.append(np.asarray(item.values, dtype=np.float64)[resolved])
+    timestamps_us.append(np.asarray(item.timestamps_us, dtype=np.int64)[resolved])
+  if skipped:
+    SKIPPED_SAMPLES.inc(skipped, tenant=batches[0].tenant_identifier)
+    logger.warning(f'Skip {skipped} sample(s) of unresolvable metrics.')
+  if not device_identifiers:
+    return
+  try:
+    with STAGE_SECONDS.time(stage='write'):
+      write_metrics(device_identifiers=device_identifiers,
+                    metric_ids=np.concatenate(metric_ids).tolist(),
+                    values=np.concatenate(values).tolist(),
+                    timestamps=from_epoch_us(np.concatenate(timestamps_us)),
+                    conn=conn)
+  except PostgreException as exc:
+    if is_integrity_error(exc):
+      invalidate_devices(batch=batches)
+    raise
+
+
+def describe_metrics(batch: NumericScalarBatch) -> list[NumericScalarValues]:
+  ''' The metric descriptors of a batch as samples without value, as used to resolve the metric ids. '''
+  return [
+      NumericScalarValues(tenant_identifier=batch.tenant_identifier,
+                          device_identifier=batch.device_identifier,
+                          metric_identifier=metric.metric_identifier,
+                          path=metric.path,
+                          unit=metric.unit,
+                          display_name=metric.display_name) for metric in batch.metrics
+  ]
+
+
+def write_metrics(device_identifiers: list[str],
+                  metric_ids: list[int],
+                  values: list[float],
+                  timestamps: np.ndarray,
+                  conn: scoped_session,
+                  method: str = INSERT_METHOD):
+  ''' Write the metric values with a binary COPY, the executemany insert is used as fallback.
+
+      Parameters
+      ----------
+      device_identifiers:  The device identifier of each value.
+      metric_ids:          The metric_key of each value.
+      values:              The metric values.
+      timestamps:          The naive utc timestamp of each value.
+      conn:                The database connection.
+      method:              "copy" to bulk load the values or "insert" to always use the executemany insert.
+  '''
+  if method == 'copy':
+    try:
+      copy_metrics(metric_ids=metric_ids, values=values, timestamps=timestamps, conn=conn)
+      return
+    except PostgreException as exc:
+      if is_integrity_error(exc):
+        raise
+      logger.warning(f'Failed to copy metrics, fall back to insert: {exc.__cause__}')
+  metrics = [
+      ScalarNumericMetric(device_identifier=device_identifier, metric_id=metric_id, value=value, timestamp=timestamp)
+      for device_identifier, metric_id, value, timestamp in zip(device_identifiers, metric_ids, values, timestamps)
+  ]
+  insert_metrics(metrics=metrics, conn=conn)
+
+
+def invalidate_devices(batch: list[NumericScalarBatch] | list[NumericScalarValues]):
+  ''' Drop the cached ids of all devices in the batch, e.g. if a cached id no longer exists in the database. '''
+  for tenant_identifier, device_identifier in {(m.tenant_identifier, m.device_identifier) for m in batch}:
+    path_id_cache.invalidate_device(tenant_identifier=tenant_identifier, device_identifier=device_identifier)
+    metric_id_cache.invalidate_device(tenant_identifier=tenant_identifier, device_identifier=device_identifier)
@@ -0,0 +1,227 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterator
+from google.protobuf.message import Message
+# local
+from hub.gls.gls import logger
+
+RECORD_HEADER = struct.Struct('<I')
+
+
+class SpoolFullError(Exception):
+  pass
+
+
+class Spool:
+  ''' Append only disk spool of length prefixed records, split into segment files.
+
+      Records are appended to the active segment until it reaches the segment size, afterwards a new segment is
+      started. Sealed segments are read back in the order they were written, the read position of a segment is kept
+      in an offset file next to it so that a restart continues where the replay stopped.
+  '''
+
+  def __init__(self, directory: str | Path, segment_bytes: int = 4194304, max_bytes: int = 1073741824):
+    ''' Parameters
+        ----------
+        directory:      The directory to store the segment files in.
+        segment_bytes:  The size in bytes after which a new segment is started.
+        max_bytes:      The maximum size of all segments, appending to a full spool raises a SpoolFullError.
+    '''
+    self.directory = Path(directory)
+    self.directory.mkdir(parents=True, exist_ok=True)
+    self.segment_bytes = segment_bytes
+    self.max_bytes = max_bytes
+    self.lock = threading.Lock()
+    self.active_segment: Path | None = None
+    self.active_file = None
+    self.size_bytes = sum(segment.stat().st_size for segment in self.segments())
+
+  def segments(self) -> list[Path]:
+    ''' All segment files ordered from the oldest to the newest. '''
+    return sorted(self.directory.glob('*.spool'))
+
+  def sealed_segments(self) -> list[Path]:
+    ''' All segments which are no longer appended to, ordered from the oldest to the newest. '''
+    with self.lock:
+      return [segment for segment in self.segments() if segment != self.active_segment]
+
+  def _next_segment(self) -> Path:
+    segments = self.segments()
+    sequence = int(segments[-1].stem) + 1 if segments else 0
+    return self.directory / f'{sequence:020d}.spool'
+
+  def _seal(self):
+    if self.active_file is not None:
+      self.active_file.close()
+    self.active_segment = None
+    self.active_file = None
+
+  def seal(self):
+    ''' Seal the active segment, so that its records can be replayed. '''
+    with self.lock:
+      self._seal()
+
+  def append(self, records: list[bytes]):
+    ''' Append records to the active segment. '''
+    size = sum(RECORD_HEADER.size + len(record) for record in records)
+    with self.lock:
+      if self.size_bytes + size > self.max_bytes:
+        raise SpoolFullError(f'Spool {self.directory} exceeds {self.max_bytes} bytes')
+      if self.active_file is None:
+        self.active_segment = self._next_segment()
+        self.active_file = open(self.active_segment, 'ab')
+      for record in records:
+        self.active_file.write(RECORD_HEADER.pack(len(record)))
+        self.active_file.write(record)
+      self.active_file.flush()
+      self.size_bytes += size
+      if self.active_file.tell() >= self.segment_bytes:
+        self._seal()
+
+  def read_offset(self, segment: Path) -> int:
+    ''' The position up to which the records of the segment have been replayed. '''
+    offset_file = segment.with_suffix('.offset')
+    if not offset_file.exists():
+      return 0
+    return int(offset_file.read_text() or 0)
+
+  def commit(self, segment: Path, offset: int):
+    ''' Persist the replay position of a segment. '''
+    offset_file = segment.with_suffix('.offset')
+    tmp_file = segment.with_suffix('.offset.tmp')
+    tmp_file.write_text(str(offset))
+    os.replace(tmp_file, offset_file)
+
+  def remove(self, segment: Path):
+    ''' Remove a fully replayed segment. '''
+    with self.lock:
+      self.size_bytes -= segment.stat().st_size
+      segment.unlink()
+      segment.with_suffix('.offset').unlink(missing_ok=True)
+
+  def empty(self) -> bool:
+    return self.size_bytes == 0
+
+  def close(self):
+    self.seal()
+
+
+def iter_records(segment: Path, offset: int = 0) -> Iterator[tuple[int, bytes]]:
+  ''' Iterate the records of a segment starting at the offset, yields the offset after each record and the record.
+      A truncated record at the end of the segment, e.g. after a crash, is ignored.
+  '''
+  with open(segment, 'rb') as f_in:
+    size = os.fstat(f_in.fileno()).st_size
+    if size <= offset:
+      return
+    with mmap.mmap(f_in.fileno(), 0, access=mmap.ACCESS_READ) as data:
+      while offset + RECORD_HEADER.size <= size:
+        (length,) = RECORD_HEADER.unpack_from(data, offset)
+        start = offset + RECORD_HEADER.size
+        if start + length > size:
+          break
+        offset = start + length
+        yield offset, data[start:offset]
+
+
+class SpoolReplayer:
+  ''' Replay the spooled records into the database at a limited rate.
+
+      Consecutive records of the same tenant are written together, after each successful write the replay position is
+      committed. If a write fails with a retryable error the replay pauses with an exponential backoff until the
+      database is healthy again.
+  '''
+
+  def __init__(self,
+               spool: Spool,
+               decode: Callable[[bytes], Message],
+               write_batch: Callable[[list[Message]], None],
+               is_retryable: Callable[[Exception], bool] = lambda exc: True,
+               count_rows: Callable[[Message], int] = lambda message: 1,
+               rows_per_second: float = 1000,
+               batch_rows: int = 500,
+               retry_seconds: float = 5,
+               max_retry_seconds: float = 60):
+    ''' Parameters
+        ----------
+        spool:              The spool to replay.
+        decode:             Deserialize a record into a message.
+        write_batch:        Write a batch of messages of one tenant to the database, raises if the write failed.
+        is_retryable:       Check if a failed write should be retried, otherwise the batch is dropped.
+        count_rows:         The number of rows a message writes, e.g. one per sample of a batch.
+        rows_per_second:    The maximum number of replayed rows per second.
+        batch_rows:         The maximum number of rows written at once.
+        retry_seconds:      The initial pause after a failed write.
+        max_retry_seconds:  The maximum pause after repeatedly failed writes.
+    '''
+    self.spool = spool
+    self.decode = decode
+    self.write_batch = write_batch
+    self.is_retryable = is_retryable
+    self.count_rows = count_rows
+    self.rows_per_second = rows_per_second
+    self.batch_rows = batch_rows
+    self.retry_seconds = retry_seconds
+    self.max_retry_seconds = max_retry_seconds
+    self.shutdown_event = threading.Event()
+    self.replayed = 0
+
+  def run(self):
+    ''' Replay the spool until the replayer is stopped. '''
+    retry_seconds = self.retry_seconds
+    while not self.shutdown_event.is_set():
+      if self.spool.empty():
+        self.shutdown_event.wait(1)
+        continue
+      segments = self.spool.sealed_segments()
+      if not segments:
+        self.spool.seal()
+        continue
+      try:
+        self.replay_segment(segments[0])
+        retry_seconds = self.retry_seconds
+      except Exception as exc:
+        logger.warning(f'Failed to replay spool {self.spool.directory}, retry in {retry_seconds} seconds: {exc}')
+        self.shutdown_event.wait(retry_seconds)
+        retry_seconds = min(retry_seconds * 2, self.max_retry_seconds)
+
+  def replay_segment(self, segment: Path):
+    ''' Replay the remaining records of a segment and remove it afterwards. '''
+    batch: list[Message] = []
+    rows = 0
+    batch_end = self.spool.read_offset(segment)
+    for offset, record in iter_records(segment=segment, offset=batch_end):
+      if self.shutdown_event.is_set():
+        return
+      message = self.decode(record)
+      if batch and (rows >= self.batch_rows or message.tenant_identifier != batch[0].tenant_identifier):
+        self._write(segment=segment, batch=batch, rows=rows, offset=batch_end)
+        batch, rows = [], 0
+      batch.append(message)
+      rows += self.count_rows(message)
+      batch_end = offset
+    if batch:
+      self._write(segment=segment, batch=batch, rows=rows, offset=batch_end)
+    self.spool.remove(segment)
+    logger.info(f'Replayed spool segment {segment.name}, {self.replayed} rows replayed so far.')
+
+  def _write(self, segment: Path, batch: list[Message], rows: int, offset: int):
+    started = time.monotonic()
+    try:
+      self.write_batch(batch)
+    except Exception as exc:
+      if self.is_retryable(exc):
+        raise
+      logger.error(f'Dropped {rows} spooled row(s) of {segment.name} which can not be written: {exc}')
+    self.spool.commit(segment=segment, offset=offset)
+    self.replayed += rows
+    pause = rows / self.rows_per_second - (time.monotonic() - started)
+    if pause > 0:
+      self.shutdown_event.wait(pause)
+
+  def stop(self):
+    self.shutdown_event.set()
@@ -0,0 +1,265 @@
+import bisect
+import threading
+import time
+import urllib.request
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Iterator
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+ROW_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+
+def _escape(value: str) -> str:
+  return str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = '') -> str:
+  pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+  if extra:
+    pairs.append(extra)
+  return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric(ABC):
+  ''' Base of the metrics, the samples are kept per combination of label values. '''
+  kind = ''
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self.lock = threading.Lock()
+
+  def _key(self, labels: dict) -> tuple:
+    if set(labels) != set(self.labelnames):
+      raise ValueError(f'Metric {self.name} requires the labels {self.labelnames}, got {tuple(labels)}')
+    return tuple(str(labels[name]) for name in self.labelnames)
+
+  @abstractmethod
+  def samples(self) -> Iterator[str]:
+    ''' The lines of the samples in the text exposition format. '''
+    pass
+
+  def render(self) -> str:
+    lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+    lines.extend(self.samples())
+    return '\n'.join(lines)
+
+
+class Counter(Metric):
+  ''' Monotonically increasing value, e.g. the number of received samples. '''
+  kind = 'counter'
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+    super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+    self.values: dict[tuple, float] = {}
+
+  def inc(self, amount: float = 1, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = self.values.get(key, 0) + amount
+
+  def samples(self) -> Iterator[str]:
+    with self.lock:
+      values = list(self.values.items())
+    for key, value in values:
+      yield f'{self.name}{_format_labels(self.labelnames, key)} {value}'
+
+
+class Gauge(Metric):
+  ''' Value which can go up and down, either set directly or read from a function when rendered. '''
+  kind = 'gauge'
+
+  def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+    super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+    self.values: dict[tuple, float | Callable[[], float]] = {}
+
+  def set(self, value: float, **labels):
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = value
+
+  def set_function(self, function: Callable[[], float], **labels):
+    ''' Read the value from the function each time the metrics are rendered. '''
+    key = self._key(labels)
+    with self.lock:
+      self.values[key] = function
+
+  def samples(self) -> Iterator[str]:
+    with self.lock:
+      values = list(self.values.items())
+    for key, value in values:
+      yield f'{self.name}{_format_labels(self.labelnames, key)} {value() if callable(value) else value}'
+
+
+class Histogram(Metric):
+  ''' Distribution of observed values in cumulative buckets, e.g. the flush latency. '''
+  kind = 'histogram'
+
+  def __init__(self,
+               name: str,
+               documentation: str,
+               labelnames: tuple[str, ...] = (),
+               buckets: tuple[float, ...] = LATENCY_BUCKETS):
+    super().__init__(name=name, documentation=documentation, labelnames=labelnames)
+    self.buckets = tuple(sorted(buckets))
+    self.counts: dict[tuple, list[int]] = {}
+    self.sums: dict[tuple, float] = {}
+
+  def observe(self, value: float, **labels):
+    key = self._key(labels)
+    index = bisect.bisect_left(self.buckets, value)
+    with self.lock:
+      counts = self.counts.get(key)
+      if counts is None:
+        counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+      counts[index] += 1
+      self.sums[key] = self.sums.get(key, 0) + value
+
+  @contextmanager
+  def time(self, **labels):
+    ''' Observe the duration of the with block in seconds. '''
+    started = time.perf_counter()
+    try:
+      yield
+    finally:
+      self.observe(time.perf_counter() - started, **labels)
+
+  def samples(self) -> Iterator[str]:
+    with self.lock:
+      values = [(key, list(counts), self.sums[key]) for key, counts in self.counts.items()]
+    for key, counts, total in values:
+      cumulative = 0
+      for bound, count in zip(self.buckets + (float('inf'),), counts):
+        cumulative += count
+        le = 'le="+Inf"' if bound == float('inf') else f'le="{bound}"'
+        yield f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}'
+      yield f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}'
+      yield f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}'
+
+
+class Registry:
+  ''' Collection of metrics rendered in the Prometheus text format. '''
+
+  def __init__(self):
+    self.metrics: dict[str, Metric] = {}
+    self.lock = threading.Lock()
+
+  def register(self, metric: Metric) -> Metric:
+    with self.lock:
+      if metric.name in self.metrics:
+        raise ValueError(f'Metric {metric.name} is already registered.')
+      self.metrics[metric.name] = metric
+    return metric
+
+  def render(self) -> str:
+    with self.lock:
+      metrics = list(self.metrics.values())
+    return '\n'.join(metric.render() for metric in metrics) + '\n'
+
+
+def merge_metrics(texts: list[str]) -> str:
+  ''' Merge metrics in the Prometheus text format by summing the samples with the same name and labels. All metrics
+      of the hub are counters, histograms or gauges of sizes, so the sum is the value of the whole hub.
+  '''
+  comments: dict[str, list[str]] = {}
+  samples: dict[str, dict[str, float]] = {}
+  for text in texts:
+    for line in text.splitlines():
+      if not line:
+        continue
+      if line.startswith('#'):
+        name = line.split(' ')[2]
+        if line not in comments.setdefault(name, []):
+          comments[name].append(line)
+        samples.setdefault(name, {})
+        continue
+      series, value = line.rsplit(' ', 1)
+      metric_samples = samples.setdefault(series.split('{')[0], {})
+      metric_samples[series] = metric_samples.get(series, 0) + float(value)
+  lines = []
+  for name, metric_samples in samples.items():
+    lines.extend(comments.get(name, []))
+    lines.extend(f'{series} {value}' for series, value in metric_samples.items())
+  return '\n'.join(lines) + '\n'
+
+
+class WorkerRegistry:
+  ''' Metrics of all worker processes of the hub, scraped from the metrics endpoints of the workers and merged. '''
+
+  def __init__(self, urls: list[str], timeout_seconds: float = 2):
+    self.urls = urls
+    self.timeout_seconds = timeout_seconds
+
+  def render(self) -> str:
+    texts = []
+    for url in self.urls:
+      try:
+        with urllib.request.urlopen(url, timeout=self.timeout_seconds) as response:
+          texts.append(response.read().decode())
+      except OSError:
+        continue
+    return merge_metrics(texts)
+
+
+REGISTRY = Registry()
+
+SAMPLES_RECEIVED = REGISTRY.register(
+    Counter('hub_samples_received_total', 'Samples received over gRPC.', ('tenant', 'type')))
+QUEUE_DEPTH = REGISTRY.register(Gauge('hub_queue_depth', 'Items waiting in the queue of a buffer.', ('buffer',)))
+WRITER_PENDING = REGISTRY.register(
+    Gauge('hub_writer_pending_batches', 'Batches waiting in the writer pool of a buffer.', ('buffer',)))
+BATCH_ROWS = REGISTRY.register(
+    Histogram('hub_batch_rows', 'Rows per dispatched batch.', ('buffer',), buckets=ROW_BUCKETS))
+QUEUE_WAIT_SECONDS = REGISTRY.register(
+    Histogram('hub_queue_wait_seconds', 'Time an item waits in the queue of a buffer.', ('buffer',)))
+BATCH_WAIT_SECONDS = REGISTRY.register(
+    Histogram('hub_batch_wait_seconds', 'Time between the first row of a batch and its dispatch.', ('buffer',)))
+FLUSH_SECONDS = REGISTRY.register(
+    Histogram('hub_flush_seconds', 'Time to write a dispatched batch.', ('buffer',)))
+LANE_OVERFLOWS = REGISTRY.register(
+    Counter('hub_lane_overflow_batches_total', 'Batches which did not fit into the full writer lane of their tenant.',
+            ('buffer', 'action')))
+FAILED_BATCHES = REGISTRY.register(
+    Counter('hub_failed_batches_total', 'Batches which failed to be written.', ('buffer', 'action')))
+DROPPED_ROWS = REGISTRY.register(Counter('hub_dropped_rows_total', 'Rows dropped by a buffer.', ('buffer', 'reason')))
+SPOOLED_ROWS = REGISTRY.register(Counter('hub_spooled_rows_total', 'Rows appended to the disk spool.', ('buffer',)))
+ROWS_WRITTEN = REGISTRY.register(
+    Counter('hub_rows_written_total', 'Rows written to the tenant databases.', ('query', 'tenant')))
+WRITE_SECONDS = REGISTRY.register(
+    Histogram('hub_database_write_seconds', 'Time of a database write transaction.', ('query',)))
+STAGE_SECONDS = REGISTRY.register(
+    Histogram('hub_write_stage_seconds', 'Time spent in the stages of a metrics write.', ('stage',)))
+SKIPPED_SAMPLES = REGISTRY.register(
+    Counter('hub_skipped_samples_total', 'Samples of metrics which could not be resolved.', ('tenant',)))
+LOG_RECORDS = REGISTRY.register(
+    Gauge('hub_loki_log_records', 'Log records shipped to or dropped by the Loki handler.', ('result',)))
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+  registry: Registry | WorkerRegistry = REGISTRY
+
+  def do_GET(self):
+    if self.path.split('?')[0] not in ('/', '/metrics'):
+      self.send_error(404)
+      return
+    body = self.registry.render().encode()
+    self.send_response(200)
+    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def log_message(self, format, *args):
+    pass
+
+
+def serve_metrics(host: str, port: int, registry: Registry | WorkerRegistry = REGISTRY) -> ThreadingHTTPServer:
+  ''' Serve the metrics on http://host:port/metrics from a daemon thread. '''
+  handler = type('MetricsHandler', (_MetricsHandler,), {'registry': registry})
+  server = ThreadingHTTPServer((host, port), handler)
+  server.daemon_threads = True
+  threading.Thread(target=server.serve_forever, name='metrics-http', daemon=True).start()
+  return server
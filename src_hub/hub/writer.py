@@ -0,0 +1,76 @@
+import threading
+import zlib
+from queue import Full, Queue
+from typing import Callable
+# local
+from hub.gls.gls import logger
+
+WriteBatch = Callable[[list], None]
+
+
+class WriterPool:
+  ''' Pool of writer threads with one ordered lane per thread.
+
+      Tenants are mapped onto the lanes with a stable hash, so all batches of a tenant are written by the same thread
+      in the order they were submitted while different tenants are written concurrently.
+  '''
+
+  def __init__(self, size: int = 4, max_pending_batches: int = 100, name: str = 'writer'):
+    ''' Parameters
+        ----------
+        size:                 The number of writer threads.
+        max_pending_batches:  The maximum number of batches waiting per lane.
+        name:                 The name prefix of the writer threads.
+    '''
+    if size < 1:
+      raise ValueError('The writer pool requires at least one thread.')
+    self.size = size
+    self.lanes: list[Queue] = [Queue(maxsize=max_pending_batches) for _ in range(size)]
+    self.threads = [
+        threading.Thread(target=self._run, args=(lane,), name=f'{name}-{index}')
+        for index, lane in enumerate(self.lanes)
+    ]
+
+  def lane_index(self, tenant_identifier: str) -> int:
+    ''' The lane of the tenant, stable across restarts. '''
+    return zlib.crc32(tenant_identifier.encode()) % self.size
+
+  def submit(self, tenant_identifier: str, write_batch: WriteBatch, batch: list, block: bool = True) -> bool:
+    ''' Queue a batch on the lane of the tenant, returns False if the lane is full and block is False. '''
+    lane = self.lanes[self.lane_index(tenant_identifier)]
+    if block:
+      lane.put((write_batch, batch))
+      return True
+    try:
+      lane.put_nowait((write_batch, batch))
+      return True
+    except Full:
+      return False
+
+  def start(self):
+    for thread in self.threads:
+      thread.start()
+
+  def stop(self):
+    ''' Write all pending batches and stop the writer threads. '''
+    for lane in self.lanes:
+      lane.put(None)
+    for thread in self.threads:
+      thread.join()
+
+  def pending(self) -> int:
+    return sum(lane.qsize() for lane in self.lanes)
+
+  def _run(self, lane: Queue):
+    while True:
+      task = lane.get()
+      if task is None:
+        lane.task_done()
+        break
+      write_batch, batch = task
+      try:
+        write_batch(batch)
+      except Exception as exc:
+        logger.error(f'Writer failed to write batch: {exc}', exc_info=True)
+      finally:
+        lane.task_done()
@@ -0,0 +1,171 @@
+import pytest
+import threading
+from queue import Queue
+from hub.buffer import Buffer, CommitResult, OverflowPolicy
+from hub.spool import Spool, iter_records
+from hub.writer import WriterPool
+from iot_libs.proto.hub_pb2 import NumericScalarBatch
+from sqlalchemy.exc import OperationalError
+
+
+class StubBuffer(Buffer):
+  ''' Buffer which records the written batches instead of writing them to the database. '''
+  message_type = NumericScalarBatch
+
+  def __init__(self, fail_with: Exception = None, **kwargs):
+    kwargs.setdefault('queue', Queue(maxsize=100))
+    super().__init__(**kwargs)
+    self.fail_with = fail_with
+    self.written: list[list[NumericScalarBatch]] = []
+
+  def write_data(self, batch):
+    if self.fail_with is not None:
+      raise self.fail_with
+    self.written.append(batch)
+
+
+def batch(tenant_identifier: str = 'tenant', rows: int = 1, value: float = 0) -> NumericScalarBatch:
+  return NumericScalarBatch(tenant_identifier=tenant_identifier,
+                            metric_index=[0] * rows,
+                            values=[value] * rows,
+                            timestamps_us=[1] * rows)
+
+
+def values(written: list[list[NumericScalarBatch]]) -> list[list[float]]:
+  return [[item.values[0] for item in items] for items in written]
+
+
+def test_batches_are_flushed_at_max_batch_rows():
+  buffer = StubBuffer(max_batch_rows=5)
+  batches = {}
+  for value in range(4):
+    buffer._add(batches=batches, item=batch(rows=2, value=value))
+  assert values(buffer.written) == [[0, 1, 2]]
+  assert batches['tenant'].rows == 2
+
+
+def test_batches_are_flushed_at_max_batch_bytes():
+  item_bytes = batch().ByteSize()
+  buffer = StubBuffer(max_batch_rows=100, max_batch_bytes=2 * item_bytes)
+  batches = {}
+  for value in range(3):
+    buffer._add(batches=batches, item=batch(value=value))
+  assert values(buffer.written) == [[0, 1]]
+
+
+def test_batches_are_flushed_after_linger_ms(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr('hub.buffer.time.monotonic', lambda: now[0])
+  buffer = StubBuffer(max_batch_rows=100, linger_ms=500)
+  batches = {}
+  buffer._add(batches=batches, item=batch(tenant_identifier='first', value=1))
+  batches['first'].started = now[0]
+  now[0] += 0.25
+  buffer._add(batches=batches, item=batch(tenant_identifier='second', value=2))
+  batches['second'].started = now[0]
+  now[0] += 0.125
+  buffer._flush_expired(batches=batches)
+  assert buffer.written == []
+  now[0] += 0.125
+  buffer._flush_expired(batches=batches)
+  assert values(buffer.written) == [[1]]
+  now[0] += 0.25
+  buffer._flush_expired(batches=batches)
+  assert values(buffer.written) == [[1], [2]]
+  assert batches == {}
+
+
+def test_tenants_are_batched_separately():
+  buffer = StubBuffer(max_batch_rows=2)
+  batches = {}
+  for tenant, value in (('first', 1), ('second', 2), ('first', 3)):
+    buffer._add(batches=batches, item=batch(tenant_identifier=tenant, value=value))
+  assert values(buffer.written) == [[1, 3]]
+  assert list(batches) == ['second']
+
+
+def test_process_writes_the_queued_batches():
+  buffer = StubBuffer(max_batch_rows=2, linger_ms=10000)
+  thread = threading.Thread(target=buffer.process)
+  thread.start()
+  results = []
+  for value in range(3):
+    buffer.put(batch(value=value), on_commit=results.append)
+  buffer.queue.put(None)
+  thread.join(timeout=5)
+  assert values(buffer.written) == [[0, 1], [2]]
+  assert results == [CommitResult.COMMITTED] * 3
+
+
+def test_block_policy_does_not_enqueue_into_a_full_queue():
+  buffer = StubBuffer(queue=Queue(maxsize=1), overflow_policy=OverflowPolicy.BLOCK)
+  assert buffer.try_put(batch(value=1))
+  assert not buffer.try_put(batch(value=2))
+  assert buffer.queue.qsize() == 1
+
+
+def test_drop_oldest_policy_replaces_the_oldest_item():
+  buffer = StubBuffer(queue=Queue(maxsize=2), overflow_policy=OverflowPolicy.DROP_OLDEST)
+  results = []
+  buffer.put(batch(value=1), on_commit=results.append)
+  buffer.put(batch(value=2))
+  assert buffer.try_put(batch(value=3))
+  assert results == [CommitResult.RETRY]
+  assert buffer.dropped == 1
+  assert [buffer.queue.get_nowait()[0].values[0] for _ in range(2)] == [2, 3]
+
+
+def test_spill_policy_appends_to_the_spool(tmp_path):
+  spool = Spool(directory=tmp_path)
+  buffer = StubBuffer(queue=Queue(maxsize=1), overflow_policy=OverflowPolicy.SPILL, spool=spool)
+  results = []
+  buffer.put(batch(value=1))
+  assert not buffer.try_put(batch(value=2))
+  assert spool.empty()
+  buffer.put(batch(value=3), on_commit=results.append)
+  assert results == [CommitResult.COMMITTED]
+  spool.seal()
+  records = [NumericScalarBatch.FromString(record) for _, record in iter_records(spool.segments()[0])]
+  assert [record.values[0] for record in records] == [3]
+
+
+def test_spill_policy_requires_a_spool():
+  with pytest.raises(ValueError):
+    StubBuffer(overflow_policy=OverflowPolicy.SPILL)
+
+
+@pytest.mark.parametrize('with_spool, result', [(True, CommitResult.COMMITTED), (False, CommitResult.RETRY)])
+def test_full_writer_lanes_spill_or_drop(tmp_path, with_spool, result):
+  spool = Spool(directory=tmp_path) if with_spool else None
+  buffer = StubBuffer(max_batch_rows=1,
+                      overflow_policy=OverflowPolicy.DROP_OLDEST,
+                      spool=spool,
+                      writer_pool_size=1)
+  buffer.writer_pool = WriterPool(size=1, max_pending_batches=1)
+  results = []
+  batches = {}
+  buffer._add(batches=batches, item=batch(value=1), on_commit=results.append)
+  buffer._add(batches=batches, item=batch(value=2), on_commit=results.append)
+  assert results == [result]
+  assert buffer.writer_pool.pending() == 1
+  assert buffer.dropped == (0 if with_spool else 1)
+  if with_spool:
+    assert not spool.empty()
+
+
+def test_failed_writes_are_spooled_if_the_database_is_unavailable(tmp_path):
+  spool = Spool(directory=tmp_path)
+  buffer = StubBuffer(fail_with=OperationalError('insert', {}, ConnectionError('database unavailable')),
+                      spool=spool,
+                      spool_on_failure=True)
+  results = []
+  buffer.flush(batch=[batch(rows=3)], callbacks=[results.append])
+  assert results == [CommitResult.COMMITTED]
+  assert not spool.empty()
+
+
+def test_invalid_batches_are_rejected():
+  buffer = StubBuffer(fail_with=ValueError('invalid batch'))
+  results = []
+  buffer.flush(batch=[batch()], callbacks=[results.append])
+  assert results == [CommitResult.REJECTED]
@@ -0,0 +1,59 @@
+from hub.cache import IdCache
+
+
+def test_least_recently_used_ids_are_evicted():
+  cache = IdCache(max_size=2)
+  cache.put(('tenant', 'device', 'a'), '1')
+  cache.put(('tenant', 'device', 'b'), '2')
+  assert cache.get(('tenant', 'device', 'a')) == '1'
+  cache.put(('tenant', 'device', 'c'), '3')
+  assert len(cache) == 2
+  assert cache.get(('tenant', 'device', 'b')) is None
+  assert cache.get(('tenant', 'device', 'a')) == '1'
+  assert cache.get(('tenant', 'device', 'c')) == '3'
+
+
+def test_negative_entries_expire_after_the_ttl(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr('hub.cache.time.monotonic', lambda: now[0])
+  cache = IdCache(negative_ttl_seconds=30)
+  key = ('tenant', 'device', 'unknown')
+  cache.put_negative(key)
+  now[0] += 30
+  assert cache.is_negative(key)
+  now[0] += 0.5
+  assert not cache.is_negative(key)
+  assert key not in cache.negative_entries
+
+
+def test_caching_an_id_clears_its_negative_entry():
+  cache = IdCache()
+  key = ('tenant', 'device', 'metric')
+  cache.put_negative(key)
+  cache.put(key, '1')
+  assert not cache.is_negative(key)
+
+
+def test_negative_entries_are_bounded():
+  cache = IdCache(max_size=2)
+  for name in ('a', 'b', 'c'):
+    cache.put_negative(('tenant', 'device', name))
+  assert not cache.is_negative(('tenant', 'device', 'a'))
+  assert cache.is_negative(('tenant', 'device', 'c'))
+
+
+def test_invalidate_device_removes_only_its_entries():
+  cache = IdCache()
+  cache.put(('tenant', 'device', 'a'), '1')
+  cache.put(('tenant', 'device', 'b', 'numeric_array'), '2')
+  cache.put(('tenant', 'other', 'a'), '3')
+  cache.put(('other', 'device', 'a'), '4')
+  cache.put_negative(('tenant', 'device', 'c'))
+  cache.put_negative(('tenant', 'other', 'c'))
+  cache.invalidate_device('tenant', 'device')
+  assert cache.get(('tenant', 'device', 'a')) is None
+  assert cache.get(('tenant', 'device', 'b', 'numeric_array')) is None
+  assert not cache.is_negative(('tenant', 'device', 'c'))
+  assert cache.get(('tenant', 'other', 'a')) == '3'
+  assert cache.get(('other', 'device', 'a')) == '4'
+  assert cache.is_negative(('tenant', 'other', 'c'))
@@ -0,0 +1,76 @@
+import pytest
+from hub.handles import HandleRegistry, UnknownSessionError
+from iot_libs.proto.batch import validate_batch
+from iot_libs.proto.hub_pb2 import MetricDescriptor, MetricRegistration, NumericScalarBatch
+
+
+def registration(*metric_identifiers: str, session_id: str = '', device_identifier: str = 'device') -> MetricRegistration:
+  return MetricRegistration(tenant_identifier='tenant',
+                            device_identifier=device_identifier,
+                            session_id=session_id,
+                            metrics=[MetricDescriptor(metric_identifier=identifier) for identifier in metric_identifiers])
+
+
+def handle_batch(session_id: str, handles: list[int]) -> NumericScalarBatch:
+  return NumericScalarBatch(session_id=session_id,
+                            metric_index=handles,
+                            values=[float(handle) for handle in handles],
+                            timestamps_us=[1] * len(handles))
+
+
+def test_registered_metrics_keep_their_handles():
+  registry = HandleRegistry()
+  first = registry.register(registration('a', 'b'))
+  second = registry.register(registration('b', 'c', session_id=first.session_id))
+  assert list(first.handles) == [0, 1]
+  assert second.session_id == first.session_id
+  assert list(second.handles) == [1, 2]
+
+
+def test_expand_restores_the_metric_descriptors():
+  registry = HandleRegistry()
+  session_id = registry.register(registration('a', 'b')).session_id
+  batch = registry.expand(handle_batch(session_id, [1, 0, 1]))
+  validate_batch(batch)
+  assert (batch.tenant_identifier, batch.device_identifier, batch.session_id) == ('tenant', 'device', '')
+  assert [batch.metrics[index].metric_identifier for index in batch.metric_index] == ['b', 'a', 'b']
+
+
+def test_batches_without_session_are_unchanged():
+  batch = NumericScalarBatch(tenant_identifier='tenant', device_identifier='device')
+  assert HandleRegistry().expand(batch) is batch
+
+
+def test_unknown_sessions_are_rejected():
+  registry = HandleRegistry()
+  with pytest.raises(UnknownSessionError):
+    registry.expand(handle_batch('unknown', [0]))
+  with pytest.raises(UnknownSessionError):
+    registry.register(registration('a', session_id='unknown'))
+
+
+def test_unknown_handles_fail_the_validation():
+  registry = HandleRegistry()
+  session_id = registry.register(registration('a')).session_id
+  with pytest.raises(ValueError):
+    validate_batch(registry.expand(handle_batch(session_id, [0, 1])))
+
+
+def test_least_recently_used_sessions_are_evicted():
+  registry = HandleRegistry(max_sessions=2)
+  first = registry.register(registration('a', device_identifier='first')).session_id
+  second = registry.register(registration('a', device_identifier='second')).session_id
+  registry.expand(handle_batch(first, [0]))
+  third = registry.register(registration('a', device_identifier='third')).session_id
+  assert len(registry) == 2
+  with pytest.raises(UnknownSessionError):
+    registry.expand(handle_batch(second, [0]))
+  assert registry.expand(handle_batch(first, [0])).device_identifier == 'first'
+  assert registry.expand(handle_batch(third, [0])).device_identifier == 'third'
+
+
+def test_sessions_can_not_be_taken_over_by_another_device():
+  registry = HandleRegistry()
+  session_id = registry.register(registration('a')).session_id
+  with pytest.raises(ValueError):
+    registry.register(registration('b', session_id=session_id, device_identifier='other'))
@@ -0,0 +1,72 @@
+from contextlib import contextmanager
+from hub.liveness import LivenessIndex, LivenessMonitor
+from iot_libs.proto.enums import DeviceHealthStatus
+
+NOW = 1700000000.0
+
+
+class StubManager:
+
+  @contextmanager
+  def connection(self, db_name: str):
+    yield db_name
+
+
+def test_repeated_heartbeats_keep_one_deadline_per_device():
+  index = LivenessIndex(timeout_seconds=30)
+  for alive in (NOW, NOW + 10, NOW + 5, NOW + 20):
+    index.heartbeat('tenant', 'device', alive=alive)
+  assert len(index) == 1
+  assert index.deadlines[('tenant', 'device')] == NOW + 50
+  assert index.pop_expired(now=NOW + 49) == []
+  assert index.pop_expired(now=NOW + 50) == [('tenant', 'device', NOW + 50)]
+  assert index.heap == []
+
+
+def test_devices_expire_at_the_cutoff():
+  index = LivenessIndex(timeout_seconds=30)
+  index.heartbeat('tenant', 'early', alive=NOW)
+  index.heartbeat('tenant', 'late', alive=NOW + 1)
+  assert index.pop_expired(now=NOW + 29.9) == []
+  assert index.pop_expired(now=NOW + 30) == [('tenant', 'early', NOW + 30)]
+  assert index.pop_expired(now=NOW + 30) == []
+  assert len(index) == 1
+
+
+def test_offline_devices_are_removed():
+  index = LivenessIndex(timeout_seconds=30)
+  index.heartbeat('tenant', 'device', alive=NOW)
+  index.heartbeat('tenant', 'device', alive=NOW + 1, status=DeviceHealthStatus.OFFLINE.value)
+  assert len(index) == 0
+  assert index.pop_expired(now=NOW + 60) == []
+
+
+def test_expired_devices_are_restored_after_a_failed_offline_update(monkeypatch):
+  calls = []
+
+  def set_devices_offline(device_identifiers, cutoff, conn):
+    calls.append(sorted(device_identifiers))
+    if len(calls) == 1:
+      raise ConnectionError('database unavailable')
+    return device_identifiers
+
+  monkeypatch.setattr('hub.liveness.set_devices_offline', set_devices_offline)
+  index = LivenessIndex(timeout_seconds=30)
+  index.heartbeat('tenant', 'first', alive=NOW)
+  index.heartbeat('tenant', 'second', alive=NOW)
+  monitor = LivenessMonitor(index=index, db_manager=StubManager())
+  monitor.check(now=NOW + 31)
+  assert len(index) == 2
+  monitor.check(now=NOW + 32)
+  assert calls == [['first', 'second'], ['first', 'second']]
+  assert len(index) == 0
+
+
+def test_restore_keeps_a_newer_heartbeat():
+  index = LivenessIndex(timeout_seconds=30)
+  index.heartbeat('tenant', 'device', alive=NOW)
+  expired = index.pop_expired(now=NOW + 30)
+  index.heartbeat('tenant', 'device', alive=NOW + 40)
+  index.restore(expired)
+  assert index.deadlines[('tenant', 'device')] == NOW + 70
+  assert index.pop_expired(now=NOW + 60) == []
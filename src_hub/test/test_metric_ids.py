@@ -0,0 +1,33 @@
+import pytest
+from hub.gls.gls import metric_id_cache, path_id_cache
+from hub.queries.metrics import metric_key, resolve_metric_ids
+from iot_libs.proto.hub_pb2 import NumericScalarValues
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+  metric_id_cache.clear()
+  path_id_cache.clear()
+  yield
+  metric_id_cache.clear()
+  path_id_cache.clear()
+
+
+def sample(metric_identifier: str) -> NumericScalarValues:
+  return NumericScalarValues(tenant_identifier='tenant', device_identifier='device', metric_identifier=metric_identifier)
+
+
+def test_metrics_of_another_type_are_negatively_cached(monkeypatch):
+  queries = []
+
+  def execute_select_query(conn, query, params, row_factory):
+    queries.append(params['metric_identifiers'])
+    return [{'metric_key': 1, 'device_identifier': 'device', 'metric_identifier': 'scalar'}]
+
+  monkeypatch.setattr('hub.queries.metrics.execute_select_query', execute_select_query)
+  batch = [sample('scalar'), sample('array')]
+  assert resolve_metric_ids(batch=batch, conn=None) == {metric_key(sample('scalar')): 1}
+  assert metric_id_cache.is_negative(metric_key(sample('array')))
+  assert not metric_id_cache.is_negative(metric_key(sample('scalar')))
+  assert resolve_metric_ids(batch=batch, conn=None) == {metric_key(sample('scalar')): 1}
+  assert queries == [['scalar', 'array']]
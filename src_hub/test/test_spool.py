@@ -0,0 +1,171 @@
+import pytest
+from hub.spool import RECORD_HEADER, Spool, SpoolFullError, SpoolReplayer, iter_records
+from hub.buffer import count_rows
+from iot_libs.proto.hub_pb2 import NumericScalarBatch, NumericScalarValues
+
+
+class RecordingEvent:
+  ''' Stand-in for the shutdown event of the replayer, which records the pauses instead of waiting. '''
+
+  def __init__(self):
+    self.pauses = []
+
+  def is_set(self):
+    return False
+
+  def wait(self, seconds):
+    self.pauses.append(seconds)
+
+
+def sample(tenant_identifier: str = 'tenant', value: float = 1.0) -> NumericScalarValues:
+  return NumericScalarValues(tenant_identifier=tenant_identifier,
+                             device_identifier='device',
+                             metric_identifier='metric',
+                             value=value)
+
+
+def test_segments_are_rotated_at_the_segment_size(tmp_path):
+  spool = Spool(directory=tmp_path, segment_bytes=100)
+  for _ in range(5):
+    spool.append([b'x' * 60])
+  segments = spool.segments()
+  assert len(segments) == 3
+  assert spool.sealed_segments() == segments[:2]
+  assert [len(list(iter_records(segment))) for segment in segments] == [2, 2, 1]
+
+
+def test_small_records_share_a_segment_until_it_is_sealed(tmp_path):
+  spool = Spool(directory=tmp_path, segment_bytes=1000)
+  spool.append([b'a', b'b'])
+  spool.append([b'c'])
+  assert len(spool.segments()) == 1
+  assert spool.sealed_segments() == []
+  spool.seal()
+  assert [record for _, record in iter_records(spool.segments()[0])] == [b'a', b'b', b'c']
+
+
+def test_appending_to_a_full_spool_raises(tmp_path):
+  record_bytes = RECORD_HEADER.size + 10
+  spool = Spool(directory=tmp_path, segment_bytes=1000, max_bytes=2 * record_bytes)
+  spool.append([b'x' * 10, b'x' * 10])
+  with pytest.raises(SpoolFullError):
+    spool.append([b'x'])
+  assert spool.size_bytes == 2 * record_bytes
+
+
+def test_size_is_restored_and_freed_by_removed_segments(tmp_path):
+  spool = Spool(directory=tmp_path, segment_bytes=10)
+  spool.append([b'x' * 20])
+  spool.append([b'y' * 20])
+  spool.close()
+  reopened = Spool(directory=tmp_path, segment_bytes=10)
+  assert reopened.size_bytes == 2 * (RECORD_HEADER.size + 20)
+  reopened.remove(reopened.segments()[0])
+  assert reopened.size_bytes == RECORD_HEADER.size + 20
+  assert len(reopened.segments()) == 1
+
+
+def test_truncated_records_are_ignored(tmp_path):
+  spool = Spool(directory=tmp_path)
+  spool.append([b'complete'])
+  spool.close()
+  segment = spool.segments()[0]
+  with open(segment, 'ab') as f_out:
+    f_out.write(RECORD_HEADER.pack(100) + b'partial')
+  assert [record for _, record in iter_records(segment)] == [b'complete']
+
+
+def test_replay_writes_batches_per_tenant_and_removes_the_segment(tmp_path):
+  spool = Spool(directory=tmp_path)
+  samples = [sample('a', 1), sample('a', 2), sample('b', 3), sample('a', 4)]
+  spool.append([item.SerializeToString() for item in samples])
+  spool.seal()
+  written = []
+  replayer = SpoolReplayer(spool=spool,
+                           decode=NumericScalarValues.FromString,
+                           write_batch=written.append,
+                           rows_per_second=1e9)
+  replayer.replay_segment(spool.sealed_segments()[0])
+  assert [[item.value for item in batch] for batch in written] == [[1, 2], [3], [4]]
+  assert replayer.replayed == 4
+  assert spool.segments() == []
+  assert spool.empty()
+
+
+def test_replay_continues_after_the_committed_offset(tmp_path):
+  spool = Spool(directory=tmp_path)
+  spool.append([sample(value=value).SerializeToString() for value in range(4)])
+  spool.seal()
+  segment = spool.sealed_segments()[0]
+  written, calls = [], []
+
+  def fail_second_write(batch):
+    calls.append(batch)
+    if len(calls) == 2:
+      raise ConnectionError('database unavailable')
+    written.append(batch)
+
+  replayer = SpoolReplayer(spool=spool,
+                           decode=NumericScalarValues.FromString,
+                           write_batch=fail_second_write,
+                           rows_per_second=1e9,
+                           batch_rows=2)
+  with pytest.raises(ConnectionError):
+    replayer.replay_segment(segment)
+  assert segment.exists()
+  replayer.replay_segment(segment)
+  assert [[item.value for item in batch] for batch in written] == [[0, 1], [2, 3]]
+  assert not segment.exists()
+
+
+def test_unretryable_batches_are_dropped(tmp_path):
+  spool = Spool(directory=tmp_path)
+  spool.append([sample().SerializeToString()])
+  spool.seal()
+
+  def reject(batch):
+    raise ValueError('invalid batch')
+
+  replayer = SpoolReplayer(spool=spool,
+                           decode=NumericScalarValues.FromString,
+                           write_batch=reject,
+                           is_retryable=lambda exc: not isinstance(exc, ValueError))
+  replayer.shutdown_event = RecordingEvent()
+  replayer.replay_segment(spool.sealed_segments()[0])
+  assert spool.empty()
+
+
+def test_replay_is_limited_to_the_rows_per_second(tmp_path, monkeypatch):
+  monkeypatch.setattr('hub.spool.time.monotonic', lambda: 100.0)
+  spool = Spool(directory=tmp_path)
+  spool.append([sample(value=value).SerializeToString() for value in range(30)])
+  spool.seal()
+  replayer = SpoolReplayer(spool=spool,
+                           decode=NumericScalarValues.FromString,
+                           write_batch=lambda batch: None,
+                           rows_per_second=100,
+                           batch_rows=10)
+  replayer.shutdown_event = RecordingEvent()
+  replayer.replay_segment(spool.sealed_segments()[0])
+  assert replayer.shutdown_event.pauses == pytest.approx([0.1, 0.1, 0.1])
+  assert replayer.replayed == 30
+
+
+def test_replay_counts_the_rows_of_multi_sample_batches(tmp_path, monkeypatch):
+  monkeypatch.setattr('hub.spool.time.monotonic', lambda: 100.0)
+  spool = Spool(directory=tmp_path)
+  batches = [NumericScalarBatch(tenant_identifier='tenant', values=[1.0] * 4) for _ in range(6)]
+  spool.append([batch.SerializeToString() for batch in batches])
+  spool.seal()
+  written = []
+  replayer = SpoolReplayer(spool=spool,
+                           decode=NumericScalarBatch.FromString,
+                           write_batch=written.append,
+                           count_rows=count_rows,
+                           rows_per_second=100,
+                           batch_rows=10)
+  replayer.shutdown_event = RecordingEvent()
+  replayer.replay_segment(spool.sealed_segments()[0])
+  assert [len(batch) for batch in written] == [3, 3]
+  assert replayer.replayed == 24
+  assert replayer.shutdown_event.pauses == pytest.approx([0.12, 0.12])
@@ -0,0 +1,71 @@
+import pytest
+import threading
+import zlib
+from hub.writer import WriterPool
+
+
+def test_tenants_are_mapped_to_stable_crc32_lanes():
+  pool = WriterPool(size=4)
+  for tenant in ('100000', '100001', 'tenant'):
+    assert pool.lane_index(tenant) == zlib.crc32(tenant.encode()) % 4
+    assert pool.lane_index(tenant) == WriterPool(size=4).lane_index(tenant)
+
+
+def test_batches_of_a_tenant_are_written_in_order():
+  written = []
+  pool = WriterPool(size=3)
+  pool.start()
+  for index in range(50):
+    pool.submit('tenant', write_batch=written.append, batch=[index])
+  pool.stop()
+  assert written == [[index] for index in range(50)]
+
+
+def test_submit_without_blocking_fails_on_a_full_lane():
+  pool = WriterPool(size=2, max_pending_batches=1)
+  tenant = '100000'
+  other = next(f'{index}' for index in range(100) if pool.lane_index(f'{index}') != pool.lane_index(tenant))
+  assert pool.submit(tenant, write_batch=print, batch=[1], block=False)
+  assert not pool.submit(tenant, write_batch=print, batch=[2], block=False)
+  assert pool.submit(other, write_batch=print, batch=[3], block=False)
+  assert pool.pending() == 2
+
+
+def test_stop_drains_the_lanes():
+  written = []
+  release = threading.Event()
+
+  def write_batch(batch):
+    release.wait(timeout=5)
+    written.append(batch)
+
+  pool = WriterPool(size=2, max_pending_batches=10)
+  pool.start()
+  for index in range(10):
+    pool.submit(f'{index}', write_batch=write_batch, batch=[index])
+  release.set()
+  pool.stop()
+  assert sorted(written) == [[index] for index in range(10)]
+  assert pool.pending() == 0
+  assert not any(thread.is_alive() for thread in pool.threads)
+
+
+def test_failed_writes_do_not_stop_the_lane():
+  written = []
+
+  def write_batch(batch):
+    if batch == [0]:
+      raise ConnectionError('database unavailable')
+    written.append(batch)
+
+  pool = WriterPool(size=1)
+  pool.start()
+  pool.submit('tenant', write_batch=write_batch, batch=[0])
+  pool.submit('tenant', write_batch=write_batch, batch=[1])
+  pool.stop()
+  assert written == [[1]]
+
+
+def test_pool_requires_a_thread():
+  with pytest.raises(ValueError):
+    WriterPool(size=0)
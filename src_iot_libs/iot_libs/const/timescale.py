@@ -0,0 +1,39 @@
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Rollup:
+  ''' Continuous aggregate with min, max, avg, sum and count of the values per metric and time bucket.
+
+      The refresh policy materializes the buckets between start_offset and end_offset before now every
+      schedule_interval, newer buckets are aggregated from the raw values at query time.
+  '''
+  view: str
+  bucket: str
+  seconds: int
+  start_offset: str
+  end_offset: str
+  schedule_interval: str
+
+
+# Ordered from the finest to the coarsest bucket
+NUMERIC_SCALAR_ROLLUPS = (
+    Rollup(view='numeric_scalar_values_1m',
+           bucket='1 minute',
+           seconds=60,
+           start_offset='1 day',
+           end_offset='1 minute',
+           schedule_interval='1 minute'),
+    Rollup(view='numeric_scalar_values_1h',
+           bucket='1 hour',
+           seconds=3600,
+           start_offset='7 days',
+           end_offset='1 hour',
+           schedule_interval='30 minutes'),
+    Rollup(view='numeric_scalar_values_1d',
+           bucket='1 day',
+           seconds=86400,
+           start_offset='60 days',
+           end_offset='1 day',
+           schedule_interval='1 hour'),
+)
@@ -1,25 +1,286 @@
 import atexit
+import gzip
 import logging
 import logging.config
 import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
 from pathlib import Path
 from importlib.resources import files
+from typing import Callable
 
 
 class LokiHandler(logging.Handler):
-  ''' Grafana Loki handler for python logging.'''
-  pass
+  ''' Grafana Loki handler for python logging.
+
+      The records are buffered in memory and pushed by a background thread in gzip compressed batches, once a batch is
+      full or the flush interval has passed. Emitting a record never waits for the network, if the buffer is full the
+      oldest records are dropped and counted. Batches which can not be pushed are retried a few times and then dropped.
+  '''
+
+  def __init__(self,
+               url: str,
+               labels: dict[str, str] = None,
+               batch_size: int = 500,
+               batch_bytes: int = 1048576,
+               flush_interval: float = 1,
+               max_buffer: int = 10000,
+               max_retries: int = 3,
+               timeout: float = 5,
+               headers: dict[str, str] = None,
+               level: int = logging.NOTSET):
+    ''' Parameters
+        ----------
+        url:             The push endpoint, e.g. http://loki:3100/loki/api/v1/push.
+        labels:          The stream labels of all records, the level of a record is added as label level.
+        batch_size:      The maximum number of records per push.
+        batch_bytes:     The maximum size of the formatted records per push.
+        flush_interval:  The maximum number of seconds a record waits in the buffer.
+        max_buffer:      The maximum number of buffered records.
+        max_retries:     The number of retries of a push which failed because Loki is unavailable.
+        timeout:         The timeout of a push in seconds.
+        headers:         Additional HTTP headers, e.g. the X-Scope-OrgID of the tenant.
+    '''
+    super().__init__(level=level)
+    self.url = url
+    self.labels = dict(labels or {})
+    self.batch_size = batch_size
+    self.batch_bytes = batch_bytes
+    self.flush_interval = flush_interval
+    self.max_buffer = max_buffer
+    self.max_retries = max_retries
+    self.timeout = timeout
+    self.headers = dict(headers or {})
+    self.buffer: deque[tuple[str, str, str]] = deque()
+    self.buffer_bytes = 0
+    self.condition = threading.Condition()
+    self.flush_requested = False
+    self.closed = False
+    self.pushing = False
+    self.sent = 0
+    self.dropped = 0
+    self.failed_pushes = 0
+    self.thread = threading.Thread(target=self._run, name='loki-handler', daemon=True)
+    self.thread.start()
+
+  def emit(self, record: logging.LogRecord):
+    try:
+      line = self.format(record)
+    except Exception:
+      self.handleError(record)
+      return
+    with self.condition:
+      while len(self.buffer) >= self.max_buffer:
+        self.buffer_bytes -= len(self.buffer.popleft()[2])
+        self.dropped += 1
+      self.buffer.append((str(int(record.created * 1e9)), record.levelname.lower(), line))
+      self.buffer_bytes += len(line)
+      if len(self.buffer) >= self.batch_size or self.buffer_bytes >= self.batch_bytes:
+        self.condition.notify_all()
+
+  def flush(self, timeout: float = None):
+    ''' Push the buffered records and wait until they are pushed or dropped. '''
+    with self.condition:
+      self.flush_requested = True
+      self.condition.notify_all()
+      self.condition.wait_for(lambda: (not self.buffer and not self.pushing) or not self.thread.is_alive(),
+                              timeout=self.timeout * (self.max_retries + 1) if timeout is None else timeout)
+
+  def close(self):
+    with self.condition:
+      self.closed = True
+      self.condition.notify_all()
+    self.thread.join(timeout=self.timeout * (self.max_retries + 1))
+    super().close()
+
+  def _take_batch(self) -> list[tuple[str, str, str]]:
+    batch = []
+    size = 0
+    while self.buffer and len(batch) < self.batch_size and (not batch or size < self.batch_bytes):
+      entry = self.buffer.popleft()
+      size += len(entry[2])
+      batch.append(entry)
+    self.buffer_bytes -= size
+    return batch
+
+  def _run(self):
+    while True:
+      with self.condition:
+        self.pushing = False
+        self.condition.notify_all()
+        deadline = time.monotonic() + self.flush_interval
+        while not (self.closed or self.flush_requested or len(self.buffer) >= self.batch_size or
+                   self.buffer_bytes >= self.batch_bytes):
+          remaining = deadline - time.monotonic()
+          if remaining <= 0:
+            break
+          self.condition.wait(timeout=remaining)
+        if self.closed and not self.buffer:
+          return
+        batch = self._take_batch()
+        if not self.buffer:
+          self.flush_requested = False
+        self.pushing = bool(batch)
+      if batch:
+        self._push(batch)
+
+  def _push(self, batch: list[tuple[str, str, str]]):
+    streams: dict[str, list[list[str]]] = {}
+    for timestamp, level, line in batch:
+      streams.setdefault(level, []).append([timestamp, line])
+    body = {
+        'streams': [{
+            'stream': {
+                **self.labels, 'level': level
+            },
+            'values': values
+        } for level, values in streams.items()]
+    }
+    data = gzip.compress(json.dumps(body).encode())
+    headers = {'Content-Type': 'application/json', 'Content-Encoding': 'gzip', **self.headers}
+    delay = 0.5
+    for attempt in range(self.max_retries + 1):
+      try:
+        request = urllib.request.Request(self.url, data=data, headers=headers, method='POST')
+        with urllib.request.urlopen(request, timeout=self.timeout):
+          pass
+        self.sent += len(batch)
+        return
+      except urllib.error.HTTPError as exc:
+        if exc.code != 429 and exc.code < 500:
+          break
+      except (OSError, ValueError):
+        pass
+      if attempt < self.max_retries and not self.closed:
+        time.sleep(delay)
+        delay *= 2
+    self.failed_pushes += 1
+    self.dropped += len(batch)
+
+
+def parse_labels(labels: str) -> dict[str, str]:
+  ''' Parse labels in the form app=hub,env=prod. '''
+  return dict(label.split('=', 1) for label in labels.split(',') if '=' in label)
+
+
+class Lazy:
+  ''' Argument of a log message which is only computed if the record is actually formatted. '''
+
+  def __init__(self, function: Callable, *args, **kwargs):
+    self.function = function
+    self.args = args
+    self.kwargs = kwargs
+
+  def __str__(self) -> str:
+    return str(self.function(*self.args, **self.kwargs))
+
+
+class BudgetLogger(logging.LoggerAdapter, ABC):
+  ''' Logger adapter which only emits a part of the records of every key, e.g. for log calls on hot paths.
+
+      The key defaults to the message template, so every call site has its own budget. Pass the values as arguments
+      instead of formatting them into the message, e.g. logger.info('Received %s', request), so that dropped records
+      are never formatted. The number of records dropped since the last emitted one is appended to the message.
+      The budgets of at most max_keys keys are kept, the least recently logged keys are forgotten first.
+  '''
+
+  def __init__(self, logger: logging.Logger, max_keys: int = 10000):
+    super().__init__(logger, {})
+    self.max_keys = max_keys
+    self.lock = threading.Lock()
+    self.suppressed: dict[object, int] = {}
+
+  @abstractmethod
+  def allow(self, key) -> bool:
+    ''' Check if a record of the key is emitted and update the budget of the key, called with the lock held. '''
+    pass
+
+  def _evict(self, budgets: OrderedDict):
+    ''' Forget the least recently used keys beyond max_keys, together with their suppressed counts. '''
+    while len(budgets) > self.max_keys:
+      key, _ = budgets.popitem(last=False)
+      self.suppressed.pop(key, None)
+
+  def log(self, level: int, msg: str, *args, key=None, **kwargs):
+    if not self.isEnabledFor(level):
+      return
+    key = msg if key is None else key
+    with self.lock:
+      if not self.allow(key):
+        self.suppressed[key] = self.suppressed.get(key, 0) + 1
+        return
+      suppressed = self.suppressed.pop(key, 0)
+    if suppressed:
+      msg = f'{msg} (%d similar message(s) suppressed)'
+      args = args + (suppressed,)
+    kwargs.setdefault('stacklevel', 2)
+    self.logger.log(level, msg, *args, **kwargs)
+
+
+class SampledLogger(BudgetLogger):
+  ''' Emit the first and then every nth record of a key. '''
+
+  def __init__(self, logger: logging.Logger, every: int = 100, max_keys: int = 10000):
+    super().__init__(logger, max_keys=max_keys)
+    self.every = max(int(every), 1)
+    self.counts: OrderedDict[object, int] = OrderedDict()
+
+  def allow(self, key) -> bool:
+    count = self.counts.get(key, 0)
+    self.counts[key] = count + 1
+    self.counts.move_to_end(key)
+    self._evict(self.counts)
+    return count % self.every == 0
+
+
+class RateLimitedLogger(BudgetLogger):
+  ''' Emit at most per_second records of a key per second, with bursts of up to burst records. '''
+
+  def __init__(self, logger: logging.Logger, per_second: float = 1, burst: int = 1, max_keys: int = 10000):
+    super().__init__(logger, max_keys=max_keys)
+    self.per_second = per_second
+    self.burst = burst
+    self.buckets: OrderedDict[object, tuple[float, float]] = OrderedDict()
+
+  def allow(self, key) -> bool:
+    now = time.monotonic()
+    tokens, updated = self.buckets.get(key, (self.burst, now))
+    tokens = min(self.burst, tokens + (now - updated) * self.per_second)
+    allowed = tokens >= 1
+    self.buckets[key] = (tokens - 1 if allowed else tokens, now)
+    self.buckets.move_to_end(key)
+    self._evict(self.buckets)
+    return allowed
 
 
 class LoggerSetup:
   ''' Class to setup logging configuration from a json file.'''
 
-  def __init__(self, logger_name: str = 'logger', config_path: str | Path = None):
+  def __init__(self,
+               logger_name: str = 'logger',
+               config_path: str | Path = None,
+               loki_url: str = None,
+               loki_labels: dict[str, str] = None):
+    ''' Parameters
+        ----------
+        logger_name:  The name of the logger.
+        config_path:  The logging configuration, defaults to the configuration of iot_libs.
+        loki_url:     The Loki push endpoint the records are shipped to, defaults to LOKI_URL, unset disables Loki.
+        loki_labels:  The stream labels, defaults to LOKI_LABELS in the form app=hub,env=prod.
+    '''
     if config_path is None:
       config_path = files('iot_libs.config').joinpath('logger_config.json')
     self.config_path = Path(config_path)
     self.logger = None
     self.logger_name = logger_name
+    self.loki_url = os.getenv('LOKI_URL') if loki_url is None else loki_url
+    self.loki_labels = parse_labels(os.getenv('LOKI_LABELS', '')) if loki_labels is None else loki_labels
+    self.loki_handler = None
 
   def setup_logging(self):
     with open(self.config_path) as f_in:
@@ -28,6 +289,12 @@ class LoggerSetup:
     self.logger = logging.getLogger(self.logger_name)
     queue_handler = logging.getHandlerByName('queue_handler')
     if queue_handler is not None:
+      if self.loki_url:
+        self.loki_handler = LokiHandler(url=self.loki_url, labels=self.loki_labels)
+        if queue_handler.listener.handlers:
+          self.loki_handler.setFormatter(queue_handler.listener.handlers[0].formatter)
+        queue_handler.listener.handlers = queue_handler.listener.handlers + (self.loki_handler,)
+        atexit.register(self.loki_handler.close)
       queue_handler.listener.start()
       atexit.register(queue_handler.listener.stop)
 
@@ -35,3 +302,11 @@ class LoggerSetup:
     if self.logger is None:
       self.setup_logging()
     return self.logger
+
+  def get_sampled_logger(self, every: int = 100) -> SampledLogger:
+    ''' Logger for hot paths which emits the first and then every nth record of a call site. '''
+    return SampledLogger(self.get_logger(), every=every)
+
+  def get_rate_limited_logger(self, per_second: float = 1, burst: int = 1) -> RateLimitedLogger:
+    ''' Logger for hot paths which emits at most per_second records of a call site per second. '''
+    return RateLimitedLogger(self.get_logger(), per_second=per_second, burst=burst)
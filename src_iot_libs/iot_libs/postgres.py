@@ -1,58 +1,254 @@
 import logging
+import numpy as np
+import os
 import pandas as pd
 import threading
+import time
+import psycopg
 import traceback
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 from sqlalchemy import create_engine
-from sqlalchemy.engine import Engine, CursorResult, URL
+from sqlalchemy.engine import Connection, Engine, CursorResult, URL
+from sqlalchemy.exc import DisconnectionError, IntegrityError, InterfaceError, OperationalError
 from sqlalchemy.orm import scoped_session, sessionmaker, Session
 from sqlalchemy.sql import text
-from typing import Callable
+from typing import Callable, Iterable, Iterator, Sequence
 
 logger = logging.getLogger(__name__)
 
 
 class EngineManager:
-  ''' Thread safe engine manager. '''
-  engines = {}
+  ''' Thread safe manager of one engine per database.
+
+      With a database per tenant every engine keeps its own connection pool, so the engines are kept in LRU order
+      within a budget of connections. An engine can open at most pool_size + max_overflow connections, engines are
+      only created while their connections fit into max_connections. Otherwise the least recently used engines without
+      checked out connections are disposed first, as are engines which have not been used for idle_seconds. Engines
+      handed out with acquire are leased until they are released and never disposed in between.
+  '''
+  engines: OrderedDict[str, Engine] = OrderedDict()
+  last_used: dict[str, float] = {}
+  leases: dict[str, int] = {}
+  lock = threading.RLock()
+  pool_size = 5
+  max_overflow = 10
+  pool_recycle = -1
+  pool_timeout = 30
+  max_connections: int = None
+  idle_seconds: float = None
+  last_eviction = 0.0
+
+  @classmethod
+  def configure(cls,
+                pool_size: int = None,
+                max_overflow: int = None,
+                pool_recycle: int = None,
+                pool_timeout: float = None,
+                max_connections: int = None,
+                idle_seconds: float = None):
+    ''' Set the pool options of engines created from now on, options which are None are kept.
+
+        Parameters
+        ----------
+        pool_size:        Connections kept open per database.
+        max_overflow:     Additional connections per database under load, closed once they are returned.
+        pool_recycle:     Seconds after which a connection is replaced, -1 keeps connections forever.
+        pool_timeout:     Seconds to wait for a connection of an exhausted pool.
+        max_connections:  Maximum number of connections of all engines, 0 for no limit.
+        idle_seconds:     Seconds after which an unused engine is disposed, 0 to keep engines.
+    '''
+    with cls.lock:
+      for name, value in (('pool_size', pool_size), ('max_overflow', max_overflow), ('pool_recycle', pool_recycle),
+                          ('pool_timeout', pool_timeout), ('max_connections', max_connections),
+                          ('idle_seconds', idle_seconds)):
+        if value is not None:
+          setattr(cls, name, value)
 
   @classmethod
   def get_engine(cls, db_name: str, url: URL) -> Engine:
-    if db_name not in cls.engines:
-      cls.engines[db_name] = create_engine(url, pool_pre_ping=True)
-    return cls.engines[db_name]
+    with cls.lock:
+      now = time.monotonic()
+      cls.last_used[db_name] = now
+      engine = cls.engines.get(db_name)
+      if engine is not None:
+        cls.engines.move_to_end(db_name)
+      if cls.idle_seconds and now - cls.last_eviction >= min(cls.idle_seconds, 60):
+        cls.last_eviction = now
+        cls.evict_idle(now=now)
+      if engine is not None:
+        return engine
+      cls._make_room()
+      engine = cls.engines[db_name] = cls._create_engine(url)
+      return engine
+
+  @classmethod
+  def acquire(cls, db_name: str, url: URL) -> Engine:
+    ''' Get the engine of a database and lease it, so that it is not evicted before it is released. '''
+    with cls.lock:
+      engine = cls.get_engine(db_name, url)
+      cls.leases[db_name] = cls.leases.get(db_name, 0) + 1
+      return engine
+
+  @classmethod
+  def release(cls, db_name: str):
+    ''' Return the lease of an engine taken with acquire. '''
+    with cls.lock:
+      leases = cls.leases.get(db_name, 0) - 1
+      if leases > 0:
+        cls.leases[db_name] = leases
+      else:
+        cls.leases.pop(db_name, None)
+
+  @classmethod
+  def evict_idle(cls, now: float = None) -> list[str]:
+    ''' Dispose the engines which have not been used for idle_seconds and return their database names. '''
+    if not cls.idle_seconds:
+      return []
+    now = time.monotonic() if now is None else now
+    with cls.lock:
+      idle = [
+          db_name for db_name in cls.engines
+          if now - cls.last_used.get(db_name, now) >= cls.idle_seconds and cls._is_idle(db_name)
+      ]
+      for db_name in idle:
+        cls._dispose(db_name)
+    return idle
+
+  @classmethod
+  def dispose_all(cls):
+    with cls.lock:
+      for db_name in list(cls.engines):
+        cls._dispose(db_name)
+
+  @classmethod
+  def _make_room(cls):
+    ''' Dispose least recently used idle engines until the connections of another engine fit into the budget. '''
+    if not cls.max_connections:
+      return
+    per_engine = cls.pool_size + cls.max_overflow
+    for db_name in list(cls.engines):
+      if (len(cls.engines) + 1) * per_engine <= cls.max_connections:
+        return
+      if cls._is_idle(db_name):
+        cls._dispose(db_name)
+    if (len(cls.engines) + 1) * per_engine > cls.max_connections:
+      logger.warning(f'Connection budget of {cls.max_connections} exceeded by {len(cls.engines) + 1} engines, '
+                     'all of them are in use.')
+
+  @classmethod
+  def _create_engine(cls, url: URL) -> Engine:
+    return create_engine(url,
+                         pool_pre_ping=True,
+                         pool_size=cls.pool_size,
+                         max_overflow=cls.max_overflow,
+                         pool_recycle=cls.pool_recycle,
+                         pool_timeout=cls.pool_timeout)
+
+  @classmethod
+  def _is_idle(cls, db_name: str) -> bool:
+    if cls.leases.get(db_name):
+      return False
+    pool = cls.engines[db_name].pool
+    return not hasattr(pool, 'checkedout') or pool.checkedout() == 0
+
+  @classmethod
+  def _dispose(cls, db_name: str):
+    engine = cls.engines.pop(db_name)
+    cls.last_used.pop(db_name, None)
+    cls._dispose_engine(engine)
+    logger.info(f'Disposed engine of database {db_name}')
+
+  @classmethod
+  def _dispose_engine(cls, engine: Engine):
+    engine.dispose()
+
+
+POOL_OPTIONS = {
+    'pool_size': ('DB_POOL_SIZE', int),
+    'max_overflow': ('DB_MAX_OVERFLOW', int),
+    'pool_recycle': ('DB_POOL_RECYCLE_SECONDS', int),
+    'pool_timeout': ('DB_POOL_TIMEOUT_SECONDS', float),
+    'max_connections': ('DB_MAX_CONNECTIONS', int),
+    'idle_seconds': ('DB_ENGINE_IDLE_SECONDS', float)
+}
+
+
+def pool_options_from_env() -> dict:
+  ''' Read the connection pool options from the environment, e.g. DB_POOL_SIZE, unset options are omitted. '''
+  return {option: cast(os.environ[name]) for option, (name, cast) in POOL_OPTIONS.items() if os.getenv(name)}
 
 
 class PostgresManager:
-  ''' Thread safe posgresql database connection manager. '''
+  ''' Thread safe posgresql database connection manager.
 
-  def __init__(self, username: str, password: str, host: str, port: int | str = 5432):
+      The session factory of a database is created once and shared by all threads, scoped_session keeps one session
+      per thread. Using the manager as context manager, e.g. with db_manager('tenant_100000') as conn, gives the session
+      of the thread, connection gives a plain connection without ORM session.
+  '''
+
+  def __init__(self, username: str, password: str, host: str, port: int | str = 5432, **pool_options):
     ''' Parameters
         ----------
-        username:  Name of the user to connect to the database.
-        password:  Password of the user to connect to the database.
-        host:      Hostname of the database server.
-        port:      Port of the database server.
+        username:      Name of the user to connect to the database.
+        password:      Password of the user to connect to the database.
+        host:          Hostname of the database server.
+        port:          Port of the database server.
+        pool_options:  Options of the connection pools, see EngineManager.configure.
     '''
     self.username = username
     self.password = password
     self.host = host
     self.local_data = threading.local()  # Thread-local storage
     self.port = int(port)
+    self.sessions: dict[str, scoped_session] = {}
+    self.lock = threading.Lock()
+    if pool_options:
+      EngineManager.configure(**pool_options)
+
+  def url(self, db_name: str) -> URL:
+    return URL.create('postgresql+psycopg',
+                      username=self.username,
+                      password=self.password,
+                      host=self.host,
+                      database=db_name,
+                      port=self.port)
+
+  def engine(self, db_name: str) -> Engine:
+    return EngineManager.get_engine(db_name, self.url(db_name))
+
+  def session_factory(self, db_name: str) -> scoped_session:
+    ''' The cached session factory of a database, it is created again if the engine has been evicted. '''
+    engine = self.engine(db_name)
+    with self.lock:
+      Session = self.sessions.get(db_name)
+      if Session is None or Session.session_factory.kw['bind'] is not engine:
+        Session = self.sessions[db_name] = scoped_session(sessionmaker(bind=engine))
+        for name in [name for name in self.sessions if name not in EngineManager.engines]:
+          del self.sessions[name]
+    return Session
 
   def __call__(self, db_name: str):
-    if not hasattr(self.local_data, 'Session') or self.local_data.db_name != db_name:
-      url = URL.create('postgresql+psycopg',
-                       username=self.username,
-                       password=self.password,
-                       host=self.host,
-                       database=db_name,
-                       port=self.port)
-      engine = EngineManager.get_engine(db_name, url)
-      self.local_data.session_factory = sessionmaker(bind=engine)
-      self.local_data.Session = scoped_session(self.local_data.session_factory)
-      self.local_data.db_name = db_name
+    ''' Select the database of the session of the thread, its engine is leased until the session is removed. '''
+    self._release_lease()
+    EngineManager.acquire(db_name, self.url(db_name))
+    self.local_data.lease = db_name
+    self.local_data.Session = self.session_factory(db_name)
+    self.local_data.db_name = db_name
     return self
 
+  @contextmanager
+  def connection(self, db_name: str) -> Iterator[Connection]:
+    ''' Connection of the pool of a database for statements which do not need an ORM session. Every execute_query
+        runs in its own transaction, unless the caller begins one.
+    '''
+    engine = EngineManager.acquire(db_name, self.url(db_name))
+    try:
+      with engine.connect() as conn:
+        yield conn
+    finally:
+      EngineManager.release(db_name)
+
   def get_session(self) -> Session:
     if not hasattr(self.local_data, 'Session'):
       raise ValueError('Database name not set. Use the object as a callable with dbname first.')
@@ -62,6 +258,13 @@ class PostgresManager:
     if hasattr(self.local_data, 'Session'):
       self.local_data.Session.remove()
       del self.local_data.Session
+    self._release_lease()
+
+  def _release_lease(self):
+    db_name = getattr(self.local_data, 'lease', None)
+    if db_name is not None:
+      del self.local_data.lease
+      EngineManager.release(db_name)
 
   def __enter__(self) -> Session:
     return self.get_session()
@@ -77,14 +280,49 @@ class PostgresManager:
 
 
 def dict_row(result: CursorResult, row: list):
+  if hasattr(row, '_asdict'):
+    return row._asdict()
   return {col: val for col, val in zip(result.keys(), row)}
 
 
+def column_arrays(keys: Sequence[str], rows: Sequence[Sequence]) -> dict[str, np.ndarray]:
+  ''' Transpose rows into one numpy array per column. '''
+  if not rows:
+    return {key: np.array([]) for key in keys}
+  return {key: np.array(column) for key, column in zip(keys, zip(*rows))}
+
+
 class PostgreException(Exception):
   pass
 
 
-def execute_query(conn: Engine | Session, query: str, params: dict | list[dict] = None) -> CursorResult:
+def is_connection_error(exc: BaseException) -> bool:
+  ''' Check if an exception or one of its causes signals an unavailable database rather than an invalid query. '''
+  seen = set()
+  while exc is not None and id(exc) not in seen:
+    if isinstance(exc, (OperationalError, InterfaceError, DisconnectionError)):
+      return True
+    if getattr(exc, 'connection_invalidated', False):
+      return True
+    seen.add(id(exc))
+    exc = exc.__cause__ or exc.__context__
+  return False
+
+
+def is_integrity_error(exc: BaseException) -> bool:
+  ''' Check if an exception or one of its causes is a constraint violation, raised by SQLAlchemy or by psycopg directly
+      as for COPY on the raw driver cursor.
+  '''
+  seen = set()
+  while exc is not None and id(exc) not in seen:
+    if isinstance(exc, (IntegrityError, psycopg.errors.IntegrityError)):
+      return True
+    seen.add(id(exc))
+    exc = exc.__cause__ or exc.__context__
+  return False
+
+
+def execute_query(conn: Engine | Session | Connection, query: str, params: dict | list[dict] = None) -> CursorResult:
   if isinstance(conn, Engine) and conn.pool.status == 'closed':
     logger.error('Connection is closed.')
     raise PostgreException('Connection is closed.')
@@ -96,15 +334,18 @@ def execute_query(conn: Engine | Session, query: str, params: dict | list[dict]
     elif isinstance(conn, Session):
       with conn.begin():
         result = conn.execute(text(query), params or {})
+    elif isinstance(conn, Connection):
+      with nullcontext() if conn.in_transaction() else conn.begin():
+        result = conn.execute(text(query), params or {})
     else:
       raise ValueError('Invalid connection type.')
   except Exception as exc:
     logger.error(f'Failed to execute query: "{query}" with params: {params}. Error: {exc}')
-    raise PostgreException(f'Failed to execute query: {traceback.format_exc()}')
+    raise PostgreException(f'Failed to execute query: {traceback.format_exc()}') from exc
   return result
 
 
-def execute_select_query(conn: Engine | Session,
+def execute_select_query(conn: Engine | Session | Connection,
                          query: str,
                          params: dict = None,
                          row_factory: None | Callable = None) -> list | pd.DataFrame:
@@ -114,3 +355,94 @@ def execute_select_query(conn: Engine | Session,
     return [row_factory(result=result, row=row) for row in data]
   columns = result.keys()
   return pd.DataFrame(data, columns=columns)
+
+
+@contextmanager
+def _streaming_connection(conn: Engine | Session | Connection) -> Iterator[Connection]:
+  if isinstance(conn, Engine):
+    with conn.connect() as connection:
+      yield connection
+  elif isinstance(conn, Session):
+    yield conn.connection()
+  elif isinstance(conn, Connection):
+    yield conn
+  else:
+    raise ValueError('Invalid connection type.')
+
+
+def stream_select_query(conn: Engine | Session | Connection,
+                        query: str,
+                        params: dict = None,
+                        chunk_size: int = 10000,
+                        as_arrays: bool = False) -> Iterator[pd.DataFrame | dict[str, np.ndarray]]:
+  ''' Execute a select query with a server side cursor and yield the result in chunks, so that only one chunk is held
+      in memory. The connection is used until the iterator is exhausted or closed.
+
+      Parameters
+      ----------
+      conn:        The database connection.
+      query:       The select query.
+      params:      The query parameters.
+      chunk_size:  The number of rows per chunk.
+      as_arrays:   Yield the chunks as numpy arrays per column instead of DataFrames.
+  '''
+  try:
+    with _streaming_connection(conn) as connection:
+      with nullcontext() if connection.in_transaction() else connection.begin():
+        result = connection.execution_options(stream_results=True, max_row_buffer=chunk_size).execute(
+            text(query), params or {})
+        keys = list(result.keys())
+        for rows in result.partitions(chunk_size):
+          yield column_arrays(keys, rows) if as_arrays else pd.DataFrame.from_records(rows, columns=keys)
+  except Exception as exc:
+    logger.error(f'Failed to stream query: "{query}" with params: {params}. Error: {exc}')
+    raise PostgreException(f'Failed to stream query: {traceback.format_exc()}') from exc
+
+
+def _copy_rows(connection: Connection, statement: str, rows: Iterable[Sequence], types: list[str] = None) -> int:
+  driver_connection = connection.connection.driver_connection
+  row_count = 0
+  with driver_connection.cursor() as cursor:
+    with cursor.copy(statement) as copy:
+      if types:
+        copy.set_types(types)
+      for row in rows:
+        copy.write_row(row)
+        row_count += 1
+  return row_count
+
+
+def execute_copy(conn: Engine | Session | Connection,
+                 table: str,
+                 columns: list[str],
+                 rows: Iterable[Sequence],
+                 types: list[str] = None) -> int:
+  ''' Bulk load rows into a table with COPY FROM STDIN and return the number of written rows.
+
+      Parameters
+      ----------
+      conn:     The database connection.
+      table:    The table to load the rows into.
+      columns:  The column names in the order of the row values.
+      rows:     The rows to load.
+      types:    The postgres type names of the columns. If given the binary COPY format is used.
+  '''
+  statement = f'copy {table} ({", ".join(columns)}) from stdin'
+  if types:
+    statement += ' (format binary)'
+  try:
+    if isinstance(conn, Engine):
+      with conn.connect() as connection:
+        with connection.begin():
+          return _copy_rows(connection=connection, statement=statement, rows=rows, types=types)
+    elif isinstance(conn, Session):
+      with conn.begin():
+        return _copy_rows(connection=conn.connection(), statement=statement, rows=rows, types=types)
+    elif isinstance(conn, Connection):
+      with nullcontext() if conn.in_transaction() else conn.begin():
+        return _copy_rows(connection=conn, statement=statement, rows=rows, types=types)
+    else:
+      raise ValueError('Invalid connection type.')
+  except Exception as exc:
+    logger.error(f'Failed to execute copy: "{statement}". Error: {exc}')
+    raise PostgreException(f'Failed to execute copy: {traceback.format_exc()}') from exc
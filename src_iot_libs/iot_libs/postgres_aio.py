@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import numpy as np
+import pandas as pd
+import threading
+import traceback
+from collections import OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from sqlalchemy.engine import CursorResult, URL
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, create_async_engine
+from sqlalchemy.sql import text
+from typing import AsyncIterator, Callable
+# local
+from iot_libs.postgres import EngineManager, PostgreException, column_arrays
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncEngineManager(EngineManager):
+  ''' Manager of one async engine per database, with the same LRU order and connection budget as EngineManager.
+
+      A request waiting for a connection of an exhausted pool suspends its coroutine instead of blocking a thread, so
+      the number of concurrent queries is bounded by the pools rather than by the threads of the server.
+  '''
+  engines: OrderedDict[str, AsyncEngine] = OrderedDict()
+  last_used: dict[str, float] = {}
+  leases: dict[str, int] = {}
+  lock = threading.RLock()
+  last_eviction = 0.0
+  disposals: set[asyncio.Task] = set()
+
+  @classmethod
+  def _create_engine(cls, url: URL) -> AsyncEngine:
+    return create_async_engine(url,
+                               pool_pre_ping=True,
+                               pool_size=cls.pool_size,
+                               max_overflow=cls.max_overflow,
+                               pool_recycle=cls.pool_recycle,
+                               pool_timeout=cls.pool_timeout)
+
+  @classmethod
+  def _dispose_engine(cls, engine: AsyncEngine):
+    ''' Close the connections of an evicted engine on the running event loop. '''
+    try:
+      loop = asyncio.get_running_loop()
+    except RuntimeError:
+      asyncio.run(engine.dispose())
+      return
+    task = loop.create_task(engine.dispose())
+    cls.disposals.add(task)
+    task.add_done_callback(cls.disposals.discard)
+
+  @classmethod
+  async def dispose_all_async(cls):
+    ''' Dispose all engines and wait until their connections are closed. '''
+    with cls.lock:
+      engines = list(cls.engines.values())
+      cls.engines.clear()
+      cls.last_used.clear()
+    await asyncio.gather(*(engine.dispose() for engine in engines), *cls.disposals)
+
+
+class AsyncPostgresManager:
+  ''' Asyncio posgresql database connection manager.
+
+      Using the manager as async context manager, e.g. async with db_manager('tenant_100000') as conn, gives a
+      connection of the pool of the database. Every execute_query runs in its own transaction, unless the caller begins
+      one.
+  '''
+
+  def __init__(self, username: str, password: str, host: str, port: int | str = 5432, **pool_options):
+    ''' Parameters
+        ----------
+        username:      Name of the user to connect to the database.
+        password:      Password of the user to connect to the database.
+        host:          Hostname of the database server.
+        port:          Port of the database server.
+        pool_options:  Options of the connection pools, see EngineManager.configure.
+    '''
+    self.username = username
+    self.password = password
+    self.host = host
+    self.port = int(port)
+    if pool_options:
+      AsyncEngineManager.configure(**pool_options)
+
+  def url(self, db_name: str) -> URL:
+    return URL.create('postgresql+psycopg',
+                      username=self.username,
+                      password=self.password,
+                      host=self.host,
+                      database=db_name,
+                      port=self.port)
+
+  def engine(self, db_name: str) -> AsyncEngine:
+    return AsyncEngineManager.get_engine(db_name, self.url(db_name))
+
+  @asynccontextmanager
+  async def connection(self, db_name: str) -> AsyncIterator[AsyncConnection]:
+    ''' Connection of the pool of a database, the engine is leased until the connection is returned. '''
+    engine = AsyncEngineManager.acquire(db_name, self.url(db_name))
+    try:
+      async with engine.connect() as conn:
+        yield conn
+    finally:
+      AsyncEngineManager.release(db_name)
+
+  def __call__(self, db_name: str):
+    return self.connection(db_name)
+
+  async def dispose(self):
+    await AsyncEngineManager.dispose_all_async()
+
+  def __repr__(self) -> str:
+    return self.__str__()
+
+  def __str__(self) -> str:
+    return f'AsyncPostgresManager(username={self.username}, password=***, host={self.host})'
+
+
+async def execute_query(conn: AsyncEngine | AsyncConnection,
+                        query: str,
+                        params: dict | list[dict] = None) -> CursorResult:
+  ''' Execute a query and return its buffered result, the async counterpart of iot_libs.postgres.execute_query. '''
+  try:
+    if isinstance(conn, AsyncEngine):
+      async with conn.connect() as connection:
+        async with connection.begin():
+          result = await connection.execute(text(query), params or {})
+    elif isinstance(conn, AsyncConnection):
+      async with nullcontext() if conn.in_transaction() else conn.begin():
+        result = await conn.execute(text(query), params or {})
+    else:
+      raise ValueError('Invalid connection type.')
+  except Exception as exc:
+    logger.error(f'Failed to execute query: "{query}" with params: {params}. Error: {exc}')
+    raise PostgreException(f'Failed to execute query: {traceback.format_exc()}') from exc
+  return result
+
+
+async def execute_select_query(conn: AsyncEngine | AsyncConnection,
+                               query: str,
+                               params: dict = None,
+                               row_factory: None | Callable = None) -> list | pd.DataFrame:
+  result = await execute_query(conn=conn, query=query, params=params)
+  data = result.fetchall()
+  if row_factory:
+    return [row_factory(result=result, row=row) for row in data]
+  columns = result.keys()
+  return pd.DataFrame(data, columns=columns)
+
+
+@asynccontextmanager
+async def _streaming_connection(conn: AsyncEngine | AsyncConnection) -> AsyncIterator[AsyncConnection]:
+  if isinstance(conn, AsyncEngine):
+    async with conn.connect() as connection:
+      yield connection
+  elif isinstance(conn, AsyncConnection):
+    yield conn
+  else:
+    raise ValueError('Invalid connection type.')
+
+
+async def stream_select_query(conn: AsyncEngine | AsyncConnection,
+                              query: str,
+                              params: dict = None,
+                              chunk_size: int = 10000,
+                              as_arrays: bool = False) -> AsyncIterator[pd.DataFrame | dict[str, np.ndarray]]:
+  ''' Execute a select query with a server side cursor and yield the result in chunks, see
+      iot_libs.postgres.stream_select_query.
+
+      Parameters
+      ----------
+      conn:        The database connection.
+      query:       The select query.
+      params:      The query parameters.
+      chunk_size:  The number of rows per chunk.
+      as_arrays:   Yield the chunks as numpy arrays per column instead of DataFrames.
+  '''
+  try:
+    async with _streaming_connection(conn) as connection:
+      async with nullcontext() if connection.in_transaction() else connection.begin():
+        result = await connection.stream(text(query),
+                                         params or {},
+                                         execution_options={'max_row_buffer': chunk_size})
+        keys = list(result.keys())
+        async for rows in result.partitions(chunk_size):
+          yield column_arrays(keys, rows) if as_arrays else pd.DataFrame.from_records(rows, columns=keys)
+  except Exception as exc:
+    logger.error(f'Failed to stream query: "{query}" with params: {params}. Error: {exc}')
+    raise PostgreException(f'Failed to stream query: {traceback.format_exc()}') from exc
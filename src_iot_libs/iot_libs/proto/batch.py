@@ -0,0 +1,75 @@
+import numpy as np
+from google.protobuf.timestamp_pb2 import Timestamp
+from iot_libs.proto.hub_pb2 import MetricDescriptor, NumericArrayWindow, NumericScalarBatch, NumericScalarValues
+
+DescriptorKey = tuple[str, str, str, str]
+# trailing metadata with the number of batches of a stream the hub accepted before it rejected one
+ACCEPTED_BATCHES_KEY = 'accepted-batches'
+
+
+def timestamp_us(timestamp: Timestamp) -> int:
+  ''' Microseconds since the unix epoch of a protobuf timestamp. '''
+  return timestamp.seconds * 1000000 + timestamp.nanos // 1000
+
+
+def descriptor_key(descriptor: MetricDescriptor) -> DescriptorKey:
+  return (descriptor.metric_identifier, descriptor.path, descriptor.unit, descriptor.display_name)
+
+
+def pack_numeric_scalar_values(samples: list[NumericScalarValues]) -> list[NumericScalarBatch]:
+  ''' Pack samples into one batch per tenant and device, the metric descriptors are sent once per batch. '''
+  batches: dict[tuple[str, str], NumericScalarBatch] = {}
+  indices: dict[tuple[str, str], dict[DescriptorKey, int]] = {}
+  for sample in samples:
+    key = (sample.tenant_identifier, sample.device_identifier)
+    batch = batches.get(key)
+    if batch is None:
+      batch = batches[key] = NumericScalarBatch(tenant_identifier=sample.tenant_identifier,
+                                                device_identifier=sample.device_identifier)
+      indices[key] = {}
+    descriptor = (sample.metric_identifier, sample.path, sample.unit, sample.display_name)
+    index = indices[key].get(descriptor)
+    if index is None:
+      index = indices[key][descriptor] = len(batch.metrics)
+      batch.metrics.add(metric_identifier=sample.metric_identifier,
+                        path=sample.path,
+                        unit=sample.unit,
+                        display_name=sample.display_name)
+    batch.metric_index.append(index)
+    batch.values.append(sample.value)
+    batch.timestamps_us.append(timestamp_us(sample.timestamp))
+  return list(batches.values())
+
+
+def validate_batch(batch: NumericScalarBatch):
+  ''' Check that the columns of a batch have the same length and all metric indices exist. '''
+  if not len(batch.metric_index) == len(batch.values) == len(batch.timestamps_us):
+    raise ValueError(f'Columns of batch of device {batch.device_identifier} differ in length: '
+                     f'{len(batch.metric_index)} metric indices, {len(batch.values)} values, '
+                     f'{len(batch.timestamps_us)} timestamps.')
+  if batch.metric_index and max(batch.metric_index) >= len(batch.metrics):
+    raise ValueError(f'Batch of device {batch.device_identifier} references an unknown metric index.')
+
+
+def pack_samples(samples: np.ndarray | list[float]) -> bytes:
+  ''' Pack the samples of a window as little-endian float32 values. '''
+  return np.asarray(samples, dtype='<f4').tobytes()
+
+
+def unpack_samples(samples: bytes) -> np.ndarray:
+  return np.frombuffer(samples, dtype='<f4')
+
+
+def window_sample_count(window: NumericArrayWindow) -> int:
+  return len(window.samples) // 4
+
+
+def validate_window(window: NumericArrayWindow):
+  ''' Check that a window has a positive sample rate and holds a whole number of float32 samples. '''
+  if not window.metric.metric_identifier:
+    raise ValueError(f'Window of device {window.device_identifier} has no metric identifier.')
+  if not window.sample_rate > 0:
+    raise ValueError(f'Window of device {window.device_identifier} has the sample rate {window.sample_rate}.')
+  if not window.samples or len(window.samples) % 4:
+    raise ValueError(f'Window of device {window.device_identifier} holds {len(window.samples)} bytes, which is no '
+                     f'positive number of float32 samples.')
@@ -4,6 +4,9 @@ from enum import Enum
 class StubMethod(Enum):
   SEND_NUMERIC_SCALAR_VALUES = ('SendNumericScalarValues', 'stream')
   SEND_DEVICE_STATUS = ('SendDeviceStatus', 'unary')
+  SEND_NUMERIC_SCALAR_BATCH = ('SendNumericScalarBatch', 'stream')
+  STREAM_NUMERIC_SCALAR_BATCHES = ('StreamNumericScalarBatches', 'bidi')
+  SEND_NUMERIC_ARRAY_WINDOWS = ('SendNumericArrayWindows', 'stream')
 
 
 class DeviceHealthStatus(Enum):
@@ -1,9 +1,10 @@
 from google.protobuf import timestamp_pb2 as _timestamp_pb2
 from google.protobuf import empty_pb2 as _empty_pb2
+from google.protobuf.internal import containers as _containers
 from google.protobuf.internal import enum_type_wrapper as _enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Mapping as _Mapping, Optional as _Optional, Union as _Union
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
@@ -48,6 +49,92 @@ class NumericScalarValues(_message.Message):
     timestamp: _timestamp_pb2.Timestamp
     def __init__(self, tenant_identifier: _Optional[str] = ..., device_identifier: _Optional[str] = ..., metric_identifier: _Optional[str] = ..., path: _Optional[str] = ..., value: _Optional[float] = ..., unit: _Optional[str] = ..., display_name: _Optional[str] = ..., timestamp: _Optional[_Union[_timestamp_pb2.Timestamp, _Mapping]] = ...) -> None: ...
 
+class MetricDescriptor(_message.Message):
+    __slots__ = ("metric_identifier", "path", "unit", "display_name")
+    METRIC_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    PATH_FIELD_NUMBER: _ClassVar[int]
+    UNIT_FIELD_NUMBER: _ClassVar[int]
+    DISPLAY_NAME_FIELD_NUMBER: _ClassVar[int]
+    metric_identifier: str
+    path: str
+    unit: str
+    display_name: str
+    def __init__(self, metric_identifier: _Optional[str] = ..., path: _Optional[str] = ..., unit: _Optional[str] = ..., display_name: _Optional[str] = ...) -> None: ...
+
+class NumericScalarBatch(_message.Message):
+    __slots__ = ("tenant_identifier", "device_identifier", "metrics", "metric_index", "values", "timestamps_us", "session_id")
+    TENANT_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    DEVICE_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    METRICS_FIELD_NUMBER: _ClassVar[int]
+    METRIC_INDEX_FIELD_NUMBER: _ClassVar[int]
+    VALUES_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMPS_US_FIELD_NUMBER: _ClassVar[int]
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    tenant_identifier: str
+    device_identifier: str
+    metrics: _containers.RepeatedCompositeFieldContainer[MetricDescriptor]
+    metric_index: _containers.RepeatedScalarFieldContainer[int]
+    values: _containers.RepeatedScalarFieldContainer[float]
+    timestamps_us: _containers.RepeatedScalarFieldContainer[int]
+    session_id: str
+    def __init__(self, tenant_identifier: _Optional[str] = ..., device_identifier: _Optional[str] = ..., metrics: _Optional[_Iterable[_Union[MetricDescriptor, _Mapping]]] = ..., metric_index: _Optional[_Iterable[int]] = ..., values: _Optional[_Iterable[float]] = ..., timestamps_us: _Optional[_Iterable[int]] = ..., session_id: _Optional[str] = ...) -> None: ...
+
+class MetricRegistration(_message.Message):
+    __slots__ = ("tenant_identifier", "device_identifier", "metrics", "session_id")
+    TENANT_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    DEVICE_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    METRICS_FIELD_NUMBER: _ClassVar[int]
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    tenant_identifier: str
+    device_identifier: str
+    metrics: _containers.RepeatedCompositeFieldContainer[MetricDescriptor]
+    session_id: str
+    def __init__(self, tenant_identifier: _Optional[str] = ..., device_identifier: _Optional[str] = ..., metrics: _Optional[_Iterable[_Union[MetricDescriptor, _Mapping]]] = ..., session_id: _Optional[str] = ...) -> None: ...
+
+class MetricHandles(_message.Message):
+    __slots__ = ("session_id", "handles")
+    SESSION_ID_FIELD_NUMBER: _ClassVar[int]
+    HANDLES_FIELD_NUMBER: _ClassVar[int]
+    session_id: str
+    handles: _containers.RepeatedScalarFieldContainer[int]
+    def __init__(self, session_id: _Optional[str] = ..., handles: _Optional[_Iterable[int]] = ...) -> None: ...
+
+class NumericArrayWindow(_message.Message):
+    __slots__ = ("tenant_identifier", "device_identifier", "metric", "start_us", "sample_rate", "samples")
+    TENANT_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    DEVICE_IDENTIFIER_FIELD_NUMBER: _ClassVar[int]
+    METRIC_FIELD_NUMBER: _ClassVar[int]
+    START_US_FIELD_NUMBER: _ClassVar[int]
+    SAMPLE_RATE_FIELD_NUMBER: _ClassVar[int]
+    SAMPLES_FIELD_NUMBER: _ClassVar[int]
+    tenant_identifier: str
+    device_identifier: str
+    metric: MetricDescriptor
+    start_us: int
+    sample_rate: float
+    samples: bytes
+    def __init__(self, tenant_identifier: _Optional[str] = ..., device_identifier: _Optional[str] = ..., metric: _Optional[_Union[MetricDescriptor, _Mapping]] = ..., start_us: _Optional[int] = ..., sample_rate: _Optional[float] = ..., samples: _Optional[bytes] = ...) -> None: ...
+
+class IngestRequest(_message.Message):
+    __slots__ = ("sequence", "batch")
+    SEQUENCE_FIELD_NUMBER: _ClassVar[int]
+    BATCH_FIELD_NUMBER: _ClassVar[int]
+    sequence: int
+    batch: NumericScalarBatch
+    def __init__(self, sequence: _Optional[int] = ..., batch: _Optional[_Union[NumericScalarBatch, _Mapping]] = ...) -> None: ...
+
+class IngestAck(_message.Message):
+    __slots__ = ("sequence", "status", "credits", "message")
+    SEQUENCE_FIELD_NUMBER: _ClassVar[int]
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    CREDITS_FIELD_NUMBER: _ClassVar[int]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    sequence: int
+    status: Status
+    credits: int
+    message: str
+    def __init__(self, sequence: _Optional[int] = ..., status: _Optional[_Union[Status, str]] = ..., credits: _Optional[int] = ..., message: _Optional[str] = ...) -> None: ...
+
 class Response(_message.Message):
     __slots__ = ("status", "message")
     STATUS_FIELD_NUMBER: _ClassVar[int]
@@ -42,6 +42,24 @@ class HubStub(object):
         request_serializer=hub__pb2.DeviceStatus.SerializeToString,
         response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
         _registered_method=True)
+    self.SendNumericScalarBatch = channel.stream_unary(
+        '/Hub/SendNumericScalarBatch',
+        request_serializer=hub__pb2.NumericScalarBatch.SerializeToString,
+        response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+        _registered_method=True)
+    self.RegisterMetrics = channel.unary_unary('/Hub/RegisterMetrics',
+                                               request_serializer=hub__pb2.MetricRegistration.SerializeToString,
+                                               response_deserializer=hub__pb2.MetricHandles.FromString,
+                                               _registered_method=True)
+    self.StreamNumericScalarBatches = channel.stream_stream('/Hub/StreamNumericScalarBatches',
+                                                            request_serializer=hub__pb2.IngestRequest.SerializeToString,
+                                                            response_deserializer=hub__pb2.IngestAck.FromString,
+                                                            _registered_method=True)
+    self.SendNumericArrayWindows = channel.stream_unary(
+        '/Hub/SendNumericArrayWindows',
+        request_serializer=hub__pb2.NumericArrayWindow.SerializeToString,
+        response_deserializer=google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+        _registered_method=True)
 
 
 class HubServicer(object):
@@ -59,6 +77,30 @@ class HubServicer(object):
     context.set_details('Method not implemented!')
     raise NotImplementedError('Method not implemented!')
 
+  def SendNumericScalarBatch(self, request_iterator, context):
+    """Missing associated documentation comment in .proto file."""
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def RegisterMetrics(self, request, context):
+    """Missing associated documentation comment in .proto file."""
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def StreamNumericScalarBatches(self, request_iterator, context):
+    """Missing associated documentation comment in .proto file."""
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
+  def SendNumericArrayWindows(self, request_iterator, context):
+    """Missing associated documentation comment in .proto file."""
+    context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+    context.set_details('Method not implemented!')
+    raise NotImplementedError('Method not implemented!')
+
 
 def add_HubServicer_to_server(servicer, server):
   rpc_method_handlers = {
@@ -74,6 +116,30 @@ def add_HubServicer_to_server(servicer, server):
               request_deserializer=hub__pb2.DeviceStatus.FromString,
               response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
           ),
+      'SendNumericScalarBatch':
+          grpc.stream_unary_rpc_method_handler(
+              servicer.SendNumericScalarBatch,
+              request_deserializer=hub__pb2.NumericScalarBatch.FromString,
+              response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+          ),
+      'RegisterMetrics':
+          grpc.unary_unary_rpc_method_handler(
+              servicer.RegisterMetrics,
+              request_deserializer=hub__pb2.MetricRegistration.FromString,
+              response_serializer=hub__pb2.MetricHandles.SerializeToString,
+          ),
+      'StreamNumericScalarBatches':
+          grpc.stream_stream_rpc_method_handler(
+              servicer.StreamNumericScalarBatches,
+              request_deserializer=hub__pb2.IngestRequest.FromString,
+              response_serializer=hub__pb2.IngestAck.SerializeToString,
+          ),
+      'SendNumericArrayWindows':
+          grpc.stream_unary_rpc_method_handler(
+              servicer.SendNumericArrayWindows,
+              request_deserializer=hub__pb2.NumericArrayWindow.FromString,
+              response_serializer=google_dot_protobuf_dot_empty__pb2.Empty.SerializeToString,
+          ),
   }
   generic_handler = grpc.method_handlers_generic_handler('Hub', rpc_method_handlers)
   server.add_generic_rpc_handlers((generic_handler,))
@@ -135,3 +201,107 @@ class Hub(object):
                                          timeout,
                                          metadata,
                                          _registered_method=True)
+
+  @staticmethod
+  def SendNumericScalarBatch(request_iterator,
+                             target,
+                             options=(),
+                             channel_credentials=None,
+                             call_credentials=None,
+                             insecure=False,
+                             compression=None,
+                             wait_for_ready=None,
+                             timeout=None,
+                             metadata=None):
+    return grpc.experimental.stream_unary(request_iterator,
+                                          target,
+                                          '/Hub/SendNumericScalarBatch',
+                                          hub__pb2.NumericScalarBatch.SerializeToString,
+                                          google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                                          options,
+                                          channel_credentials,
+                                          insecure,
+                                          call_credentials,
+                                          compression,
+                                          wait_for_ready,
+                                          timeout,
+                                          metadata,
+                                          _registered_method=True)
+
+  @staticmethod
+  def RegisterMetrics(request,
+                      target,
+                      options=(),
+                      channel_credentials=None,
+                      call_credentials=None,
+                      insecure=False,
+                      compression=None,
+                      wait_for_ready=None,
+                      timeout=None,
+                      metadata=None):
+    return grpc.experimental.unary_unary(request,
+                                         target,
+                                         '/Hub/RegisterMetrics',
+                                         hub__pb2.MetricRegistration.SerializeToString,
+                                         hub__pb2.MetricHandles.FromString,
+                                         options,
+                                         channel_credentials,
+                                         insecure,
+                                         call_credentials,
+                                         compression,
+                                         wait_for_ready,
+                                         timeout,
+                                         metadata,
+                                         _registered_method=True)
+
+  @staticmethod
+  def StreamNumericScalarBatches(request_iterator,
+                                 target,
+                                 options=(),
+                                 channel_credentials=None,
+                                 call_credentials=None,
+                                 insecure=False,
+                                 compression=None,
+                                 wait_for_ready=None,
+                                 timeout=None,
+                                 metadata=None):
+    return grpc.experimental.stream_stream(request_iterator,
+                                           target,
+                                           '/Hub/StreamNumericScalarBatches',
+                                           hub__pb2.IngestRequest.SerializeToString,
+                                           hub__pb2.IngestAck.FromString,
+                                           options,
+                                           channel_credentials,
+                                           insecure,
+                                           call_credentials,
+                                           compression,
+                                           wait_for_ready,
+                                           timeout,
+                                           metadata,
+                                           _registered_method=True)
+
+  @staticmethod
+  def SendNumericArrayWindows(request_iterator,
+                              target,
+                              options=(),
+                              channel_credentials=None,
+                              call_credentials=None,
+                              insecure=False,
+                              compression=None,
+                              wait_for_ready=None,
+                              timeout=None,
+                              metadata=None):
+    return grpc.experimental.stream_unary(request_iterator,
+                                          target,
+                                          '/Hub/SendNumericArrayWindows',
+                                          hub__pb2.NumericArrayWindow.SerializeToString,
+                                          google_dot_protobuf_dot_empty__pb2.Empty.FromString,
+                                          options,
+                                          channel_credentials,
+                                          insecure,
+                                          call_credentials,
+                                          compression,
+                                          wait_for_ready,
+                                          timeout,
+                                          metadata,
+                                          _registered_method=True)
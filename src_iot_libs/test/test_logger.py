@@ -0,0 +1,189 @@
+import gzip
+import json
+import logging
+import pytest
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from iot_libs.logger import Lazy, LokiHandler, RateLimitedLogger, SampledLogger
+
+
+class ListHandler(logging.Handler):
+
+  def __init__(self):
+    super().__init__()
+    self.records = []
+
+  def emit(self, record):
+    self.records.append(record)
+
+
+def make_logger(name: str) -> tuple[logging.Logger, ListHandler]:
+  logger = logging.getLogger(name)
+  logger.propagate = False
+  logger.setLevel(logging.INFO)
+  handler = ListHandler()
+  logger.handlers = [handler]
+  return logger, handler
+
+
+class Counting:
+
+  def __init__(self):
+    self.formatted = 0
+
+  def __str__(self):
+    self.formatted += 1
+    return 'value'
+
+
+def test_sampled_logger_emits_every_nth_record_per_key():
+  logger, handler = make_logger('test.sampled')
+  sampled = SampledLogger(logger, every=3)
+  for _ in range(7):
+    sampled.info('Received %s', 1)
+    sampled.info('Received %s', 2, key='other')
+  messages = [record.getMessage() for record in handler.records if record.args[0] == 1]
+  assert messages == ['Received 1', 'Received 1 (2 similar message(s) suppressed)',
+                      'Received 1 (2 similar message(s) suppressed)']
+  assert len(handler.records) == 6
+
+
+def test_rate_limited_logger_limits_records_per_second(monkeypatch):
+  now = [100.0]
+  monkeypatch.setattr('iot_libs.logger.time.monotonic', lambda: now[0])
+  logger, handler = make_logger('test.rate')
+  limited = RateLimitedLogger(logger, per_second=2, burst=2)
+  for _ in range(10):
+    limited.info('Sample')
+  now[0] += 1
+  for _ in range(10):
+    limited.info('Sample')
+  assert [record.getMessage() for record in handler.records] == [
+      'Sample', 'Sample', 'Sample (8 similar message(s) suppressed)', 'Sample'
+  ]
+
+
+@pytest.mark.parametrize('budget_logger', [
+    lambda logger: SampledLogger(logger, every=1, max_keys=10),
+    lambda logger: RateLimitedLogger(logger, per_second=1, burst=1, max_keys=10)
+])
+def test_budgets_are_bounded_by_max_keys(budget_logger):
+  logger, handler = make_logger('test.max_keys')
+  limited = budget_logger(logger)
+  for sensor in range(100):
+    limited.info('Sample', key=f'sensor.{sensor}')
+    limited.info('Sample', key=f'sensor.{sensor}')
+  budgets = limited.counts if isinstance(limited, SampledLogger) else limited.buckets
+  assert len(budgets) == 10
+  assert len(limited.suppressed) <= 10
+  assert list(budgets) == [f'sensor.{sensor}' for sensor in range(90, 100)]
+
+
+def test_dropped_records_are_not_formatted():
+  logger, handler = make_logger('test.lazy')
+  sampled = SampledLogger(logger, every=10)
+  value = Counting()
+  for _ in range(10):
+    sampled.info('Value %s', value)
+  for record in handler.records:
+    record.getMessage()
+  assert value.formatted == 1
+
+
+def test_disabled_level_is_not_counted():
+  logger, handler = make_logger('test.level')
+  sampled = SampledLogger(logger, every=2)
+  sampled.debug('Debug')
+  sampled.info('Info')
+  assert [record.getMessage() for record in handler.records] == ['Info']
+  assert not sampled.counts.get('Debug')
+
+
+def test_lazy_computes_argument_when_formatted():
+  calls = []
+  lazy = Lazy(lambda items: calls.append(items) or len(items), [1, 2, 3])
+  assert not calls
+  assert f'{lazy}' == '3'
+  assert calls == [[1, 2, 3]]
+
+
+def test_records_point_to_the_call_site():
+  logger, handler = make_logger('test.caller')
+  SampledLogger(logger).info('Caller')
+  assert handler.records[0].funcName == 'test_records_point_to_the_call_site'
+
+
+class LokiStandIn(BaseHTTPRequestHandler):
+  pushes: list = []
+  status: int = 204
+
+  def do_POST(self):
+    body = self.rfile.read(int(self.headers['Content-Length']))
+    if self.status < 300:
+      assert self.headers['Content-Encoding'] == 'gzip'
+      self.pushes.append(json.loads(gzip.decompress(body)))
+    self.send_response(self.status)
+    self.end_headers()
+
+  def log_message(self, format, *args):
+    pass
+
+
+@pytest.fixture
+def loki():
+  handler = type('Loki', (LokiStandIn,), {'pushes': [], 'status': 204})
+  server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+  threading.Thread(target=server.serve_forever, daemon=True).start()
+  yield handler, f'http://127.0.0.1:{server.server_address[1]}/loki/api/v1/push'
+  server.shutdown()
+
+
+def make_record(message: str, level: int = logging.INFO) -> logging.LogRecord:
+  return logging.LogRecord('test.loki', level, __file__, 1, message, None, None)
+
+
+def test_loki_handler_pushes_full_batches(loki):
+  handler, url = loki
+  loki_handler = LokiHandler(url=url, labels={'app': 'test'}, batch_size=3, flush_interval=60)
+  for index in range(6):
+    loki_handler.handle(make_record(f'message {index}', logging.INFO if index % 2 else logging.WARNING))
+  deadline = time.monotonic() + 5
+  while len(handler.pushes) < 2 and time.monotonic() < deadline:
+    time.sleep(0.01)
+  loki_handler.close()
+  assert len(handler.pushes) == 2
+  streams = [stream for push in handler.pushes for stream in push['streams']]
+  assert {tuple(sorted(stream['stream'].items())) for stream in streams} == {(('app', 'test'), ('level', 'info')),
+                                                                            (('app', 'test'), ('level', 'warning'))}
+  lines = sorted(value[1] for stream in streams for value in stream['values'])
+  assert lines == [f'message {index}' for index in range(6)]
+  assert loki_handler.sent == 6
+
+
+def test_loki_handler_pushes_on_flush_interval(loki):
+  handler, url = loki
+  loki_handler = LokiHandler(url=url, batch_size=100, flush_interval=0.1)
+  loki_handler.handle(make_record('message'))
+  deadline = time.monotonic() + 5
+  while not handler.pushes and time.monotonic() < deadline:
+    time.sleep(0.01)
+  assert handler.pushes[0]['streams'][0]['values'][0][1] == 'message'
+  loki_handler.close()
+
+
+def test_loki_handler_bounds_the_buffer_and_counts_drops(loki):
+  handler, url = loki
+  handler.status = 400
+  loki_handler = LokiHandler(url=url, batch_size=100, flush_interval=60, max_buffer=5)
+  started = time.monotonic()
+  for index in range(20):
+    loki_handler.handle(make_record(f'message {index}'))
+  assert time.monotonic() - started < 1
+  assert len(loki_handler.buffer) == 5
+  assert loki_handler.dropped == 15
+  loki_handler.flush(timeout=5)
+  assert loki_handler.dropped == 20
+  assert loki_handler.failed_pushes == 1
+  assert not handler.pushes
+  loki_handler.close()
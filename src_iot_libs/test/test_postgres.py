@@ -0,0 +1,93 @@
+import psycopg
+import pytest
+import threading
+from collections import OrderedDict
+from iot_libs.postgres import EngineManager, PostgreException, is_integrity_error
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+
+def wrap(cause: BaseException) -> PostgreException:
+  try:
+    raise PostgreException('Failed to execute query') from cause
+  except PostgreException as exc:
+    return exc
+
+
+@pytest.mark.parametrize('cause', [
+    IntegrityError('insert', {}, psycopg.errors.UniqueViolation()),
+    psycopg.errors.UniqueViolation(),
+    psycopg.errors.ForeignKeyViolation(),
+])
+def test_integrity_errors_are_detected(cause):
+  assert is_integrity_error(wrap(cause))
+
+
+@pytest.mark.parametrize('cause', [
+    OperationalError('insert', {}, psycopg.errors.AdminShutdown()),
+    psycopg.errors.UndefinedTable(),
+    ValueError('Invalid connection type.'),
+])
+def test_other_errors_are_not_integrity_errors(cause):
+  assert not is_integrity_error(wrap(cause))
+
+
+class StubPool:
+
+  def checkedout(self):
+    return 0
+
+
+class StubEngine:
+
+  def __init__(self):
+    self.pool = StubPool()
+    self.disposed = False
+
+  def dispose(self):
+    self.disposed = True
+
+
+@pytest.fixture
+def manager():
+
+  class StubEngineManager(EngineManager):
+    engines = OrderedDict()
+    last_used = {}
+    leases = {}
+    lock = threading.RLock()
+    pool_size = 1
+    max_overflow = 0
+    max_connections = 2
+    idle_seconds = None
+
+    @classmethod
+    def _create_engine(cls, url):
+      return StubEngine()
+
+  return StubEngineManager
+
+
+def test_leased_engines_are_not_evicted_for_room(manager):
+  first = manager.acquire('first', url=None)
+  manager.acquire('second', url=None)
+  manager.get_engine('third', url=None)
+  assert not first.disposed
+  assert list(manager.engines) == ['first', 'second', 'third']
+  manager.release('first')
+  manager.get_engine('fourth', url=None)
+  assert first.disposed
+  assert list(manager.engines) == ['second', 'fourth']
+
+
+def test_leased_engines_are_not_evicted_when_idle(manager):
+  manager.idle_seconds = 10
+  engine = manager.acquire('tenant', url=None)
+  manager.acquire('tenant', url=None)
+  now = manager.last_used['tenant'] + 60
+  assert manager.evict_idle(now=now) == []
+  manager.release('tenant')
+  assert manager.evict_idle(now=now) == []
+  manager.release('tenant')
+  assert manager.leases == {}
+  assert manager.evict_idle(now=now) == ['tenant']
+  assert engine.disposed